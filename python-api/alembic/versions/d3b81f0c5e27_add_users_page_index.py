@@ -0,0 +1,31 @@
+"""add users page index
+
+Revision ID: d3b81f0c5e27
+Revises: cb9e6eb58c65
+Create Date: 2026-10-18 09:12:40.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3b81f0c5e27'
+down_revision: Union[str, None] = 'cb9e6eb58c65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'users_page_idx',
+        'users',
+        [sa.text("COALESCE(created_at, '-infinity'::timestamptz) DESC"), sa.text('id DESC')],
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('users_page_idx', table_name='users')
@@ -0,0 +1,47 @@
+"""add refresh token digest
+
+Revision ID: e7a42c9d1b60
+Revises: d3b81f0c5e27
+Create Date: 2026-10-18 14:02:11.540913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a42c9d1b60'
+down_revision: Union[str, None] = 'd3b81f0c5e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('user_tokens', sa.Column('refresh_token_digest', postgresql.BYTEA(), nullable=True))
+    op.execute(
+        "UPDATE user_tokens SET refresh_token_digest = sha256(convert_to(refresh_token, 'UTF8'))"
+    )
+    # Keep the newest row of any refresh token stored more than once.
+    op.execute(
+        """
+        DELETE FROM user_tokens ut
+        USING user_tokens newer
+        WHERE newer.refresh_token_digest = ut.refresh_token_digest
+        AND (newer.date, newer.id) > (ut.date, ut.id)
+        """
+    )
+    op.alter_column('user_tokens', 'refresh_token_digest', nullable=False)
+    op.create_index(
+        'user_tokens_refresh_token_digest_key',
+        'user_tokens',
+        ['refresh_token_digest'],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('user_tokens_refresh_token_digest_key', table_name='user_tokens')
+    op.drop_column('user_tokens', 'refresh_token_digest')
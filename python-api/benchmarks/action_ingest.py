@@ -0,0 +1,87 @@
+"""Benchmark: user action ingest, executemany versus binary COPY.
+
+Inserts `--rows` anonymous user actions in batches of `--batch-size`, once
+with the `executemany` statement the stream handlers used to run and once
+through `ActionsRepository` (COPY), then deletes them again.
+
+    poetry run python benchmarks/action_ingest.py postgresql://... \\
+        --rows 50000 --batch-size 500
+"""
+
+import asyncio
+import json
+import time
+import uuid
+
+import click
+import psycopg
+
+from python_api.models.actions import UserAction
+from python_api.repositories.actions import ActionsRepository
+
+INSERT_SQL = """
+INSERT INTO user_actions (action, user_id, info, occurred_at, stream_id)
+VALUES (
+    %(action)s,
+    %(user_id)s,
+    %(info)s,
+    %(occurred_at)s,
+    %(stream_id)s
+)
+"""
+
+
+async def _executemany(conn, batch: list[UserAction]):
+    dumps = [action.model_dump(mode="json", by_alias=False) for action in batch]
+    for dump in dumps:
+        dump["info"] = json.dumps(dump["info"])
+
+    async with conn.cursor() as cur:
+        await cur.executemany(INSERT_SQL, dumps)
+
+
+async def _copy(conn, batch: list[UserAction]):
+    await ActionsRepository(conn).insert_user_actions(batch)
+
+
+async def _run(dsn, rows, batch_size, method):
+    prefix = f"bench-{uuid.uuid4()}"
+    actions = [
+        UserAction(
+            action="benchmark",
+            info={"page": "/dashboard", "n": i},
+            occurred_at=int(time.time()),
+            stream_id=f"{prefix}-{i}",
+        )
+        for i in range(rows)
+    ]
+
+    async with await psycopg.AsyncConnection.connect(dsn) as conn:
+        start = time.perf_counter()
+        for i in range(0, rows, batch_size):
+            await method(conn, actions[i : i + batch_size])
+            await conn.commit()
+        elapsed = time.perf_counter() - start
+
+        await conn.execute(
+            "DELETE FROM user_actions WHERE stream_id LIKE %s", (f"{prefix}-%",)
+        )
+        await conn.commit()
+
+    return elapsed
+
+
+@click.command()
+@click.argument("dsn")
+@click.option("--rows", default=20000)
+@click.option("--batch-size", default=100, help="Stream messages per batch.")
+def action_ingest(dsn, rows, batch_size):
+    print(f"{'method':>12} {'seconds':>10} {'rows/s':>10}")
+
+    for name, method in [("executemany", _executemany), ("copy", _copy)]:
+        elapsed = asyncio.run(_run(dsn, rows, batch_size, method))
+        print(f"{name:>12} {elapsed:>10.2f} {rows / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    action_ingest()
@@ -0,0 +1,87 @@
+"""Load test: latency of an unrelated endpoint while a burst of logins runs.
+
+Probes `--probe` (a route that does no work) at a steady rate, first on an
+idle API and then while `--logins` concurrent requests hammer /login. With
+bcrypt on the event loop, the probe's p99 grows by the hash time for every
+login queued ahead of it; with hashing on the thread pool it stays flat.
+
+Run against one API worker, so the logins and the probe share an event loop:
+
+    poetry run python benchmarks/login_burst.py http://localhost:8000 \\
+        --email test@exchequer.local --password oldpassword --logins 20
+"""
+
+import asyncio
+import time
+
+import click
+import httpx
+
+
+async def _probe(client, path, duration, interval):
+    latencies: list[float] = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def _login_loop(client, email, password, deadline):
+    logins = 0
+    while time.perf_counter() < deadline:
+        response = await client.post(
+            "/login", data={"username": email, "password": password}
+        )
+        response.raise_for_status()
+        logins += 1
+    return logins
+
+
+def _report(label, latencies, logins=None):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    logins = "" if logins is None else f" {logins:>8}"
+    print(
+        f"{label:>8} {len(latencies):>8} {p50 * 1000:>8.1f}ms"
+        f" {p99 * 1000:>8.1f}ms{logins}"
+    )
+
+
+async def _run(base_url, email, password, logins, duration, probe, interval):
+    limits = httpx.Limits(max_connections=logins + 1)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        print(f"{'':>8} {'probes':>8} {'p50':>10} {'p99':>10} {'logins':>8}")
+
+        _report("idle", await _probe(client, probe, duration, interval))
+
+        deadline = time.perf_counter() + duration
+        results = await asyncio.gather(
+            _probe(client, probe, duration, interval),
+            *(_login_loop(client, email, password, deadline) for _ in range(logins)),
+        )
+        _report("burst", results[0], sum(results[1:]))
+
+
+@click.command()
+@click.argument("base_url")
+@click.option("--email", required=True)
+@click.option("--password", required=True)
+@click.option("--logins", default=20, help="Concurrent login loops.")
+@click.option("--duration", default=10.0, help="Seconds per phase.")
+@click.option("--probe", default="/test", help="Unrelated route to time.")
+@click.option("--interval", default=0.01, help="Seconds between probes.")
+def login_burst(base_url, email, password, logins, duration, probe, interval):
+    asyncio.run(
+        _run(base_url, email, password, logins, duration, probe, interval)
+    )
+
+
+if __name__ == "__main__":
+    login_burst()
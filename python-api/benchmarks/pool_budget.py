@@ -0,0 +1,81 @@
+"""Load test: query throughput at different cluster-wide connection budgets.
+
+Each simulated gunicorn worker is its own process with its own pool, sized by
+the same rule the API uses (`dependencies.pool_size`). Every worker runs
+`--concurrency` request loops that check out a connection, run `--query` and
+return it, for `--duration` seconds.
+
+    poetry run python benchmarks/pool_budget.py postgresql://... \\
+        --workers 8 --budget 16 --budget 40 --budget 120
+"""
+
+import asyncio
+import multiprocessing
+import time
+
+import click
+from psycopg_pool import AsyncConnectionPool
+
+from python_api.dependencies import pool_size
+from python_api.settings import Settings
+
+
+async def _run_worker(dsn, min_size, max_size, concurrency, duration, query):
+    pool = AsyncConnectionPool(dsn, min_size=min_size, max_size=max_size, open=False)
+    await pool.open()
+
+    ops = 0
+    waits: list[float] = []
+    deadline = time.perf_counter() + duration
+
+    async def request_loop():
+        nonlocal ops
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            async with pool.connection() as conn:
+                waits.append(time.perf_counter() - start)
+                await conn.execute(query)
+            ops += 1
+
+    await asyncio.gather(*(request_loop() for _ in range(concurrency)))
+    await pool.close()
+    return ops, waits
+
+
+def _worker(args):
+    return asyncio.run(_run_worker(*args))
+
+
+@click.command()
+@click.argument("dsn")
+@click.option("--workers", default=4, help="Simulated gunicorn workers.")
+@click.option("--budget", "budgets", multiple=True, type=int, default=[8, 20, 60])
+@click.option("--concurrency", default=50, help="In-flight requests per worker.")
+@click.option("--duration", default=10.0, help="Seconds per budget.")
+@click.option("--query", default="SELECT pg_sleep(0.002)")
+def pool_budget(dsn, workers, budgets, concurrency, duration, query):
+    print(f"{'budget':>8} {'per worker':>10} {'ops/s':>10} {'p50 wait':>10} {'p99 wait':>10}")
+
+    for budget in budgets:
+        settings = Settings(
+            database_connection_budget=budget, web_concurrency=workers
+        )
+        min_size, max_size = pool_size(settings)
+
+        args = [(dsn, min_size, max_size, concurrency, duration, query)] * workers
+        with multiprocessing.Pool(workers) as procs:
+            results = procs.map(_worker, args)
+
+        total_ops = sum(ops for ops, _ in results)
+        waits = sorted(wait for _, worker_waits in results for wait in worker_waits)
+        p50 = waits[len(waits) // 2] if waits else 0
+        p99 = waits[int(len(waits) * 0.99)] if waits else 0
+
+        print(
+            f"{budget:>8} {max_size:>10} {total_ops / duration:>10.0f}"
+            f" {p50 * 1000:>8.1f}ms {p99 * 1000:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    pool_budget()
@@ -0,0 +1,61 @@
+"""Microbenchmark: per-request cost of validating an access token.
+
+Times `validate_token` on the same token with the verified-token cache
+disabled (a full RS256 verification every time) and enabled.
+
+    poetry run python benchmarks/token_cache.py --iterations 5000
+"""
+
+import tempfile
+import time
+
+import click
+from jwcrypto import jwk
+
+from python_api import signing_keys, token_cache
+from python_api.settings import Settings
+from python_api.utils import create_access_token, validate_token
+
+
+def _time(settings, token, iterations):
+    signing_keys.KEY_MANAGER = None
+    token_cache.TOKEN_CACHE = None
+
+    validate_token(token, settings)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        validate_token(token, settings)
+    return (time.perf_counter() - start) / iterations
+
+
+@click.command()
+@click.option("--iterations", default=2000)
+@click.option("--key-size", default=2048)
+def token_cache_benchmark(iterations, key_size):
+    with tempfile.NamedTemporaryFile(suffix=".pem") as f:
+        key = jwk.JWK.generate(kty="RSA", size=key_size)
+        f.write(key.export_to_pem(private_key=True, password=None))
+        f.flush()
+
+        settings = Settings(jwt_signing_key=f.name)
+        token = create_access_token(
+            settings,
+            {"sub": "00000000-0000-0000-0000-000000000000", "roles": ["user"]},
+        )
+
+        uncached = _time(
+            settings.model_copy(update={"jwt_cache_size": 0}), token, iterations
+        )
+        cached = _time(settings, token, iterations)
+
+    print(f"{'cache':>8} {'us/request':>12}")
+    print(f"{'off':>8} {uncached * 1e6:>12.1f}")
+    print(f"{'on':>8} {cached * 1e6:>12.1f}")
+    print(
+        f"saved {(uncached - cached) * 1e6:.1f}us per request"
+        f" ({uncached / cached:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    token_cache_benchmark()
@@ -1,13 +1,17 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from python_api.dependencies import ValidJWTDep, EntitiesRepositoryDep
+from python_api.dependencies import (
+    ValidJWTDep,
+    EntitiesRepositoryDep,
+    read_only_postgres,
+)
 from python_api.models.entities import EntityCreate
 from python_api.models.envelopes import EnvelopeCreate
 
 router = APIRouter(prefix="/entities", tags=["entities"])
 
 
-@router.get("")
+@router.get("", dependencies=[Depends(read_only_postgres)])
 async def list_entities(jwt: ValidJWTDep, entities: EntitiesRepositoryDep):
     return await entities.get_entities_for_user(jwt["sub"])
 
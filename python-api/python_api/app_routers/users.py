@@ -24,6 +24,7 @@ from python_api.dependencies import (
     EmailGeneratorDep,
     AutomatedEmailsDep,
     TransactionsRepositoryDep,
+    read_only_postgres,
 )
 from python_api.integrations.ynab import IntegrationError, YNABConnector
 from python_api.models import CamelModel
@@ -55,7 +56,9 @@ active_user_router = APIRouter(
 public_router = APIRouter(prefix="/users", tags=["users"])
 
 
-@public_router.get("/me", response_model=UserWithInfo)
+@public_router.get(
+    "/me", response_model=UserWithInfo, dependencies=[Depends(read_only_postgres)]
+)
 async def read_users_me(current_user: CurrentActiveUserDep):
     return current_user
 
@@ -126,9 +129,11 @@ async def get_user_token(
 
     returned_token = refresh_token.credentials
 
-    token_provider, last_used = await users.get_token_provider_and_last_used(
-        refresh_token.credentials
-    )
+    # One query finds the token and its user.
+    found = await users.lookup_refresh_token(refresh_token.credentials)
+    if not found:
+        raise HTTPException(401, "Refresh Token invalid")
+    current_user, token_provider, last_used = found
 
     if token_provider == "apple":
         try:
@@ -141,19 +146,11 @@ async def get_user_token(
             else:
                 raise e
 
-        access_token = auth_res.access_token
-        # We got here, so that means the refresh token is valid and
-        # so is this access token. Regenerate the access token
-        # with one we recognize.
-
-        current_user = await users.get_user_by_refresh_token(refresh_token.credentials)
-        if current_user and current_user.restricted:
+        # We got here, so that means the refresh token is valid. Regenerate
+        # the access token with one we recognize.
+        if current_user.restricted:
             raise HTTPException(418, "Restricted user")
 
-        if not current_user:
-            print("No user found for refresh token", refresh_token.credentials)
-            raise HTTPException(401, "Refresh Token invalid")
-
         access_token = create_access_token_from_user(settings, current_user)
 
         if auth_res.refresh_token:
@@ -164,9 +161,13 @@ async def get_user_token(
 
         await users.refresh_token_used(refresh_token.credentials)
     else:
-        current_user = await users.get_user_by_refresh_token(refresh_token.credentials)
-        if current_user and current_user.restricted:
+        if current_user.restricted:
             raise HTTPException(418, "Restricted user")
+
+        access_token = create_access_token_from_user(
+            settings, current_user, fresh=False
+        )
+
         create_new = False
         if (
             last_used
@@ -175,20 +176,13 @@ async def get_user_token(
         ):
             create_new = True
 
-        if current_user:
-            access_token = create_access_token_from_user(
-                settings, current_user, fresh=False
-            )
-
-            if not create_new:
-                await users.refresh_token_used(refresh_token.credentials)
-            else:
-                token_obj = await users.insert_new_refresh_token(current_user.id)
-                returned_token = token_obj.refresh_token
+        if not create_new:
+            await users.refresh_token_used(refresh_token.credentials)
         else:
-            raise HTTPException(401, "Refresh Token invalid")
+            token_obj = await users.insert_new_refresh_token(current_user.id)
+            returned_token = token_obj.refresh_token
 
-    user = await users.get_user_with_info_by_id(str(current_user.id))
+    user = await users.get_cached_user_with_info_by_id(str(current_user.id))
 
     ret = {
         "access_token": access_token,
@@ -230,7 +224,7 @@ async def create_user(
             detail="User already exist with that email",
         )
 
-    # Hash password
+    password_hash = await users.get_password_hash(user.password)
     db_user = DbUser(
         name=user.name,
         email=user.email,
@@ -238,7 +232,7 @@ async def create_user(
         requested_billing_period=user.billing_period,
         promo=user.promo,
         is_verified=False,
-        password_hash=users.get_password_hash(user.password),
+        password_hash=password_hash,
     )
 
     try:
@@ -343,7 +337,7 @@ async def update_password(
             status_code=status.HTTP_403_FORBIDDEN, detail="Old password does not match"
         )
 
-    new_password_hash = users.get_password_hash(update_password.new_password)
+    new_password_hash = await users.get_password_hash(update_password.new_password)
 
     await users.update_password(id, new_password_hash)
 
@@ -0,0 +1,214 @@
+"""In-process memoization for repository reads.
+
+`Cache` is a bounded LRU with a TTL per entry. The async path is
+single-flight: concurrent misses for the same key wait on the one load in
+progress instead of each querying the database.
+
+Cached values are shared, so by default every hit returns a deep copy that
+the caller may modify. Pass `copy=False` for values nobody mutates. Frozen
+pydantic models, tuples and scalars are never copied.
+
+The `cache` and `async_cache` decorators are re-exported from
+`python_api.repositories`.
+"""
+
+import asyncio
+import copy as copylib
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from pydantic import BaseModel
+
+from python_api import metrics
+
+CACHE_LOOKUPS = metrics.Counter(
+    "exchequer_cache_lookups_total",
+    "Repository cache lookups, by cache and result.",
+)
+
+CACHE_ENTRIES = metrics.Gauge(
+    "exchequer_cache_entries",
+    "Entries held by each repository cache.",
+)
+
+CACHES: dict[str, "Cache"] = {}
+
+_IMMUTABLE = (str, bytes, int, float, bool, type(None), frozenset)
+
+
+def _is_immutable(value) -> bool:
+    if isinstance(value, _IMMUTABLE):
+        return True
+    if isinstance(value, BaseModel):
+        return bool(value.model_config.get("frozen"))
+    if isinstance(value, tuple):
+        return all(_is_immutable(item) for item in value)
+    return False
+
+
+class Cache:
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 60.0,
+        max_size: int = 1024,
+        copy: bool = True,
+        cache_none: bool = False,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.max_size = max_size
+        self.copy = copy
+        self.cache_none = cache_none
+
+        # key -> (value, time.monotonic() it expires)
+        self._entries: OrderedDict = OrderedDict()
+        self._inflight: dict = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.waits = 0
+
+        CACHES[name] = self
+
+    def _copy(self, value):
+        if not self.copy or _is_immutable(value):
+            return value
+        if isinstance(value, BaseModel):
+            return value.model_copy(deep=True)
+        if isinstance(value, list):
+            return [self._copy(item) for item in value]
+        return copylib.deepcopy(value)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return True, self._copy(value)
+
+    def _store(self, key, value):
+        if value is None and not self.cache_none:
+            return
+
+        self._entries[key] = (value, time.monotonic() + self.timeout)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _miss(self):
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+
+    def get(self, key, load):
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        self._miss()
+        value = load()
+        self._store(key, value)
+        return self._copy(value)
+
+    async def aget(self, key, load):
+        found, value = self._lookup(key)
+        if found:
+            return value
+
+        if (inflight := self._inflight.get(key)) is not None:
+            self.waits += 1
+            CACHE_LOOKUPS.inc(cache=self.name, result="wait")
+            try:
+                return self._copy(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The load we waited on failed; try our own.
+
+        self._miss()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await load()
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+        self._store(key, value)
+        return self._copy(value)
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "evictions": self.evictions,
+        }
+
+
+@metrics.on_collect
+def _collect_cache_metrics():
+    for name, _cache in CACHES.items():
+        CACHE_ENTRIES.set(len(_cache._entries), cache=name)
+
+
+def _key(args, kwargs):
+    return (tuple(args), tuple(sorted(kwargs.items())))
+
+
+def cache(timeout=60.0, max_size=1024, copy=True, name=None):
+    """Memoize a function for `timeout` seconds per argument combination."""
+
+    def _wrapped(func):
+        _cache = Cache(name or func.__qualname__, timeout, max_size, copy)
+
+        @wraps(func)
+        def _inner(*args, **kwargs):
+            return _cache.get(_key(args, kwargs), lambda: func(*args, **kwargs))
+
+        _inner.cache = _cache
+        return _inner
+
+    return _wrapped
+
+
+def async_cache(cache_key, timeout=60.0, max_size=1024, copy=True):
+    """Memoize a repository method, keyed on its arguments other than `self`."""
+
+    def _wrapped(func):
+        _cache = Cache(cache_key, timeout, max_size, copy)
+
+        @wraps(func)
+        async def _inner(*args, **kwargs):
+            return await _cache.aget(
+                _key(args[1:], kwargs), lambda: func(*args, **kwargs)
+            )
+
+        _inner.cache = _cache
+        return _inner
+
+    return _wrapped
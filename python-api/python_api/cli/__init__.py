@@ -114,17 +114,17 @@ def test_scheduled_emails(
         if not only_create:
             start_time = datetime.now().timestamp()
             total_sent = 0
-            emails = await automated_email_repo.get_due_emails()
-            for email in emails:
-                _subject, text, html = email_gen.generate_email(
-                    email.subject, email.template, **(email.variables or {})
-                )
+            async for emails in automated_email_repo.stream_due_emails():
+                for email in emails:
+                    _subject, text, html = email_gen.generate_email(
+                        email.subject, email.template, **(email.variables or {})
+                    )
 
-                if email.user_email and email.id:
-                    mailer.sendmail(email.user_email, _subject, text, html)
-                    await automated_email_repo.mark_sent(email.id)
+                    if email.user_email and email.id:
+                        mailer.sendmail(email.user_email, _subject, text, html)
+                        await automated_email_repo.mark_sent(email.id)
 
-                total_sent += 1
+                    total_sent += 1
 
             end_time = datetime.now().timestamp()
             emails_per_second = total_sent / (end_time - start_time)
@@ -142,11 +142,10 @@ def init_subscriptions():
         db = await AsyncConnection.connect(settings.database_dsn, row_factory=dict_row)
         user_repo = UserRepository(None, None, db, settings)
 
-        users, _ = await user_repo.get_users()
-
-        for user in users:
-            await user_repo.subscribe_user(str(user.id), EmailType.PROMOTIONAL)
-            await user_repo.subscribe_user(str(user.id), EmailType.TRANSACTIONAL)
+        async for users in user_repo.stream_users():
+            for user in users:
+                await user_repo.subscribe_user(str(user.id), EmailType.PROMOTIONAL)
+                await user_repo.subscribe_user(str(user.id), EmailType.TRANSACTIONAL)
         await db.commit()
 
     asyncio.run(_init_subscriptions())
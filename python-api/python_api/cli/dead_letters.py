@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, UTC
+
+import click
+from redis.asyncio import Redis
+
+from python_api.settings import Settings
+from python_api.streams import (
+    discard_dead_letter,
+    get_dead_letters,
+    replay_dead_letter,
+)
+
+
+async def _all_ids(redis: Redis, stream: str | None) -> list[str]:
+    ids, after = [], None
+    while letters := await get_dead_letters(redis, after=after):
+        ids += [letter.id for letter in letters if stream in (None, letter.stream)]
+        after = letters[-1].id
+    return ids
+
+
+@click.group()
+def dead_letters():
+    """Inspect, replay and discard stream entries that failed ingest."""
+
+
+@dead_letters.command("list")
+@click.option("--count", default=100)
+@click.option("--after", default=None, help="List dead letters after this ID.")
+def list_dead_letters(count, after):
+    async def _list():
+        redis = Redis.from_url(Settings().redis_url)
+        for letter in await get_dead_letters(redis, count=count, after=after):
+            failed_at = datetime.fromtimestamp(letter.failed_at, UTC)
+            print(
+                f"{letter.id} {letter.stream} {letter.entry_id}"
+                f" deliveries={letter.deliveries} failed_at={failed_at.isoformat()}"
+            )
+            print(f"    {letter.error}")
+        await redis.aclose()
+
+    asyncio.run(_list())
+
+
+@dead_letters.command()
+@click.argument("ids", nargs=-1)
+@click.option("--all", "replay_all", is_flag=True, default=False)
+@click.option("--stream", default=None, help="With --all, only this stream.")
+def replay(ids, replay_all, stream):
+    async def _replay():
+        settings = Settings()
+        redis = Redis.from_url(settings.redis_url)
+        for id in await _all_ids(redis, stream) if replay_all else ids:
+            entry_id = await replay_dead_letter(redis, id, settings.stream_max_length)
+            if entry_id is None:
+                print(f"No dead letter {id}")
+            else:
+                print(f"Replayed {id} as {entry_id}")
+        await redis.aclose()
+
+    asyncio.run(_replay())
+
+
+@dead_letters.command()
+@click.argument("ids", nargs=-1, required=True)
+def discard(ids):
+    async def _discard():
+        redis = Redis.from_url(Settings().redis_url)
+        for id in ids:
+            if await discard_dead_letter(redis, id):
+                print(f"Discarded {id}")
+            else:
+                print(f"No dead letter {id}")
+        await redis.aclose()
+
+    asyncio.run(_discard())
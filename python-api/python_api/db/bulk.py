@@ -0,0 +1,133 @@
+"""Bulk ingest through binary `COPY ... FROM STDIN` and multi-row INSERTs.
+
+Both skip rows that conflict with a unique constraint, so a stream consumer
+can write a redelivered batch again and only the rows it hasn't stored yet
+are added.
+
+COPY streams a whole batch in one statement, which is much faster than
+`executemany` for the append-only tables the stream consumers write. COPY
+can't skip conflicts itself, so `copy_rows` copies into a temporary staging
+table and moves the rows over with `INSERT ... SELECT ... ON CONFLICT DO
+NOTHING`. Any other constraint violation, such as a dangling foreign key,
+fails the batch; `copy_rows` then falls back to inserting row by row, each in
+its own savepoint, and skips only the rows that violate a constraint.
+
+`insert_rows` sends the rows as a few large `INSERT ... VALUES (...), (...)`
+statements instead, for callers that build rows as plain Python values.
+"""
+
+from collections.abc import Sequence
+
+from psycopg import AsyncConnection, errors, sql
+
+
+async def copy_rows(
+    conn: AsyncConnection,
+    table: str,
+    columns: Sequence[str],
+    types: Sequence[str],
+    rows: Sequence[Sequence],
+) -> int:
+    """Insert `rows` into `table`, returning how many rows were written.
+
+    `types` are the Postgres type names of `columns`, needed by binary COPY.
+    Values must already be adapted for them (e.g. `uuid.UUID`, `Jsonb`).
+    """
+    if not rows:
+        return 0
+
+    table_sql = sql.Identifier(table)
+    columns_sql = sql.SQL(", ").join(map(sql.Identifier, columns))
+    staging_sql = sql.Identifier(f"_copy_{table}")
+
+    try:
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                # Just the columns' types, none of the table's constraints.
+                await cur.execute(
+                    sql.SQL(
+                        "CREATE TEMP TABLE {} ON COMMIT DROP"
+                        " AS SELECT {} FROM {} WITH NO DATA"
+                    ).format(staging_sql, columns_sql, table_sql)
+                )
+                async with cur.copy(
+                    sql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+                        staging_sql, columns_sql
+                    )
+                ) as copy:
+                    copy.set_types(types)
+                    for row in rows:
+                        await copy.write_row(row)
+
+                await cur.execute(
+                    sql.SQL(
+                        "INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT DO NOTHING"
+                    ).format(table_sql, columns_sql, columns_sql, staging_sql)
+                )
+                inserted = cur.rowcount
+                # Dropped now rather than on commit, so the caller's transaction
+                # can copy into the same table again.
+                await cur.execute(sql.SQL("DROP TABLE {}").format(staging_sql))
+        return inserted
+    except errors.IntegrityError as e:
+        print(f"COPY into {table} failed, inserting row by row:", e)
+
+    insert_sql = sql.SQL(
+        "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT DO NOTHING"
+    ).format(
+        table_sql,
+        columns_sql,
+        sql.SQL(", ").join(sql.Placeholder() * len(columns)),
+    )
+
+    inserted = 0
+    async with conn.cursor() as cur:
+        for row in rows:
+            try:
+                async with conn.transaction():
+                    await cur.execute(insert_sql, row)
+                inserted += cur.rowcount
+            except errors.IntegrityError as e:
+                print(f"Skipping row for {table}:", e)
+
+    return inserted
+
+
+# Postgres allows at most 65535 bind parameters per statement.
+MAX_PARAMS = 65535
+
+
+async def insert_rows(
+    conn: AsyncConnection,
+    table: str,
+    columns: Sequence[str],
+    rows: Sequence[Sequence],
+) -> int:
+    """Insert `rows` with multi-row INSERTs, returning how many were written.
+
+    Errors other than conflicts fail the whole call, so wrap it in a savepoint
+    to isolate them.
+    """
+    if not rows:
+        return 0
+
+    table_sql = sql.Identifier(table)
+    columns_sql = sql.SQL(", ").join(map(sql.Identifier, columns))
+    row_sql = sql.SQL("({})").format(
+        sql.SQL(", ").join(sql.Placeholder() * len(columns))
+    )
+    chunk_size = MAX_PARAMS // len(columns)
+
+    inserted = 0
+    async with conn.cursor() as cur:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            await cur.execute(
+                sql.SQL("INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING").format(
+                    table_sql, columns_sql, sql.SQL(", ").join([row_sql] * len(chunk))
+                ),
+                [value for row in chunk for value in row],
+            )
+            inserted += cur.rowcount
+
+    return inserted
@@ -4,6 +4,7 @@ from decimal import Decimal
 from typing import Any
 from sqlalchemy.dialects.postgresql import (
     BOOLEAN,
+    BYTEA,
     INTEGER,
     FLOAT,
     INTERVAL,
@@ -36,6 +37,7 @@ from sqlalchemy import (
     BIGINT,
     NUMERIC,
     ForeignKey,
+    Index,
     Integer,
     Sequence,
     sql,
@@ -124,6 +126,16 @@ class User(Base):
 
     integrations: Mapped[dict[str, Any]] = mapped_column(JSONB, nullable=True)
 
+    __table_args__ = (
+        # Keyset pagination of the admin user list, newest first.
+        Index(
+            "users_page_idx",
+            text("COALESCE(created_at, '-infinity'::timestamptz) DESC"),
+            text("id DESC"),
+            postgresql_where=text("deleted_at IS NULL"),
+        ),
+    )
+
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
@@ -195,6 +207,8 @@ class UserToken(Base):
 
     id: Str = text_column(primary_key=True)
     refresh_token: Str = text_column()
+    # sha256 of refresh_token, which lookups go through.
+    refresh_token_digest: Mapped[bytes] = mapped_column(BYTEA)
     provider: Mapped[TokenProvider] = mapped_column(TOKEN_PROVIDER)
     user_id = user_id_fkey(
         "user_tokens_user_id_fkey", ondelete="CASCADE", nullable=False
@@ -210,6 +224,14 @@ class UserToken(Base):
         nullable=True,
     )
 
+    __table_args__ = (
+        Index(
+            "user_tokens_refresh_token_digest_key",
+            "refresh_token_digest",
+            unique=True,
+        ),
+    )
+
 
 class ErrorLog(Base):
     __tablename__ = "error_log"
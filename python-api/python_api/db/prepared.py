@@ -0,0 +1,66 @@
+"""Registry of server-side prepared statements for our hottest queries.
+
+Statements are registered at import time with `prepared()`. Repositories run
+them with `PreparedStatement.execute()`, which asks psycopg to prepare them on
+their first run on each connection instead of after `prepare_threshold` runs.
+From then on that connection binds the parameters to the prepared plan, so
+the parse and plan cost is paid once per connection.
+
+Connections with `prepare_threshold=None`, i.e. the pools behind pgbouncer,
+never prepare anything and run the plain SQL. A statement that fails to
+prepare fails like any other query, without affecting the connection's other
+statements.
+"""
+
+import weakref
+
+from psycopg import AsyncConnection, AsyncCursor
+
+STATEMENTS: dict[str, "PreparedStatement"] = {}
+
+ENABLED = True
+
+
+class PreparedStatement:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+        # Prepared statements are per session, so remember which connections
+        # have this one. Approximate: psycopg may evict it from a connection
+        # that has prepared more than `prepared_max` statements.
+        self._connections: "weakref.WeakSet[AsyncConnection]" = weakref.WeakSet()
+
+        self.hits = 0
+        self.misses = 0
+
+    async def execute(self, cur: AsyncCursor, params: dict):
+        conn = cur.connection
+        prepare = ENABLED and conn.prepare_threshold is not None
+        if prepare and conn in self._connections:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        # None leaves it to prepare_threshold, as for any other query.
+        await cur.execute(self.sql, params, prepare=prepare or None)
+        if prepare:
+            self._connections.add(conn)
+
+        return cur
+
+
+def prepared(name: str, sql: str) -> PreparedStatement:
+    if name in STATEMENTS:
+        raise ValueError(f"Prepared statement {name} is already registered")
+
+    statement = PreparedStatement(name, sql)
+    STATEMENTS[name] = statement
+    return statement
+
+
+def get_stats() -> dict[str, dict[str, int]]:
+    return {
+        name: {"hits": statement.hits, "misses": statement.misses}
+        for name, statement in STATEMENTS.items()
+    }
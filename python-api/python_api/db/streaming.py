@@ -0,0 +1,28 @@
+"""Streaming large result sets through named server-side cursors.
+
+Postgres keeps the result on its side and we fetch it `chunk_size` rows at a
+time, so walking every subscriber or every due email uses constant memory no
+matter how many rows match.
+"""
+
+import uuid
+from collections.abc import AsyncIterator
+
+from psycopg.rows import DictRow
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+async def stream_rows(
+    db, sql, params=None, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> AsyncIterator[list[DictRow]]:
+    """Yield the rows of `sql` in lists of at most `chunk_size`.
+
+    `db` is a plain connection or a `LazyConnectionContextManagerAsync`. The
+    cursor lives as long as the iteration, so other statements can run on the
+    same connection between chunks.
+    """
+    async with db.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+        await cur.execute(sql, params)
+        while rows := await cur.fetchmany(chunk_size):
+            yield rows
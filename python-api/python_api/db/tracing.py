@@ -0,0 +1,240 @@
+"""Per-query latency tracing and the slow-query log.
+
+`LazyConnectionContextManagerAsync` hands repositories a `TracedCursor`, which
+times every execute/executemany/fetch* and row iteration, and tags it with the
+route and the repository method that issued it. Statements queued inside a
+pipeline aren't timed, since they return before the server has run them; the
+fetch or sync that waits for them is. Statements slower than the configured
+threshold are buffered in a `SlowQueryLog` and written to `error_log` in
+batches, off the request path: whenever a batch fills, and by the API's
+periodic flusher so a quiet worker doesn't hold them indefinitely.
+"""
+
+import asyncio
+import json
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from datetime import datetime, UTC
+from logging import WARNING
+
+from psycopg import AsyncCursor, pq
+from psycopg_pool import AsyncConnectionPool
+
+from python_api.metrics import Histogram
+
+QUERY_TIME = Histogram(
+    "exchequer_db_query_seconds",
+    "Time spent in cursor calls, by route, repository method and operation.",
+)
+
+MAX_QUERY_LENGTH = 2000
+
+
+def _repository_method(depth: int = 2) -> str:
+    """Name the first caller outside the db layer, e.g. UserRepository.get_user."""
+    frame = sys._getframe(depth)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("python_api.") and not module.startswith("python_api.db"):
+            return frame.f_code.co_qualname
+        frame = frame.f_back
+    return "unknown"
+
+
+def _normalize(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    return " ".join(str(query).split())[:MAX_QUERY_LENGTH]
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        threshold_ms: float,
+        batch_size: int = 50,
+    ):
+        self.pool = pool
+        self.threshold_ms = threshold_ms
+        self.batch_size = batch_size
+
+        self._entries: list[dict] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    def is_slow(self, elapsed: float) -> bool:
+        return bool(self.threshold_ms) and elapsed * 1000 >= self.threshold_ms
+
+    def add(self, route: str, method: str, op: str, query, elapsed: float):
+        # Parameters are deliberately left out; they carry emails and tokens.
+        self._entries.append(
+            {
+                "user_id": None,
+                "severity": WARNING,
+                "type": "slow-query",
+                "created_at": datetime.now(UTC),
+                "endpoint": route,
+                "status_code": None,
+                "details": json.dumps(
+                    {
+                        "method": method,
+                        "op": op,
+                        "durationMs": round(elapsed * 1000, 2),
+                        "query": _normalize(query),
+                    }
+                ),
+            }
+        )
+
+        if len(self._entries) >= self.batch_size:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Wait for flushes in flight, then write whatever is left."""
+        await asyncio.gather(*self._tasks)
+        await self.flush()
+
+    async def flush(self):
+        entries, self._entries = self._entries, []
+        if not entries:
+            return
+
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(
+                        """
+                        INSERT INTO error_log
+                        (user_id, severity, type, created_at, endpoint, status_code, details)
+                        VALUES
+                        (
+                        %(user_id)s,
+                        %(severity)s,
+                        %(type)s,
+                        %(created_at)s,
+                        %(endpoint)s,
+                        %(status_code)s,
+                        %(details)s
+                        )
+                        """,
+                        entries,
+                    )
+        except Exception as e:
+            print("Could not write slow queries:", e)
+
+
+class TracedCursor:
+    """Times cursor calls, delegating everything else to the psycopg cursor."""
+
+    def __init__(
+        self,
+        cursor: AsyncCursor,
+        route: str,
+        slow_query_log: SlowQueryLog | None = None,
+        run: Callable[[Callable[[], Awaitable] | None], Awaitable] | None = None,
+    ):
+        self._cursor = cursor
+        self._route = route
+        self._slow_query_log = slow_query_log
+        self._query = None
+        # Runs each statement, so the connection wrapper can send what it
+        # owes the server (the RLS context) along with the first one.
+        self._run = run
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __aiter__(self):
+        return self._iterate(_repository_method(1))
+
+    async def _iterate(self, method: str):
+        # Only the time spent waiting on rows counts, not the loop body.
+        rows = self._cursor.__aiter__()
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = await anext(rows)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield row
+        finally:
+            self._observe("iterate", elapsed, method)
+
+    async def _statement(self, statement: Callable[[], Awaitable] | None):
+        if self._run is not None:
+            await self._run(statement)
+        elif statement is not None:
+            await statement()
+
+    def _pipelined(self) -> bool:
+        status = self._cursor.connection.pgconn.pipeline_status
+        return status != pq.PipelineStatus.OFF
+
+    def _record(self, op: str, start: float):
+        self._observe(op, time.perf_counter() - start, _repository_method(3))
+
+    def _observe(self, op: str, elapsed: float, method: str):
+        QUERY_TIME.observe(elapsed, route=self._route, method=method, op=op)
+
+        if self._slow_query_log and self._slow_query_log.is_slow(elapsed):
+            self._slow_query_log.add(self._route, method, op, self._query, elapsed)
+
+    async def execute(self, query, params=None, **kwargs):
+        self._query = query
+        pipelined = self._pipelined()
+        start = time.perf_counter()
+        try:
+            await self._statement(
+                lambda: self._cursor.execute(query, params, **kwargs)
+            )
+        finally:
+            if not pipelined:
+                self._record("execute", start)
+        return self
+
+    async def executemany(self, query, params_seq, **kwargs):
+        self._query = query
+        pipelined = self._pipelined()
+        start = time.perf_counter()
+        try:
+            await self._statement(
+                lambda: self._cursor.executemany(query, params_seq, **kwargs)
+            )
+        finally:
+            if not pipelined:
+                self._record("executemany", start)
+
+    @asynccontextmanager
+    async def copy(self, statement, params=None, **kwargs):
+        # COPY can't share a pipeline; whatever is owed goes out first.
+        await self._statement(None)
+        async with self._cursor.copy(statement, params, **kwargs) as copy:
+            yield copy
+
+    async def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.fetchone()
+        finally:
+            self._record("fetchone", start)
+
+    async def fetchmany(self, size: int = 0):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.fetchmany(size)
+        finally:
+            self._record("fetchmany", start)
+
+    async def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return await self._cursor.fetchall()
+        finally:
+            self._record("fetchall", start)
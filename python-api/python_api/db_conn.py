@@ -1,60 +1,338 @@
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextvars import ContextVar
 from psycopg import AsyncConnection as AsyncConnectionGeneric, AsyncCursor
+from psycopg import AsyncPipeline
 from psycopg.rows import DictRow
 import psycopg_pool
 from psycopg_pool import AsyncConnectionPool
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+import time
+
+from python_api.db.tracing import SlowQueryLog, TracedCursor
+from python_api.metrics import Counter, Gauge, Histogram
 
 
 CONN_REF_COUNT = 0
 
+# Round trips avoided since startup, by reason. Each request's own count is
+# kept on its LazyConnectionContextManagerAsync.round_trips_saved.
+ROUND_TRIPS_SAVED = {
+    "begin": 0,
+    "commit": 0,
+}
+
+CHECKOUT_WAIT = Histogram(
+    "exchequer_db_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection.",
+)
+HOLD_TIME = Histogram(
+    "exchequer_db_connection_hold_seconds",
+    "Time a request holds a pooled connection, from checkout to return.",
+)
+POOL_TIMEOUTS = Counter(
+    "exchequer_db_pool_timeouts_total",
+    "Checkouts that gave up waiting for a pooled connection.",
+)
+CONNECTIONS_IN_USE = Gauge(
+    "exchequer_db_connections_in_use",
+    "Connections currently checked out by requests in this worker.",
+)
+ROUND_TRIPS_SAVED_TOTAL = Counter(
+    "exchequer_db_round_trips_saved_total",
+    "Postgres round trips avoided by pipelining and read-only connections.",
+)
+
 AsyncConnection = AsyncConnectionGeneric[DictRow]
 
+_REPLICA_SAFE: ContextVar[bool] = ContextVar("replica_safe", default=False)
+
+
+@contextmanager
+def replica_scope():
+    """Mark reads issued inside the block as safe to serve from the replica."""
+    token = _REPLICA_SAFE.set(True)
+    try:
+        yield
+    finally:
+        _REPLICA_SAFE.reset(token)
+
 
 class LazyConnectionContextManagerAsync:
     def __init__(
-        self, conn_pool: AsyncConnectionPool[AsyncConnection], jwt: dict | None
+        self,
+        conn_pool: AsyncConnectionPool[AsyncConnection],
+        jwt: dict | None,
+        read_only: bool = False,
+        replica_pool: AsyncConnectionPool[AsyncConnection] | None = None,
+        route: str = "",
+        transaction_pooling: bool = False,
+        slow_query_log: SlowQueryLog | None = None,
     ):
         self.conn_pool = conn_pool
         self.conn: AsyncConnection | None = None
         self._jwt = jwt
 
+        # Read-only connections run in autocommit, so there is no BEGIN or
+        # COMMIT to send. Only takes effect if set before the first query.
+        self.read_only = read_only
+        # Behind a transaction pooler (pgbouncer) session state is not ours to
+        # keep, so every connection runs in a transaction and the RLS context
+        # is always transaction-local.
+        self.transaction_pooling = transaction_pooling
+        self.round_trips_saved = 0
+
+        self.replica_pool = replica_pool
+        self.replica_conn: AsyncConnection | None = None
+        # Once the primary may hold this request's writes, replica-safe reads
+        # go to the primary too so the request always reads its own writes.
+        self._may_have_written = False
+
+        # Used to label pool and query metrics.
+        self.route = route
+        self.slow_query_log = slow_query_log
+        self._checked_out_at: dict[int, float] = {}
+
+        self._after_commit: list[Callable[[], Awaitable]] = []
+        # Connections, by id, whose RLS context hasn't been sent yet, and the
+        # read-only ones that hold it for the session.
+        self._context_pending: set[int] = set()
+        self._session_context: set[int] = set()
+
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        global CONN_REF_COUNT
+        try:
+            if self.conn is not None:
+                conn, self.conn = self.conn, None
+                await self._release(conn, self.conn_pool, "primary")
+        finally:
+            if self.replica_conn is not None and self.replica_pool is not None:
+                conn, self.replica_conn = self.replica_conn, None
+                await self._release(conn, self.replica_pool, "replica")
 
-        if self.conn is not None:
-            CONN_REF_COUNT -= 1
-            await self.conn.commit()  # Prevent rollback notifications
-            await self.conn_pool.putconn(self.conn)
-            self.conn = None
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                print("After-commit callback failed:", e)
+
+    def after_commit(self, callback: Callable[[], Awaitable]):
+        """Run `callback()` once the request's writes are committed.
+
+        Anything that tells other workers about a write, like a cache
+        invalidation, must wait for this; before the commit they would only
+        read the old rows again.
+        """
+        self._after_commit.append(callback)
 
     async def rollback(self):
         if self.conn is not None:
             await self.conn.rollback()
+            # A transaction-local context went with the transaction.
+            if not self.conn.autocommit:
+                self._context_pending.add(id(self.conn))
+
+    def _saved(self, reason: str):
+        ROUND_TRIPS_SAVED[reason] += 1
+        ROUND_TRIPS_SAVED_TOTAL.inc(reason=reason)
+        self.round_trips_saved += 1
+
+    async def _getconn(
+        self,
+        pool: AsyncConnectionPool[AsyncConnection],
+        read_only: bool,
+        pool_name: str,
+    ) -> AsyncConnection:
+        global CONN_REF_COUNT
+
+        conn = None
+        start = time.perf_counter()
+        try:
+            conn = await pool.getconn()
+            CONN_REF_COUNT += 1
+            CONNECTIONS_IN_USE.inc(pool=pool_name)
+        except psycopg_pool.PoolTimeout:
+            POOL_TIMEOUTS.inc(pool=pool_name, route=self.route)
+            print("Pool timeout:", pool.get_stats())
+
+        checked_out_at = time.perf_counter()
+        CHECKOUT_WAIT.observe(
+            checked_out_at - start, pool=pool_name, route=self.route
+        )
+
+        if conn is None:
+            raise RuntimeError("Connection is not available")
+
+        self._checked_out_at[id(conn)] = checked_out_at
+        self._context_pending.add(id(conn))
+
+        if read_only and not self.transaction_pooling:
+            await conn.set_autocommit(True)
+            # Autocommit never sends BEGIN.
+            self._saved("begin")
+
+        return conn
+
+    async def _release(
+        self,
+        conn: AsyncConnection,
+        pool: AsyncConnectionPool[AsyncConnection],
+        pool_name: str,
+    ):
+        global CONN_REF_COUNT
+
+        CONN_REF_COUNT -= 1
+        CONNECTIONS_IN_USE.dec(pool=pool_name)
+        self._context_pending.discard(id(conn))
+        try:
+            if conn.autocommit:
+                if id(conn) in self._session_context:
+                    # The next borrower, including code that takes the pool
+                    # directly, must not inherit the context. This costs
+                    # the round trip the skipped COMMIT saved.
+                    await conn.execute("RESET app.current_user_id")
+                else:
+                    self._saved("commit")
+                await conn.set_autocommit(False)
+            else:
+                await conn.commit()  # Prevent rollback notifications
+        except BaseException:
+            # Whatever state it was left in, it's not fit for another request;
+            # the pool discards closed connections.
+            await conn.close()
+            raise
+        finally:
+            self._session_context.discard(id(conn))
+            await pool.putconn(conn)
+
+            checked_out_at = self._checked_out_at.pop(id(conn), None)
+            if checked_out_at is not None:
+                HOLD_TIME.observe(
+                    time.perf_counter() - checked_out_at,
+                    pool=pool_name,
+                    route=self.route,
+                )
+
+    def _use_replica(self) -> bool:
+        replica_safe = _REPLICA_SAFE.get()
+        if not replica_safe and not self.read_only:
+            self._may_have_written = True
+
+        return (
+            replica_safe
+            and self.replica_pool is not None
+            and not self._may_have_written
+        )
+
+    async def _checkout(self, replica: bool = False) -> tuple[AsyncConnection, bool]:
+        """Return the request's connection and whether it was just checked out."""
+        if replica and self.replica_pool is not None:
+            if self.replica_conn is not None:
+                return self.replica_conn, False
+
+            # The replica only ever serves reads, so it always takes the
+            # read-only path.
+            self.replica_conn = await self._getconn(
+                self.replica_pool, True, "replica"
+            )
+            return self.replica_conn, True
+
+        if self.conn is not None:
+            return self.conn, False
+
+        self.conn = await self._getconn(self.conn_pool, self.read_only, "primary")
+        return self.conn, True
+
+    def _user_id(self) -> str | None:
+        user_id = self._jwt.get("sub") if self._jwt is not None else None
+        return str(user_id) if user_id else None
+
+    async def _set_context(self, conn: AsyncConnection, user_id: str):
+        """Send the RLS user context: for the transaction, or the session on a
+        read-only connection, where it's reset on release."""
+        await conn.execute(
+            "SELECT set_config('app.current_user_id', %s, %s);",
+            (user_id, not conn.autocommit),
+        )
+        if conn.autocommit:
+            self._session_context.add(id(conn))
+
+    async def _run_first(
+        self, conn: AsyncConnection, statement: Callable[[], Awaitable] | None
+    ):
+        """Run `statement()`, sending the RLS context first if it's still due.
+
+        BEGIN, the context and the statement share one flight. The pipeline
+        is synced before this returns, so the statement's errors and rowcount
+        are there as if it had run alone. Without a statement, e.g. before a
+        COPY, the context goes out on its own.
+        """
+        if id(conn) not in self._context_pending:
+            if statement is not None:
+                await statement()
+            return
+
+        self._context_pending.discard(id(conn))
+        user_id = self._user_id()
+        if statement is None:
+            if user_id:
+                await self._set_context(conn, user_id)
+            return
+
+        if not user_id and conn.autocommit:
+            await statement()
+            return
+
+        async with conn.pipeline():
+            if user_id:
+                await self._set_context(conn, user_id)
+            await statement()
+        if not conn.autocommit:
+            self._saved("begin")
 
     @asynccontextmanager
     async def cursor(
         self, *args, **kwargs
     ) -> AsyncGenerator[AsyncCursor[DictRow], None]:
-        global CONN_REF_COUNT
-        if self.conn is None:
-            try:
-                self.conn = await self.conn_pool.getconn()
-                if self._jwt is not None:
-                    async with self.conn.cursor() as cursor:
-                        await self.conn.execute(
-                            "SELECT set_config('app.current_user_id', %s, true);",
-                            (self._jwt.get("sub"),),
-                        )
-                CONN_REF_COUNT += 1
-            except psycopg_pool.PoolTimeout:
-                print("Pool timeout:", self.conn_pool.get_stats())
-
-        if self.conn is None:
-            raise RuntimeError("Connection is not available")
+        conn, _ = await self._checkout(self._use_replica())
+
+        if kwargs.get("name"):
+            # Server-side cursors can't run in pipeline mode, so the context
+            # goes out on its own. Outside a transaction the cursor must be
+            # WITH HOLD to outlive its DECLARE.
+            await self._run_first(conn, None)
+            if conn.autocommit:
+                kwargs.setdefault("withhold", True)
+
+        async with conn.cursor(*args, **kwargs) as cursor:
+            yield TracedCursor(  # pyright: ignore
+                cursor,
+                self.route,
+                self.slow_query_log,
+                lambda statement: self._run_first(conn, statement),
+            )
+
+    @asynccontextmanager
+    async def pipeline(self) -> AsyncGenerator[AsyncPipeline, None]:
+        """Send every statement issued inside the block in a single network flight.
+
+        Statements are queued instead of waiting on their results, so a unit of
+        work only pays one round trip. Fetching a result inside the block forces
+        a sync, so keep reads that later statements depend on outside of it.
+        Mirrors `AsyncConnection.pipeline()`, so repositories can use it with
+        either the lazy wrapper or a plain connection.
+        """
+        if not self.read_only:
+            self._may_have_written = True
 
-        async with self.conn.cursor(*args, **kwargs) as cursor:
-            yield cursor
+        conn, _ = await self._checkout()
+        async with conn.pipeline() as pipeline:
+            if id(conn) in self._context_pending:
+                self._context_pending.discard(id(conn))
+                if user_id := self._user_id():
+                    await self._set_context(conn, user_id)
+                if not conn.autocommit:
+                    self._saved("begin")
+            yield pipeline
@@ -1,5 +1,4 @@
-from datetime import datetime, timedelta, timezone
-import json
+from datetime import datetime, timezone
 import asyncio
 import traceback
 from typing import Annotated, Any
@@ -9,7 +8,7 @@ from jwcrypto.common import JWException
 import os
 import stripe
 
-from fastapi import Header, Query, Request, status, Response
+from fastapi import BackgroundTasks, Header, Query, Request, status, Response
 from python_api.integrations.ynab import YNABConnector
 from python_api.sso import InvalidIDToken
 
@@ -21,13 +20,15 @@ from fastapi import Depends
 from fastapi.exceptions import HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import HTTPBearer
-import httpx
 from psycopg.rows import DictRow, dict_row
 from psycopg import AsyncConnection
 from jwcrypto import jwk, jwt
 from jwcrypto.jws import InvalidJWSSignature
 
 from python_api.db_conn import LazyConnectionContextManagerAsync
+from python_api.db import prepared
+from python_api.db.tracing import SlowQueryLog
+from python_api import metrics
 
 from python_api.mail import EmailGenerator, Mailer
 from python_api.repositories.users import UserRepository
@@ -35,13 +36,16 @@ from python_api.repositories.automated_emails import AutomatedEmails
 from python_api.repositories.transactions import TransactionsRepository
 from python_api.repositories.entities import EntitiesRepository
 from python_api.tracking import Tracking
-from python_api.utils import load_key, validate_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from python_api.redis_pool import redis_client
+from python_api.user_status import UserStatusCache, user_status_cache
+from python_api.utils import validate_token, ACCESS_TOKEN_EXPIRE_MINUTES
 
 
 from python_api.models.users import User, UserWithInfo, YNABIntegration
 
 from python_api.services.bucket import FileBucket
 from python_api.sso.apple import AppleSSO
+from python_api.sso.jwks import APPLE_JWKS, GOOGLE_JWKS
 
 from .settings import Settings
 
@@ -71,10 +75,7 @@ SettingsDep = Annotated[Settings, Depends(settings)]
 
 
 async def redis(settings: SettingsDep):
-    redis = await Redis.from_url(settings.redis_url)
-
-    yield redis
-    await redis.aclose()
+    return redis_client(settings)
 
 
 async def mailer(settings: SettingsDep):
@@ -86,23 +87,75 @@ async def email_generator(settings: SettingsDep):
     return EmailGenerator(settings)
 
 
+async def user_status(settings: SettingsDep):
+    return user_status_cache(settings)
+
+
 MailerDep = Annotated[Mailer, Depends(mailer)]
 EmailGeneratorDep = Annotated[EmailGenerator, Depends(email_generator)]
 RedisDep = Annotated[Redis, Depends(redis)]
+UserStatusDep = Annotated[UserStatusCache, Depends(user_status)]
 
 CONN_POOL = None
 ASYNC_CONN_POOL = None
+ASYNC_REPLICA_CONN_POOL = None
+SLOW_QUERY_LOG = None
+
+
+# Connections each worker keeps for the sync pool, out of its budget share.
+# Only startup and maintenance code uses it, one statement at a time.
+SYNC_POOL_SIZE = 1
+
+
+def pool_size(settings: Settings, sync: bool = False) -> tuple[int, int]:
+    """Return this worker's (min_size, max_size) for a database pool.
+
+    Each worker's share of `database_connection_budget` is split between
+    its async pool, which serves requests, and a sync pool of
+    SYNC_POOL_SIZE. Raises ValueError if a share can't hold both.
+    """
+    if not settings.database_connection_budget:
+        return 1, 15
+
+    workers = max(settings.web_concurrency, 1)
+    share = settings.database_connection_budget // workers
+    if share < SYNC_POOL_SIZE + 1:
+        raise ValueError(
+            f"database_connection_budget={settings.database_connection_budget}"
+            f" is too small for {workers} workers; each needs at least"
+            f" {SYNC_POOL_SIZE + 1} connections"
+        )
+
+    if sync:
+        return 1, SYNC_POOL_SIZE
+    return 1, share - SYNC_POOL_SIZE
+
+
+def pool_kwargs(settings: Settings, sync: bool = False) -> dict[str, Any]:
+    min_size, max_size = pool_size(settings, sync)
+    connection_kwargs: dict[str, Any] = {"row_factory": dict_row}
+    if settings.database_pgbouncer:
+        # Server-side prepared statements are per session; with transaction
+        # pooling the next statement may land on another server connection.
+        connection_kwargs["prepare_threshold"] = None
+
+    return {
+        "kwargs": connection_kwargs,
+        "min_size": min_size,
+        "max_size": max_size,
+        "open": False,
+    }
+
+
+def _async_pool(settings: Settings, dsn: str):
+    return psycopg_pool.AsyncConnectionPool(dsn, **pool_kwargs(settings))
 
 
 async def conn_pool(settings: SettingsDep):
     global CONN_POOL
     if CONN_POOL is None:
         CONN_POOL = ConnectionPool(
-            settings.database_dsn,
-            kwargs={"row_factory": dict_row},
-            min_size=1,
-            max_size=15,
-            open=False,
+            settings.database_dsn, **pool_kwargs(settings, sync=True)
         )
         CONN_POOL.open()
 
@@ -112,22 +165,105 @@ async def conn_pool(settings: SettingsDep):
 async def async_conn_pool(settings_dep: SettingsDep):
     global ASYNC_CONN_POOL
     if ASYNC_CONN_POOL is None:
-        ASYNC_CONN_POOL = psycopg_pool.AsyncConnectionPool(
-            settings_dep.database_dsn,
-            kwargs={"row_factory": dict_row},
-            min_size=1,
-            max_size=15,
-            open=False,
-        )
+        ASYNC_CONN_POOL = _async_pool(settings_dep, settings_dep.database_dsn)
         await ASYNC_CONN_POOL.open()
 
     return ASYNC_CONN_POOL
 
 
+async def async_replica_conn_pool(settings_dep: SettingsDep):
+    global ASYNC_REPLICA_CONN_POOL
+    if not settings_dep.database_replica_dsn:
+        return None
+
+    if ASYNC_REPLICA_CONN_POOL is None:
+        ASYNC_REPLICA_CONN_POOL = _async_pool(
+            settings_dep, settings_dep.database_replica_dsn
+        )
+        await ASYNC_REPLICA_CONN_POOL.open()
+
+    return ASYNC_REPLICA_CONN_POOL
+
+
 ConnPoolDep = Annotated[ConnectionPool, Depends(conn_pool)]
 AsyncConnPoolDep = Annotated[
     psycopg_pool.AsyncConnectionPool[AsyncConnection[DictRow]], Depends(async_conn_pool)
 ]
+AsyncReplicaConnPoolDep = Annotated[
+    psycopg_pool.AsyncConnectionPool[AsyncConnection[DictRow]] | None,
+    Depends(async_replica_conn_pool),
+]
+
+
+async def slow_query_log(conn_pool: AsyncConnPoolDep, settings_dep: SettingsDep):
+    global SLOW_QUERY_LOG
+    if SLOW_QUERY_LOG is None:
+        SLOW_QUERY_LOG = SlowQueryLog(
+            conn_pool,
+            settings_dep.slow_query_threshold_ms,
+            batch_size=settings_dep.slow_query_batch_size,
+        )
+
+    return SLOW_QUERY_LOG
+
+
+_slow_query_flusher: asyncio.Task | None = None
+
+
+async def _flush_slow_queries(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        if SLOW_QUERY_LOG is not None:
+            await SLOW_QUERY_LOG.flush()
+
+
+def start_slow_query_flusher(settings: Settings):
+    """Write buffered slow queries every slow_query_flush_interval seconds."""
+    global _slow_query_flusher
+    _slow_query_flusher = asyncio.create_task(
+        _flush_slow_queries(settings.slow_query_flush_interval)
+    )
+
+
+async def stop_slow_query_flusher():
+    global _slow_query_flusher
+    if _slow_query_flusher is not None:
+        _slow_query_flusher.cancel()
+        try:
+            await _slow_query_flusher
+        except asyncio.CancelledError:
+            pass
+        _slow_query_flusher = None
+
+    if SLOW_QUERY_LOG is not None:
+        await SLOW_QUERY_LOG.close()
+
+
+SlowQueryLogDep = Annotated[SlowQueryLog, Depends(slow_query_log)]
+
+
+POOL_STATS = metrics.Gauge(
+    "exchequer_db_pool_stats",
+    "psycopg_pool statistics, one series per pool and stat.",
+)
+PREPARED_EXECUTIONS = metrics.Gauge(
+    "exchequer_db_prepared_executions",
+    "Executions of registered prepared statements, by statement and result.",
+)
+
+
+@metrics.on_collect
+def _collect_db_metrics():
+    pools = {"primary": ASYNC_CONN_POOL, "replica": ASYNC_REPLICA_CONN_POOL}
+    for pool_name, pool in pools.items():
+        if pool is None:
+            continue
+        for stat, value in pool.get_stats().items():
+            POOL_STATS.set(value, pool=pool_name, stat=stat)
+
+    for name, stats in prepared.get_stats().items():
+        PREPARED_EXECUTIONS.set(stats["hits"], statement=name, result="hit")
+        PREPARED_EXECUTIONS.set(stats["misses"], statement=name, result="miss")
 
 
 async def optional_jwt(
@@ -171,14 +307,42 @@ async def optional_jwt(
 OptionalJWTDep = Annotated[dict | None, Depends(optional_jwt)]
 
 
-async def postgres_async(conn_pool: AsyncConnPoolDep, optional_jwt: OptionalJWTDep):
-    async with LazyConnectionContextManagerAsync(conn_pool, optional_jwt) as conn:
+async def postgres_async(
+    request: Request,
+    settings: SettingsDep,
+    conn_pool: AsyncConnPoolDep,
+    replica_pool: AsyncReplicaConnPoolDep,
+    slow_queries: SlowQueryLogDep,
+    optional_jwt: OptionalJWTDep,
+):
+    # Label metrics with the route template, never the raw path.
+    route = getattr(request.scope.get("route"), "path", "unknown")
+    async with LazyConnectionContextManagerAsync(
+        conn_pool,
+        optional_jwt,
+        replica_pool=replica_pool,
+        route=route,
+        transaction_pooling=settings.database_pgbouncer,
+        slow_query_log=slow_queries,
+    ) as conn:
         yield conn
 
 
 AsyncPostgresDep = Annotated[AsyncConnection[DictRow], Depends(postgres_async)]
 
 
+async def read_only_postgres(
+    postgres: Annotated[LazyConnectionContextManagerAsync, Depends(postgres_async)],
+):
+    """Route dependency for endpoints that never write to postgres.
+
+    The request's connection runs in autocommit, so it skips the BEGIN and
+    COMMIT round trips. Add it to the route's `dependencies` so it is resolved
+    before anything queries the database.
+    """
+    postgres.read_only = True
+
+
 async def user_errors(db: AsyncPostgresDep):
     errors = UserErrors(db)
     try:
@@ -221,7 +385,7 @@ UserRepositoryDep = Annotated[UserRepository, Depends(user_repo)]
 
 async def valid_jwt(
     optional_jwt: OptionalJWTDep,
-    redis: RedisDep,
+    user_status: UserStatusDep,
     emulated_user: str | None = Query(None),
     x_emulated_user: str | None = Header(None),
 ):
@@ -240,8 +404,7 @@ async def valid_jwt(
     if optional_jwt is None:
         raise credentials_exception
 
-    user = await redis.get(f"users:{optional_jwt['sub']}")
-    user = User(**json.loads(user)) if user else None
+    user = await user_status.get(optional_jwt["sub"])
 
     if (
         "restricted" in optional_jwt
@@ -268,54 +431,12 @@ async def bucket_storage(settings: SettingsDep):
 BucketStorageDep = Annotated[FileBucket, Depends(bucket_storage)]
 
 
-async def get_apple_keys(redis: RedisDep):
-    expiration = await redis.get("apple_keys:expiration")
-    if expiration:
-        expiration = datetime.fromisoformat(expiration.decode("utf-8"))
-
-    apple_keys = await redis.get("apple_keys:keys")
-    if apple_keys:
-        apple_keys = json.loads(apple_keys)
-
-    if not apple_keys or not expiration or expiration <= datetime.now():
-        async with httpx.AsyncClient() as client:
-            try:
-                keys_res = await client.get("https://appleid.apple.com/auth/keys")
-                keys = keys_res.json()
-                await redis.set("apple_keys:keys", json.dumps(keys["keys"]))
-                await redis.set(
-                    "apple_keys:expiration", str(datetime.now() + timedelta(hours=12))
-                )
-            except Exception:
-                print("Could not get apple keys, leaving key variables as is.")
-
-    return apple_keys
-
-
-async def get_google_keys(redis: RedisDep):
-    expiration = await redis.get("google_keys:expiration")
-    if expiration:
-        expiration = datetime.fromisoformat(expiration.decode("utf-8"))
-
-    google_keys = await redis.get("google_keys:keys")
-    if google_keys:
-        google_keys = json.loads(google_keys)
-
-    if not google_keys or not expiration or expiration <= datetime.now():
-        async with httpx.AsyncClient() as client:
-            try:
-                keys_res = await client.get(
-                    "https://www.googleapis.com/oauth2/v3/certs"
-                )
-                keys = keys_res.json()
-                await redis.set("google_keys:keys", json.dumps(keys["keys"]))
-                await redis.set(
-                    "google_keys:expiration", str(datetime.now() + timedelta(hours=6))
-                )
-            except Exception:
-                print("Could not get google keys, leaving key variables as is.")
-
-    return google_keys
+async def get_apple_keys(settings: SettingsDep):
+    return await APPLE_JWKS.get(settings)
+
+
+async def get_google_keys(settings: SettingsDep):
+    return await GOOGLE_JWKS.get(settings)
 
 
 AppleKeys = Annotated[list[dict], Depends(get_apple_keys)]
@@ -353,7 +474,7 @@ async def get_current_user(
     if user_id is None:
         raise credentials_exception
 
-    user = await users.get_user_with_info_by_id(user_id)
+    user = await users.get_cached_user_with_info_by_id(user_id)
     if user is None:
         print("no user")
         raise credentials_exception
@@ -374,9 +495,8 @@ CurrentActiveUserDep = Annotated[UserWithInfo, Depends(get_current_active_user)]
 # And these checks happen every request so they need to be fast
 
 
-async def admin(jwt: ValidJWTDep, redis: RedisDep):
-    user = await redis.get(f"users:{jwt['sub']}")
-    user = User(**json.loads(user)) if user else None
+async def admin(jwt: ValidJWTDep, user_status: UserStatusDep):
+    user = await user_status.get(jwt["sub"])
     roles = [r.value for r in user.roles] if user else []
     if roles and "admin" not in roles or "admin" not in jwt["roles"]:
         raise HTTPException(
@@ -385,9 +505,8 @@ async def admin(jwt: ValidJWTDep, redis: RedisDep):
         )
 
 
-async def editor(jwt: ValidJWTDep, redis: RedisDep):
-    user = await redis.get(f"users:{jwt['sub']}")
-    user = User(**json.loads(user)) if user else None
+async def editor(jwt: ValidJWTDep, user_status: UserStatusDep):
+    user = await user_status.get(jwt["sub"])
     roles = [r.value for r in user.roles] if user else []
     if (
         roles
@@ -460,9 +579,29 @@ TransactionsRepositoryDep = Annotated[
 ]
 
 
-async def tracking(redis: RedisDep, jwt: OptionalJWTDep):
+async def _flush_tracking(tracker: Tracking):
+    try:
+        await tracker.flush()
+    except Exception as e:
+        print("Could not publish tracked events:", e)
+
+
+async def tracking(
+    redis: RedisDep,
+    jwt: OptionalJWTDep,
+    settings: SettingsDep,
+    background_tasks: BackgroundTasks,
+):
     user_id = jwt.get("sub", None) if jwt else None
-    yield Tracking(redis, user_id)
+    tracker = Tracking(redis, user_id, settings, buffered=True)
+    # Runs once the response has been sent.
+    background_tasks.add_task(_flush_tracking, tracker)
+    try:
+        yield tracker
+    except Exception:
+        # Background tasks don't run for failed requests.
+        await _flush_tracking(tracker)
+        raise
 
 
 TrackingDep = Annotated[Tracking, Depends(tracking)]
@@ -1,4 +1,5 @@
 import asyncio
+from contextlib import asynccontextmanager
 import secrets
 import logging
 from typing import Annotated
@@ -11,7 +12,7 @@ from fastapi.exceptions import HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.openapi.utils import get_openapi
 from fastapi.openapi.docs import get_swagger_ui_html
 from httpx import HTTPStatusError
@@ -31,10 +32,16 @@ from python_api.sso import InvalidIDToken
 
 from python_api.sso.apple import AppleSSORequest
 
-from python_api import dependencies
+from python_api import dependencies, metrics
+from python_api.passwords import PasswordHasherBusy
+from python_api.redis_pool import close_redis_pool
+from python_api.sso.jwks import start_jwks_refreshers, stop_jwks_refreshers
+from python_api.streams import stream_monitor
+from python_api.user_status import close_user_status_cache
 
 from python_api.routers import (
     dashboard,
+    streams,
     users,
     admin_router,
 )
@@ -50,7 +57,25 @@ import sentry_sdk
 settings = Settings()
 
 logging.basicConfig(level=settings.log_level, force=True)
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Reject a connection budget the workers can't share before serving.
+    dependencies.pool_size(settings)
+    # Fetch the SSO providers' keys before the first login needs them.
+    start_jwks_refreshers(settings)
+    stream_monitor(settings).start(settings)
+    dependencies.start_slow_query_flusher(settings)
+    yield
+    await dependencies.stop_slow_query_flusher()
+    await stream_monitor(settings).stop(settings)
+    await stop_jwks_refreshers()
+    await close_user_status_cache()
+    await close_redis_pool()
+
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None, lifespan=lifespan)
 app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=3)
 
 if settings.sentry_dsn:
@@ -91,6 +116,16 @@ with small improvements.
 """
 
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy(_request: Request, _exc: PasswordHasherBusy):
+    # Every hashing thread is taken and the queue is full; back off and retry.
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many requests, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.get("/test", include_in_schema=False)
 async def test():
     return {"message": "Hello World2!"}
@@ -109,6 +144,21 @@ async def openapi(admin=Depends(dependencies.admin)):
     return get_openapi(title="Exchequer API", version="0.0.1", routes=app.routes)
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(
+    settings: dependencies.SettingsDep,
+    authorization: str | None = Header(None),
+):
+    if not settings.metrics_token or not secrets.compare_digest(
+        (authorization or "").encode(), f"Bearer {settings.metrics_token}".encode()
+    ):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/.well-known/keys")
 async def get_keys(settings: dependencies.SettingsDep):
     return get_jwks(settings)
@@ -572,6 +622,7 @@ app.include_router(app_router_users.public_router)
 app.include_router(app_router_users.active_user_router)
 admin_router.include_router(users.router)
 admin_router.include_router(dashboard.router)
+admin_router.include_router(streams.router)
 
 app.include_router(admin_router)
 app.include_router(app_router)
@@ -0,0 +1,153 @@
+"""Minimal Prometheus instrumentation, rendered in the text exposition format.
+
+Metrics are created at import time and registered globally, one set per
+worker process. `on_collect` callbacks run right before every scrape and are
+where point-in-time values (pool stats, queue depths) get copied into gauges.
+
+Under gunicorn each scrape is answered by whichever worker accepts it, so
+every series carries a `worker` label with that worker's pid. Prometheus then
+keeps one series per worker instead of mixing their counters into one that
+jumps back and forth; sum over `worker` for totals. A worker's series only
+advance when it answers a scrape, so scrape often enough for every worker to
+be reached. We don't share values between processes, e.g. through a
+multiprocess directory, to keep this module dependency-free.
+"""
+
+import math
+import os
+from collections.abc import Callable, Iterable
+
+_METRICS: list["Metric"] = []
+_COLLECTORS: list[Callable[[], None]] = []
+
+# Seconds. Tuned for connection checkouts and queries, which are mostly fast.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _label_key(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Iterable[tuple[str, str]]) -> str:
+    key = list(key)
+    if not key:
+        return ""
+
+    def escape(v: str):
+        return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in key) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+        _METRICS.append(self)
+
+    def samples(self) -> Iterable[tuple[str, Iterable[tuple[str, str]], float]]:
+        for key, value in self._values.items():
+            yield self.name, key, value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        worker = ("worker", str(os.getpid()))
+        for name, key, value in self.samples():
+            labels = _format_labels([worker, *key])
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, description: str, buckets: Iterable[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: dict[tuple[tuple[str, str], ...], list[int]] = {}
+        self._sums: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = _label_key(labels)
+        counts = self._counts.setdefault(key, [0] * len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._sums[key] = self._sums.get(key, 0) + value
+
+    def samples(self):
+        for key, counts in self._counts.items():
+            for bound, count in zip(self.buckets, counts):
+                yield (
+                    f"{self.name}_bucket",
+                    [*key, ("le", _format_value(bound))],
+                    count,
+                )
+            yield f"{self.name}_sum", key, self._sums[key]
+            yield f"{self.name}_count", key, counts[-1]
+
+
+def on_collect(func: Callable[[], None]):
+    """Register a callback that refreshes gauges right before each scrape."""
+    _COLLECTORS.append(func)
+    return func
+
+
+def render() -> str:
+    for collector in _COLLECTORS:
+        collector()
+
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
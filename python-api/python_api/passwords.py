@@ -0,0 +1,117 @@
+"""Password hashing off the event loop.
+
+A bcrypt hash or verify takes a few hundred milliseconds by design. Run
+inline in an async handler, it stalls every other request on the worker for
+that long. `PasswordHasher` runs them on a small thread pool instead; bcrypt
+releases the GIL while it works, so the event loop keeps serving requests.
+The pool size bounds how many hashes run at once, and the rest queue, up to
+PENDING_PER_WORKER per thread. Past that `PasswordHasherBusy` is raised,
+which the API answers with a 503, so a burst of logins fails fast instead of
+piling up requests that would time out anyway.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+from passlib.exc import UnknownHashError
+
+from python_api import metrics
+from python_api.settings import Settings
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Hashes each thread may have queued or running before new ones are refused.
+PENDING_PER_WORKER = 4
+
+PASSWORD_HASH_PENDING = metrics.Gauge(
+    "exchequer_password_hash_pending",
+    "Password hashes in this worker, by whether they are queued or running.",
+)
+PASSWORD_HASH_WAIT = metrics.Histogram(
+    "exchequer_password_hash_wait_seconds",
+    "Time password hashes spent queued for a hashing thread, by operation.",
+)
+PASSWORD_HASH_SECONDS = metrics.Histogram(
+    "exchequer_password_hash_seconds",
+    "Time spent hashing or verifying a password, by operation.",
+)
+PASSWORD_HASH_REJECTED = metrics.Counter(
+    "exchequer_password_hash_rejected_total",
+    "Password hashes refused because too many were pending, by operation.",
+)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = 2, max_pending: int | None = None):
+        self.workers = workers
+        self.max_pending = max_pending or workers * PENDING_PER_WORKER
+        # Submitted and not yet finished, queued or running.
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+
+    async def _run(self, op: str, func, *args):
+        if self.pending >= self.max_pending:
+            PASSWORD_HASH_REJECTED.inc(op=op)
+            raise PasswordHasherBusy(f"{self.pending} password hashes pending")
+
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            result = func(*args)
+            return result, started, time.perf_counter()
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, finished = await loop.run_in_executor(
+                self._executor, timed
+            )
+        finally:
+            self.pending -= 1
+
+        # Observed here rather than in the thread, so metrics are only ever
+        # touched from the event loop.
+        PASSWORD_HASH_WAIT.observe(started - submitted, op=op)
+        PASSWORD_HASH_SECONDS.observe(finished - started, op=op)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        try:
+            return await self._run(
+                "verify", pwd_context.verify, password, password_hash
+            )
+        except UnknownHashError:
+            return False
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+PASSWORD_HASHER: PasswordHasher | None = None
+
+
+def password_hasher(settings: Settings) -> PasswordHasher:
+    global PASSWORD_HASHER
+    if PASSWORD_HASHER is None:
+        PASSWORD_HASHER = PasswordHasher(settings.password_hash_workers)
+    return PASSWORD_HASHER
+
+
+@metrics.on_collect
+def _collect_password_hash_metrics():
+    pending = PASSWORD_HASHER.pending if PASSWORD_HASHER else 0
+    workers = PASSWORD_HASHER.workers if PASSWORD_HASHER else 0
+    PASSWORD_HASH_PENDING.set(min(pending, workers), state="running")
+    PASSWORD_HASH_PENDING.set(max(pending - workers, 0), state="queued")
@@ -0,0 +1,64 @@
+"""Shared Redis connection pool.
+
+Every Redis client in a process borrows connections from one pool instead of
+opening its own connection per request. Connections belong to the event loop
+that opened them, so there is one pool per running loop: one per API worker,
+and one per `asyncio.run` in the celery tasks.
+"""
+
+import asyncio
+import weakref
+
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from python_api import metrics
+from python_api.settings import Settings
+
+_POOLS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BlockingConnectionPool]" = (
+    weakref.WeakKeyDictionary()
+)
+
+REDIS_POOL_CONNECTIONS = metrics.Gauge(
+    "exchequer_redis_pool_connections",
+    "Redis pool connections in this worker, by state.",
+)
+
+
+def redis_pool(settings: Settings) -> BlockingConnectionPool:
+    loop = asyncio.get_running_loop()
+    pool = _POOLS.get(loop)
+    if pool is None:
+        # Blocking, so a burst waits up to redis_pool_timeout for a free
+        # connection instead of failing with "Too many connections".
+        pool = BlockingConnectionPool.from_url(
+            settings.redis_url,
+            max_connections=settings.redis_max_connections,
+            timeout=settings.redis_pool_timeout,
+            health_check_interval=settings.redis_health_check_interval,
+        )
+        _POOLS[loop] = pool
+
+    return pool
+
+
+def redis_client(settings: Settings) -> Redis:
+    """A client on the shared pool. Cheap to create, nothing to close."""
+    return Redis(connection_pool=redis_pool(settings))
+
+
+async def close_redis_pool():
+    """Disconnect the current loop's pool, e.g. on application shutdown."""
+    pool = _POOLS.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.aclose()
+
+
+@metrics.on_collect
+def _collect_redis_metrics():
+    in_use = idle = 0
+    for pool in list(_POOLS.values()):
+        in_use += len(pool._in_use_connections)
+        idle += len(pool._available_connections)
+
+    REDIS_POOL_CONNECTIONS.set(in_use, state="in_use")
+    REDIS_POOL_CONNECTIONS.set(idle, state="idle")
@@ -0,0 +1,49 @@
+"""Contains the ActionsRepository class, which stores tracked user actions.
+
+Actions arrive in batches from the Redis streams and are bulk loaded with COPY.
+"""
+
+import uuid
+
+from psycopg.types.json import Jsonb
+
+from python_api.db.bulk import copy_rows
+from python_api.models.actions import UserAction, UserSubscriptionAction
+
+ACTION_COLUMNS = ("action", "user_id", "info", "occurred_at", "stream_id")
+ACTION_TYPES = ("text", "uuid", "jsonb", "int8", "text")
+
+
+def _action_row(action: UserAction):
+    return (
+        action.action,
+        uuid.UUID(action.user_id) if action.user_id else None,
+        Jsonb(action.info) if action.info is not None else None,
+        action.occurred_at,
+        action.stream_id,
+    )
+
+
+class ActionsRepository:
+    def __init__(self, db):
+        self.db = db
+
+    async def insert_user_actions(self, actions: list[UserAction]) -> int:
+        return await copy_rows(
+            self.db,
+            "user_actions",
+            ACTION_COLUMNS,
+            ACTION_TYPES,
+            [_action_row(action) for action in actions],
+        )
+
+    async def insert_user_subscription_actions(
+        self, actions: list[UserSubscriptionAction]
+    ) -> int:
+        return await copy_rows(
+            self.db,
+            "user_subscription_actions",
+            ACTION_COLUMNS,
+            ACTION_TYPES,
+            [_action_row(action) for action in actions],
+        )
@@ -1,9 +1,21 @@
+from collections.abc import AsyncIterator
 from datetime import datetime
 import json
+from python_api.db.streaming import DEFAULT_CHUNK_SIZE, stream_rows
 from python_api.repositories.users import UserRepository
 from python_api.settings import Settings
 from python_api.models.emails import AutomatedEmail, EmailType
 
+DUE_EMAILS_SQL = """
+SELECT
+e.id, e.user_id, u.email AS user_email, u.roles, e.email_type,
+e.subject, e.variables, e.scheduled_at, e.sent_at, e.template
+FROM automated_emails e
+JOIN users u ON e.user_id = u.id
+WHERE sent_at IS NULL AND scheduled_at < EXTRACT(EPOCH FROM NOW())
+AND scheduled_at > EXTRACT(EPOCH FROM NOW() - INTERVAL '1 hour')
+"""
+
 
 class AutomatedEmails:
     def __init__(self, settings: Settings, db):
@@ -24,22 +36,23 @@ class AutomatedEmails:
             )
 
     async def get_due_emails(self) -> list[AutomatedEmail]:
-        sql = """
-        SELECT
-        e.id, e.user_id, u.email AS user_email, u.roles, e.email_type,
-        e.subject, e.variables, e.scheduled_at, e.sent_at, e.template
-        FROM automated_emails e
-        JOIN users u ON e.user_id = u.id
-        WHERE sent_at IS NULL AND scheduled_at < EXTRACT(EPOCH FROM NOW())
-        AND scheduled_at > EXTRACT(EPOCH FROM NOW() - INTERVAL '1 hour')
-        """
-
         async with self.db.cursor() as cur:
-            await cur.execute(sql)
+            await cur.execute(DUE_EMAILS_SQL)
             emails = await cur.fetchall()
-            if self.environment != "production":
-                emails = [e for e in emails if "admin" in e["roles"]]
-            return [AutomatedEmail.model_validate(email) for email in emails]
+            return self._due_emails(emails)
+
+    async def stream_due_emails(
+        self, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[list[AutomatedEmail]]:
+        """Like get_due_emails, but yields the emails in chunks."""
+        async for emails in stream_rows(self.db, DUE_EMAILS_SQL, None, chunk_size):
+            if due := self._due_emails(emails):
+                yield due
+
+    def _due_emails(self, emails) -> list[AutomatedEmail]:
+        if self.environment != "production":
+            emails = [e for e in emails if "admin" in e["roles"]]
+        return [AutomatedEmail.model_validate(email) for email in emails]
 
     async def mark_sent(self, email_id: int):
         async with self.db.cursor() as cur:
@@ -1,9 +1,19 @@
 from uuid import uuid4
-from . import Repository
+from . import Repository, replica_safe
 from humps import camelize
 
 from python_api.models.entities import Entity, EntityCreate
 from python_api.models.envelopes import Envelope
+from python_api.db.prepared import prepared
+
+GET_USER_ENVELOPES = prepared(
+    "get_user_envelopes",
+    """
+    SELECT e.id, e.user_id, e.entity_id, e.name, e.type, e.created_at, e.updated_at
+    FROM envelopes e
+    WHERE e.user_id = %(user_id)s
+    """,
+)
 
 
 class EntitiesRepository(Repository):
@@ -30,6 +40,7 @@ class EntitiesRepository(Repository):
             row = await cur.fetchone()
             return Entity(**camelize(row))
 
+    @replica_safe
     async def get_entities_for_user(self, user_id: str):
         async with self.db.cursor() as cur:
             await cur.execute(
@@ -130,16 +141,10 @@ class EntitiesRepository(Repository):
                 },
             )
 
+    @replica_safe
     async def get_user_envelopes(self, user_id: str) -> list[Envelope]:
         async with self.db.cursor() as cur:
-            await cur.execute(
-                """
-                SELECT e.id, e.user_id, e.entity_id, e.name, e.type, e.created_at, e.updated_at
-                FROM envelopes e
-                WHERE e.user_id = %(user_id)s
-                """,
-                {"user_id": user_id},
-            )
+            await GET_USER_ENVELOPES.execute(cur, {"user_id": user_id})
 
             envelopes = [Envelope(**camelize(env)) async for env in cur]
             return envelopes
@@ -1,11 +1,17 @@
 """Contains the TransactionsRepository class for managing transactions in a database.
 
 This class should be used to insert and fetch transactions and transaction reports.
+Store transactions arrive in batches from the transactions stream and are
+written with `insert_transactions`, which needs a plain `AsyncConnection`.
 """
 
 import uuid
 
 from datetime import datetime
+
+from psycopg import errors
+
+from python_api.db.bulk import insert_rows
 from python_api.repositories import Repository
 
 AMORTIZATION_SCHEDULE = {
@@ -17,6 +23,29 @@ AMORTIZATION_SCHEDULE = {
 }
 
 
+TRANSACTION_COLUMNS = (
+    "id",
+    "user_id",
+    "source",
+    "transaction_id",
+    "product_id",
+    "price",
+    "tax_percentage",
+    "commission_percentage",
+    "takehome_percentage",
+    "takehome_amount",
+    "created_at",
+    "transacted_at",
+    "applied_at",
+    "currency",
+    "amortized_transaction_id",
+)
+
+
+# Namespace of the row IDs derived from transactions stream entry IDs.
+STREAM_NAMESPACE = uuid.UUID("5b0c2d7e-3f4a-4c1e-9a8b-7d6e5f4c3b2a")
+
+
 def add_months(date: int, month: int):
     dt = datetime.fromtimestamp(date)
     nmonth = dt.month + month
@@ -35,6 +64,84 @@ def add_months(date: int, month: int):
     return int(dt.replace(year=nyear, month=nmonth, day=day).timestamp())
 
 
+def transaction_rows(
+    user_id,
+    source,
+    transaction_id,
+    product_id,
+    price,
+    tax_percentage,
+    commission_percentage,
+    takehome_percentage,
+    takehome_amount,
+    created_at,
+    applied_at: int,
+    duration,
+    currency: str | None = None,
+    stream_id: str | None = None,
+) -> list[dict]:
+    """Expand a store transaction into its rows: itself, then its amortizations.
+
+    Given the ID of the stream entry it arrived in, the rows' IDs derive from
+    it, so a redelivered entry conflicts with the rows already stored.
+    """
+
+    def row_id(suffix: str):
+        if stream_id is None:
+            return uuid.uuid4()
+        return uuid.uuid5(STREAM_NAMESPACE, f"{stream_id}{suffix}")
+
+    main_id = row_id("")
+
+    amortization = AMORTIZATION_SCHEDULE.get(duration, None)
+    transactions = [
+        {
+            "id": main_id,
+            "user_id": user_id,
+            "source": source,
+            "transaction_id": transaction_id,
+            "product_id": product_id,
+            "price": price,
+            "tax_percentage": tax_percentage,
+            "commission_percentage": commission_percentage,
+            "takehome_percentage": takehome_percentage,
+            "takehome_amount": takehome_amount,
+            "created_at": created_at,
+            "transacted_at": created_at,
+            "applied_at": applied_at,
+            "currency": currency,
+            "amortized_transaction_id": None,
+        }
+    ]
+
+    if amortization:
+        transactions[0]["applied_at"] = None
+
+        months = amortization["months"]
+        for i in range(0, months):
+            transactions.append(
+                {
+                    "id": row_id(f".{i}"),
+                    "user_id": user_id,
+                    "source": f"{source}.amortized",
+                    "transaction_id": f"{transaction_id}.{i}",
+                    "product_id": product_id,
+                    "price": price / months,
+                    "tax_percentage": tax_percentage,
+                    "commission_percentage": commission_percentage,
+                    "takehome_percentage": takehome_percentage,
+                    "takehome_amount": takehome_amount / months,
+                    "created_at": created_at,
+                    "transacted_at": created_at,
+                    "applied_at": add_months(applied_at, i),
+                    "currency": currency,
+                    "amortized_transaction_id": main_id,
+                }
+            )
+
+    return transactions
+
+
 class TransactionsRepository(Repository):
     def __init__(self, db):
         super().__init__(None, None)
@@ -128,103 +235,70 @@ class TransactionsRepository(Repository):
             )
             return await cur.fetchone()
 
-    async def insert_transaction(
-        self,
-        user_id,
-        source,
-        transaction_id,
-        product_id,
-        price,
-        tax_percentage,
-        commission_percentage,
-        takehome_percentage,
-        takehome_amount,
-        created_at,
-        applied_at: int,
-        duration,
-        currency: str | None = None,
-    ):
-        main_id = uuid.uuid4()
+    async def insert_transaction(self, **transaction):
+        inserted, total, _ = await self.insert_transactions([transaction])
+        return inserted, total
 
-        amortization = AMORTIZATION_SCHEDULE.get(duration, None)
-        transactions = [
-            {
-                "id": main_id,
-                "user_id": user_id,
-                "source": source,
-                "transaction_id": transaction_id,
-                "product_id": product_id,
-                "price": price,
-                "tax_percentage": tax_percentage,
-                "commission_percentage": commission_percentage,
-                "takehome_percentage": takehome_percentage,
-                "takehome_amount": takehome_amount,
-                "created_at": created_at,
-                "transacted_at": created_at,
-                "applied_at": applied_at,
-                "currency": currency,
-                "amortized_transaction_id": None,
-            }
-        ]
-
-        if amortization:
-            transactions[0]["applied_at"] = None
-
-            next_applied_at = applied_at
-            months = amortization["months"]
-
-            for i in range(0, amortization["months"]):
-                assert main_id is not None
-
-                next_applied_at = add_months(applied_at, i)
-                transactions.append(
-                    {
-                        "id": uuid.uuid4(),
-                        "user_id": user_id,
-                        "source": f"{source}.amortized",
-                        "transaction_id": f"{transaction_id}.{i}",
-                        "product_id": product_id,
-                        "price": price / months,
-                        "tax_percentage": tax_percentage,
-                        "commission_percentage": commission_percentage,
-                        "takehome_percentage": takehome_percentage,
-                        "takehome_amount": takehome_amount / months,
-                        "created_at": created_at,
-                        "transacted_at": created_at,
-                        "applied_at": next_applied_at,
-                        "currency": currency,
-                        "amortized_transaction_id": main_id,
-                    }
-                )
+    async def insert_transactions(
+        self, transactions: list[dict]
+    ) -> tuple[int, int, dict[int, Exception]]:
+        """Insert a batch of store transactions and their amortization schedules.
 
-        failed = False
-        async with self.db.cursor() as cur:
-            inserted = 0
+        The whole batch normally goes out as one multi-row INSERT. If that
+        fails, each source transaction is retried in its own savepoint, so a
+        bad one doesn't take the others down with it. A transaction whose
+        user doesn't exist is kept without one.
+
+        Returns the rows inserted, the rows in the expanded schedules, and the
+        errors of the transactions that could not be written, by batch index.
+        """
+        schedules: dict[int, list[dict]] = {}
+        failed: dict[int, Exception] = {}
+        for i, transaction in enumerate(transactions):
             try:
-                await cur.executemany(
-                    self.INSERT_TRANSACTION_QUERY,
-                    transactions,
+                schedules[i] = transaction_rows(**transaction)
+            except (TypeError, ValueError) as e:
+                print("Skipping malformed transaction:", transaction, e)
+                failed[i] = e
+
+        total = sum(len(rows) for rows in schedules.values())
+        try:
+            async with self.db.transaction():
+                inserted = await self._insert_rows(
+                    [row for rows in schedules.values() for row in rows]
                 )
-                inserted += cur.rowcount
-
-            except Exception as e:
-                for transaction in transactions:
-                    transaction["user_id"] = None
-                await self.db.rollback()
-                print(e)
-                inserted = 0
-                failed = True
-
-        if failed:
-            async with self.db.cursor() as cur:
-                for transaction in transactions:
-                    await cur.execute(
-                        self.INSERT_TRANSACTION_QUERY,
-                        transaction,
-                    )
-
-                    inserted += cur.rowcount
-        return inserted, len(transactions)
+            return inserted, total, failed
+        except (errors.IntegrityError, errors.DataError) as e:
+            print("Batch insert of transactions failed, inserting one by one:", e)
+
+        inserted = 0
+        for i, rows in schedules.items():
+            try:
+                inserted += await self._insert_schedule(rows)
+            except (errors.IntegrityError, errors.DataError) as e:
+                print(f"Skipping transaction {rows[0]['transaction_id']}:", e)
+                failed[i] = e
+
+        return inserted, total, failed
+
+    async def _insert_schedule(self, rows: list[dict]) -> int:
+        try:
+            async with self.db.transaction():
+                return await self._insert_rows(rows)
+        except errors.IntegrityError as e:
+            print(f"Inserting transaction {rows[0]['transaction_id']} without user:", e)
+
+        rows = [{**row, "user_id": None} for row in rows]
+        async with self.db.transaction():
+            return await self._insert_rows(rows)
+
+    async def _insert_rows(self, rows: list[dict]) -> int:
+        return await insert_rows(
+            self.db,
+            "transactions",
+            TRANSACTION_COLUMNS,
+            [[row[column] for column in TRANSACTION_COLUMNS] for row in rows],
+        )
 
     INSERT_TRANSACTION_QUERY = """
         INSERT INTO transactions (
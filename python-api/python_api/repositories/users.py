@@ -1,3 +1,4 @@
+from collections.abc import AsyncIterator
 from datetime import UTC, datetime, timedelta
 import string
 import uuid
@@ -5,10 +6,11 @@ import math
 import random
 import secrets
 import base64
+import hashlib
+import json
 from humps import camelize
-from passlib.context import CryptContext
-from passlib.exc import UnknownHashError
 from pydantic import BaseModel
+from redis.exceptions import RedisError
 
 from python_api.models.entities import Entity
 from python_api.models.envelopes import Envelope
@@ -25,10 +27,111 @@ from python_api.models.users import (
 )
 from python_api.models.emails import EmailType
 
-from python_api.repositories import Repository
+from python_api.caching import Cache
+from python_api.db.prepared import prepared
+from python_api.db.streaming import DEFAULT_CHUNK_SIZE, stream_rows
+from python_api.repositories import Repository, replica_safe
 
 from python_api.repositories.entities import EntitiesRepository
+from python_api.passwords import password_hasher
 from python_api.settings import Settings
+from python_api.user_status import user_status_cache
+
+
+GET_USER = prepared(
+    "get_user",
+    """
+    SELECT u.id, u.email, u.email_id, u.name, u.roles, u.is_verified, u.restricted,
+    ARRAY_AGG(su.provider) as sso_connections,
+    CASE WHEN password_hash IS NOT NULL THEN true ELSE false END as has_password
+    FROM users u
+    LEFT JOIN sso_users su ON su.user_id = u.id
+    WHERE u.id = %(user_id)s AND u.deleted_at IS NULL
+    GROUP BY u.id
+    """,
+)
+
+GET_USER_SUBSCRIPTION = prepared(
+    "get_user_subscription",
+    """
+    SELECT id, user_id, stripe_subscription_id, status,
+    created_at, updated_at, expires_at
+    FROM subscriptions
+    WHERE user_id = %(user_id)s
+    """,
+)
+
+GET_USER_BY_REFRESH_TOKEN = prepared(
+    "get_user_by_refresh_token",
+    """
+    SELECT u.id, email, email_id, name, roles, password_hash,
+        is_verified, restricted
+    FROM users u
+    INNER JOIN user_tokens ut ON u.id = ut.user_id
+    WHERE ut.refresh_token_digest = %(digest)s AND u.deleted_at IS NULL
+    """,
+)
+
+# The whole lookup for a token refresh: the token's provider, when it was last
+# used, and its user.
+LOOKUP_REFRESH_TOKEN = prepared(
+    "lookup_refresh_token",
+    """
+    SELECT ut.provider, ut.last_used AS token_last_used,
+        u.id, u.email, u.email_id, u.name, u.roles, u.password_hash,
+        u.is_verified, u.restricted
+    FROM user_tokens ut
+    INNER JOIN users u ON u.id = ut.user_id
+    WHERE ut.refresh_token_digest = %(digest)s AND u.deleted_at IS NULL
+    """,
+)
+
+EMAIL_SUBSCRIBED_USERS_SQL = """
+SELECT u.id, u.email, u.email_id, u.name, u.is_verified
+FROM users u
+JOIN user_subscriptions us ON us.user_id = u.id
+WHERE us.email_type = %(email_type)s AND u.deleted_at IS NULL
+AND u.is_verified = true AND (us.unsubscribed_at IS NULL OR us.subscribed_at > us.unsubscribed_at)
+"""
+
+# Users are listed newest first. created_at is nullable, so the sort key
+# matches the expression of the users_page_idx index instead.
+USER_PAGE_KEY = "COALESCE(u.created_at, '-infinity'::timestamptz)"
+
+USER_COUNT_TTL = 60.0
+# User counts by search term. Bounded, since every admin search adds a key.
+USER_COUNTS = Cache(
+    "UserRepository.count_users", USER_COUNT_TTL, max_size=256, copy=False
+)
+EXACT_USER_COUNT_BELOW = 10000
+
+
+def refresh_token_digest(refresh_token: str) -> bytes:
+    """Fixed-length key refresh tokens are stored and looked up by."""
+    return hashlib.sha256(refresh_token.encode()).digest()
+
+
+def user_page_cursor(user: User) -> str:
+    """Opaque cursor that `get_users(after=...)` continues after."""
+    created_at = user.created_at.isoformat() if user.created_at else None
+    return (
+        base64.urlsafe_b64encode(json.dumps([created_at, str(user.id)]).encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def _decode_page_cursor(cursor: str) -> tuple[datetime | str, str]:
+    try:
+        created_at, user_id = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+        return (
+            datetime.fromisoformat(created_at) if created_at else "-infinity",
+            str(uuid.UUID(user_id)),
+        )
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid page cursor") from e
 
 
 class UserRepository(Repository):
@@ -49,13 +152,34 @@ class UserRepository(Repository):
     def from_db_user(user: DbUser | None) -> User | None:
         return User(**user.model_dump(by_alias=True)) if user else None
 
+    @replica_safe
     async def get_users(
-        self, offset=None, limit=None, search=None
+        self,
+        offset=None,
+        limit=None,
+        search=None,
+        after: str | None = None,
+        exact_count=False,
     ) -> tuple[list[User], int]:
+        """Page through users, newest first.
+
+        Pass the `user_page_cursor()` of the last user of a page as `after`
+        to get the next one. Unlike `offset`, that costs the same for every
+        page. The total is estimated unless `exact_count` is set.
+        """
         args = {}
 
+        where_sql = ""
         limit_sql = ""
-        search_sql = ""
+        if search:
+            args["search"] = f"%{search}%"
+            where_sql += " AND (u.email ILIKE %(search)s OR u.name ILIKE %(search)s)"
+        if after:
+            args["after_created_at"], args["after_id"] = _decode_page_cursor(after)
+            where_sql += (
+                f" AND ({USER_PAGE_KEY}, u.id)"
+                " < (%(after_created_at)s::timestamptz, %(after_id)s::uuid)"
+            )
         if limit:
             args["limit"] = limit
             limit_sql = "LIMIT %(limit)s"
@@ -63,60 +187,99 @@ class UserRepository(Repository):
             args["offset"] = offset
             limit_sql += " OFFSET %(offset)s"
 
-        if search:
-            args["search"] = f"%{search}%"
-            search_sql = "AND (u.email ILIKE %(search)s OR u.name ILIKE %(search)s)"
+        user_count = await self.count_users(search, exact=exact_count)
 
         async with self.db.cursor() as cur:
             await cur.execute(
                 f"""
-            SELECT COUNT(1) as "count" FROM
-            (SELECT u.id, u.email, u.email_id, u.name, u.roles, u.is_verified, u.created_at,
+            SELECT u.id, u.email, u.email_id, u.name, u.roles, u.is_verified, u.created_at,
             u.restricted
             FROM users u
             WHERE u.deleted_at IS NULL
-            {search_sql}
-            GROUP BY u.id
-            ) as users
+            {where_sql}
+            ORDER BY {USER_PAGE_KEY} DESC, u.id DESC
+            {limit_sql}
             """,
                 args,
             )
 
-            count_dict = await cur.fetchone()
-            user_count = count_dict["count"]
+            users = [User(**camelize(user)) for user in await cur.fetchall()]
+
+            return users, user_count
+
+    @replica_safe
+    async def count_users(self, search=None, exact=False) -> int:
+        """Count users who aren't deleted.
+
+        Without `exact`, the count may be an estimate. It comes from the
+        planner statistics for large unfiltered tables, or from a count cached
+        for USER_COUNT_TTL seconds.
+        """
+        if exact:
+            USER_COUNTS.invalidate(search)
+
+        return await USER_COUNTS.aget(
+            search, lambda: self._count_users(search, estimate=not exact)
+        )
+
+    async def _count_users(self, search, estimate: bool) -> int:
+        if estimate and not search:
+            async with self.db.cursor() as cur:
+                await cur.execute(
+                    """
+                    SELECT reltuples::bigint AS estimate
+                    FROM pg_class WHERE oid = 'users'::regclass
+                    """
+                )
+                row = await cur.fetchone()
+            # Small tables are cheap to count, and reltuples is -1 until the
+            # first ANALYZE.
+            if row and row["estimate"] >= EXACT_USER_COUNT_BELOW:
+                return row["estimate"]
+
+        args = {}
+        search_sql = ""
+        if search:
+            args["search"] = f"%{search}%"
+            search_sql = "AND (u.email ILIKE %(search)s OR u.name ILIKE %(search)s)"
 
+        async with self.db.cursor() as cur:
             await cur.execute(
                 f"""
-            SELECT u.id, u.email, u.email_id, u.name, u.roles, u.is_verified, u.created_at,
-            u.restricted
-            FROM users u
-            WHERE u.deleted_at IS NULL
-            {search_sql}
-            GROUP BY u.id
-            ORDER BY u.created_at DESC
-            {limit_sql}
-            """,
+                SELECT COUNT(1) AS "count" FROM users u
+                WHERE u.deleted_at IS NULL
+                {search_sql}
+                """,
                 args,
             )
+            return (await cur.fetchone())["count"]
 
-            users = [User(**camelize(user)) for user in await cur.fetchall()]
+    async def stream_users(
+        self, search=None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[list[User]]:
+        """Yield every user, newest first, in chunks of `chunk_size`."""
+        args = {}
+        search_sql = ""
+        if search:
+            args["search"] = f"%{search}%"
+            search_sql = "AND (u.email ILIKE %(search)s OR u.name ILIKE %(search)s)"
 
-            return users, user_count
+        sql = f"""
+        SELECT u.id, u.email, u.email_id, u.name, u.roles, u.is_verified, u.created_at,
+        u.restricted
+        FROM users u
+        WHERE u.deleted_at IS NULL
+        {search_sql}
+        ORDER BY {USER_PAGE_KEY} DESC, u.id DESC
+        """
 
+        async for users in stream_rows(self.db, sql, args, chunk_size):
+            yield [User(**camelize(user)) for user in users]
+
+    @replica_safe
     async def get_user(self, user_id: str) -> User | None:
         async with self.db.cursor() as cur:
-            await cur.execute(
-                """
-            SELECT u.id, u.email, u.email_id, u.name, u.roles, u.is_verified, u.restricted,
-            ARRAY_AGG(su.provider) as sso_connections,
-            CASE WHEN password_hash IS NOT NULL THEN true ELSE false END as has_password
-            FROM users u
-            LEFT JOIN sso_users su ON su.user_id = u.id
-            WHERE u.id = %(user_id)s AND u.deleted_at IS NULL
-            GROUP BY u.id
-            """,
-                {"user_id": user_id},
-            )
+            await GET_USER.execute(cur, {"user_id": user_id})
 
             user = await cur.fetchone()
             if not user:
@@ -142,7 +305,8 @@ class UserRepository(Repository):
                 },
             )
 
-            return await self.get_user_by_id(user_id)
+        await self._invalidate_cached_user(user_id)
+        return await self.get_user_by_id(user_id)
 
     async def update_user(self, id: str, user: AdminUserViewModel) -> User | None:
         async with self.db.cursor() as cur:
@@ -163,7 +327,9 @@ class UserRepository(Repository):
                 },
             )
 
-            return await self.get_user(id)
+        db_user = await self.get_user(id)
+        await self._set_cached_status(id, db_user)
+        return db_user
 
     async def insert_user(self, user: DbUser):
         user.email = user.email.lower()
@@ -228,7 +394,8 @@ class UserRepository(Repository):
             )
 
     async def delete_user(self, user_id: str):
-        async with self.db.cursor() as cur:
+        # Pipelined, so every statement goes out with the final fetch.
+        async with self.db.pipeline(), self.db.cursor() as cur:
             await cur.execute(
                 """
                 DELETE FROM subscriptions 
@@ -294,7 +461,10 @@ class UserRepository(Repository):
                 },
             )
 
-            return (await cur.fetchone())["id"]
+            deleted_id = (await cur.fetchone())["id"]
+
+        await self._invalidate_cached_user(user_id)
+        return deleted_id
 
     async def restrict_user(self, user_id: str):
         async with self.db.cursor() as cur:
@@ -307,6 +477,8 @@ class UserRepository(Repository):
                 {"user_id": user_id},
             )
 
+        await self._set_cached_status(user_id, await self.get_user(user_id))
+
     async def un_restrict_user(self, user_id: str):
         async with self.db.cursor() as cur:
             await cur.execute(
@@ -318,6 +490,8 @@ class UserRepository(Repository):
                 {"user_id": user_id},
             )
 
+        await self._set_cached_status(user_id, await self.get_user(user_id))
+
     async def is_restricted(self, user_id: str):
         async with self.db.cursor() as cur:
             await cur.execute(
@@ -415,8 +589,11 @@ class UserRepository(Repository):
     ) -> tuple[str, int] | tuple[None, None]:
         async with self.db.cursor() as cur:
             await cur.execute(
-                "SELECT provider, last_used FROM user_tokens WHERE refresh_token = %s",
-                (refresh_token,),
+                """
+                SELECT provider, last_used FROM user_tokens
+                WHERE refresh_token_digest = %s
+                """,
+                (refresh_token_digest(refresh_token),),
             )
             res = await cur.fetchone()
             if not res:
@@ -479,15 +656,7 @@ class UserRepository(Repository):
 
     async def get_user_subscription(self, user_id: str) -> Subscription | None:
         async with self.db.cursor() as cur:
-            await cur.execute(
-                """
-            SELECT id, user_id, stripe_subscription_id, status,
-            created_at, updated_at, expires_at
-            FROM subscriptions
-            WHERE user_id = %(user_id)s
-            """,
-                {"user_id": user_id},
-            )
+            await GET_USER_SUBSCRIPTION.execute(cur, {"user_id": user_id})
 
             subscription = await cur.fetchone()
             if not subscription:
@@ -496,14 +665,76 @@ class UserRepository(Repository):
         return Subscription(**camelize(subscription))
 
     async def get_user_with_info_by_id(self, user_id: str) -> UserWithInfo | None:
-        user = await self.get_user_by_id(user_id)
+        user = await self._get_user_info(user_id)
         if not user:
             return None
 
-        user = UserWithInfo(**user.model_dump(by_alias=True))
         user.entities = await self.entities.get_entities_for_user(user_id)
         return user
 
+    async def get_cached_user_with_info_by_id(
+        self, user_id: str
+    ) -> UserWithInfo | None:
+        """Like get_user_with_info_by_id, with the user and subscription cached.
+
+        Entities are written outside this repository, so they're always read
+        fresh. Methods here that change a user invalidate the cached copy.
+        """
+        user = await user_status_cache(self.settings).get_user_info(
+            user_id, lambda: self._get_user_info(user_id)
+        )
+        if not user:
+            return None
+
+        user.entities = await self.entities.get_entities_for_user(user_id)
+        return user
+
+    async def _get_user_info(self, user_id: str) -> UserWithInfo | None:
+        user = await self.get_user_by_id(user_id)
+        if not user:
+            return None
+
+        return UserWithInfo(**user.model_dump(by_alias=True))
+
+    async def _invalidate_cached_user(self, user_id):
+        await self._publish_user_change(
+            user_id,
+            lambda: user_status_cache(self.settings).invalidate_everywhere(
+                str(user_id)
+            ),
+        )
+
+    async def _set_cached_status(self, user_id, user: User | None):
+        """Store the user's status for auth checks, from the row as written."""
+        if user is None:
+            return
+
+        await self._publish_user_change(
+            user_id, lambda: user_status_cache(self.settings).set(str(user_id), user)
+        )
+
+    async def _publish_user_change(self, user_id, publish):
+        """Run `publish()`, which tells every worker a user changed, once the
+        change is committed."""
+        after_commit = getattr(self.db, "after_commit", None)
+        if after_commit is None:
+            # A plain connection is committed by its caller, after we return.
+            await self._try_publish(user_id, publish)
+            return
+
+        # This worker's copy goes now so the rest of the request sees the
+        # write. Other workers are told once it's committed, or they could
+        # reload the old rows and keep them.
+        user_status_cache(self.settings).invalidate(str(user_id))
+        after_commit(lambda: self._try_publish(user_id, publish))
+
+    async def _try_publish(self, user_id, publish):
+        try:
+            await publish()
+        except (RedisError, OSError) as e:
+            # Cached copies expire after their TTL regardless.
+            print("Could not update cached user", user_id, e)
+
     async def get_user_by_email_id(self, email_id: str) -> DbUser | None:
         return await self._get_user_by_sql_property(email_id, "u.email_id")
 
@@ -543,15 +774,8 @@ class UserRepository(Repository):
 
     async def get_user_by_refresh_token(self, refresh_token) -> DbUser | None:
         async with self.db.cursor() as cur:
-            await cur.execute(
-                """
-            SELECT u.id, email, email_id, name, roles, password_hash,
-                is_verified, restricted
-            FROM users u
-            INNER JOIN user_tokens ut ON u.id = ut.user_id
-            WHERE ut.refresh_token = %(refresh_token)s AND u.deleted_at IS NULL
-            """,
-                {"refresh_token": refresh_token},
+            await GET_USER_BY_REFRESH_TOKEN.execute(
+                cur, {"digest": refresh_token_digest(refresh_token)}
             )
 
             user = await cur.fetchone()
@@ -562,6 +786,27 @@ class UserRepository(Repository):
 
         return user
 
+    async def lookup_refresh_token(
+        self, refresh_token: str
+    ) -> tuple[DbUser, str, int | None] | None:
+        """Find a refresh token and its user in one query.
+
+        Returns its user, its provider and when it was last used, or None for
+        an unknown token or deleted user.
+        """
+        async with self.db.cursor() as cur:
+            await LOOKUP_REFRESH_TOKEN.execute(
+                cur, {"digest": refresh_token_digest(refresh_token)}
+            )
+
+            row = await cur.fetchone()
+            if not row:
+                return None
+
+        provider = row.pop("provider")
+        last_used = row.pop("token_last_used")
+        return DbUser(**camelize(row)), provider, last_used
+
     async def user_refresh_token(self, email: str) -> str | None:
         async with self.db.cursor() as cur:
             await cur.execute(
@@ -590,11 +835,11 @@ class UserRepository(Repository):
                 """
                 UPDATE user_tokens
                 SET last_used = %(last_used)s
-                WHERE refresh_token = %(refresh_token)s
+                WHERE refresh_token_digest = %(digest)s
                 """,
                 {
                     "last_used": int(datetime.now().timestamp()),
-                    "refresh_token": refresh_token,
+                    "digest": refresh_token_digest(refresh_token),
                 },
             )
 
@@ -603,10 +848,14 @@ class UserRepository(Repository):
             await cur.execute(
                 """
                 UPDATE user_tokens
-                SET refresh_token = %s
+                SET refresh_token = %s, refresh_token_digest = %s
                 WHERE id = %s
                 """,
-                (token.refresh_token, token.id),
+                (
+                    token.refresh_token,
+                    refresh_token_digest(token.refresh_token),
+                    token.id,
+                ),
             )
 
     async def update_refresh_token_by_token(self, old_token: str, new_token: str):
@@ -614,21 +863,34 @@ class UserRepository(Repository):
             await cur.execute(
                 """
                 UPDATE user_tokens
-                SET refresh_token = %s
-                WHERE refresh_token = %s
+                SET refresh_token = %s, refresh_token_digest = %s
+                WHERE refresh_token_digest = %s
                 """,
-                (new_token, old_token),
+                (
+                    new_token,
+                    refresh_token_digest(new_token),
+                    refresh_token_digest(old_token),
+                ),
             )
 
     async def insert_refresh_token(self, token: DbUserToken) -> DbUserToken:
         async with self.db.cursor() as cur:
             await cur.execute(
                 """
-                INSERT INTO user_tokens (id, refresh_token, date, provider, user_id, last_used)
-                VALUES (%(id)s, %(refresh_token)s, %(date)s, %(provider)s, %(user_id)s, %(last_used)s)
+                INSERT INTO user_tokens (
+                    id, refresh_token, refresh_token_digest, date, provider,
+                    user_id, last_used
+                )
+                VALUES (
+                    %(id)s, %(refresh_token)s, %(refresh_token_digest)s, %(date)s,
+                    %(provider)s, %(user_id)s, %(last_used)s
+                )
                 RETURNING id, refresh_token, date, provider, user_id, last_used;
                 """,
-                token.model_dump(mode="json", by_alias=False),
+                {
+                    **token.model_dump(mode="json", by_alias=False),
+                    "refresh_token_digest": refresh_token_digest(token.refresh_token),
+                },
             )
 
             return DbUserToken(**await cur.fetchone())
@@ -636,9 +898,11 @@ class UserRepository(Repository):
     async def insert_new_refresh_token(
         self, user_id, provider="EXCHEQUER"
     ) -> DbUserToken:
+        refresh_token = base64.b64encode(secrets.token_bytes(64)).decode()
         token_dict = {
             "id": base64.b64encode(random.randbytes(24)).decode(),
-            "refresh_token": base64.b64encode(secrets.token_bytes(64)).decode(),
+            "refresh_token": refresh_token,
+            "refresh_token_digest": refresh_token_digest(refresh_token),
             "date": int(datetime.now().timestamp()),
             "provider": provider,
             "user_id": user_id,
@@ -647,8 +911,14 @@ class UserRepository(Repository):
         async with self.db.cursor() as cur:
             await cur.execute(
                 """
-                INSERT INTO user_tokens (id, refresh_token, date, provider, user_id, last_used)
-                VALUES (%(id)s, %(refresh_token)s, %(date)s, %(provider)s, %(user_id)s, %(last_used)s)
+                INSERT INTO user_tokens (
+                    id, refresh_token, refresh_token_digest, date, provider,
+                    user_id, last_used
+                )
+                VALUES (
+                    %(id)s, %(refresh_token)s, %(refresh_token_digest)s, %(date)s,
+                    %(provider)s, %(user_id)s, %(last_used)s
+                )
                 RETURNING id, refresh_token, date, provider, user_id, last_used;
                 """,
                 token_dict,
@@ -658,7 +928,7 @@ class UserRepository(Repository):
 
     async def reset_password(self, email: str, password: str):
         async with self.db.cursor() as cur:
-            password_hash = self.get_password_hash(password)
+            password_hash = await self.get_password_hash(password)
             await cur.execute(
                 "UPDATE users SET password_hash = %s, updated_at = %s WHERE email = %s",
                 (password_hash, datetime.now(UTC), email.lower()),
@@ -705,61 +975,45 @@ class UserRepository(Repository):
             return code
 
     async def generate_email_verification_code(self, user_id: str) -> str | None:
-        async with self.db.cursor() as cur:
-            code = generate_otp(6)
+        code = generate_otp(6)
+        params = {
+            "code": code,
+            "expires_at": datetime.now().astimezone(UTC) + timedelta(minutes=15),
+            "user_id": user_id,
+            "status": False,
+        }
 
+        # Update the existing row, or insert one if the user has none yet. Both
+        # statements are pipelined so this costs a single round trip.
+        async with self.db.pipeline(), self.db.cursor() as cur:
             await cur.execute(
                 """
-                SELECT user_id FROM verification v
-                WHERE v.user_id = %(user_id)s
+                UPDATE verification
+                SET
+                code = %(code)s,
+                expires_at = %(expires_at)s,
+                status = %(status)s
+                WHERE user_id = %(user_id)s
                 """,
-                {"user_id": user_id},
+                params,
             )
 
-            user_in_verification = await cur.fetchone()
-
-            # If user Id is in verification table then just update it.
-            if user_in_verification:
-                await cur.execute(
-                    """
-                    UPDATE verification
-                    SET
-                    code = %(code)s,
-                    expires_at = %(expires_at)s,
-                    status = %(status)s
-                    WHERE user_id = %(user_id)s
-                    """,
-                    {
-                        "code": code,
-                        "expires_at": datetime.now().astimezone(UTC)
-                        + timedelta(minutes=15),
-                        "user_id": user_id,
-                        "status": False,
-                    },
-                )
-
-                return code
-
             await cur.execute(
                 """
                 INSERT INTO verification
                 (code, expires_at, user_id, status)
-                VALUES
-                (%(code)s, %(expires_at)s, %(user_id)s, %(status)s)
+                SELECT %(code)s, %(expires_at)s, %(user_id)s, %(status)s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM verification v WHERE v.user_id = %(user_id)s
+                )
                 """,
-                {
-                    "code": code,
-                    "expires_at": datetime.now().astimezone(UTC)
-                    + timedelta(minutes=15),
-                    "user_id": user_id,
-                    "status": False,
-                },
+                params,
             )
 
-            return code
+        return code
 
     async def update_user_to_verified(self, user_id):
-        async with self.db.cursor() as cur:
+        async with self.db.pipeline(), self.db.cursor() as cur:
             await cur.execute(
                 """
                 UPDATE verification
@@ -781,21 +1035,29 @@ class UserRepository(Repository):
                 "UPDATE users SET is_verified = true WHERE id = %s", (user_id,)
             )
 
+        await self._invalidate_cached_user(user_id)
+
     async def get_email_subscribed_users(self, email_type: EmailType) -> list[User]:
         async with self.db.cursor() as cur:
             await cur.execute(
-                """
-                SELECT u.id, u.email, u.email_id, u.name, u.is_verified
-                FROM users u
-                JOIN user_subscriptions us ON us.user_id = u.id
-                WHERE us.email_type = %(email_type)s AND u.deleted_at IS NULL
-                AND u.is_verified = true AND (us.unsubscribed_at IS NULL OR us.subscribed_at > us.unsubscribed_at)
-                """,
+                EMAIL_SUBSCRIBED_USERS_SQL,
                 {"email_type": email_type.value},
             )
 
             return [User(**camelize(user)) for user in await cur.fetchall()]
 
+    async def stream_email_subscribed_users(
+        self, email_type: EmailType, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> AsyncIterator[list[User]]:
+        """Like get_email_subscribed_users, but yields the users in chunks."""
+        async for users in stream_rows(
+            self.db,
+            EMAIL_SUBSCRIBED_USERS_SQL,
+            {"email_type": email_type.value},
+            chunk_size,
+        ):
+            yield [User(**camelize(user)) for user in users]
+
     async def is_user_subscribed_to_emails(
         self, user_id: str, email_type: EmailType
     ) -> bool:
@@ -865,8 +1127,8 @@ class UserRepository(Repository):
                 },
             )
 
-    def get_password_hash(self, password):
-        return pwd_context.hash(password)
+    async def get_password_hash(self, password):
+        return await password_hasher(self.settings).hash(password)
 
     def email_verification_email(self, code):
         return f"""If you did not request this verification code, please ignore this email.
@@ -874,10 +1136,9 @@ class UserRepository(Repository):
 Enter this code: {code} into your verification form. This code expires in 15 minutes"""
 
     async def verify_password(self, plain_password, hashed_password) -> bool:
-        try:
-            return pwd_context.verify(plain_password, hashed_password)
-        except UnknownHashError:
-            return False
+        return await password_hasher(self.settings).verify(
+            plain_password, hashed_password
+        )
 
     async def provision_subscription_trial(self, user_id: str):
         async with self.db.cursor() as cur:
@@ -901,6 +1162,8 @@ Enter this code: {code} into your verification form. This code expires in 15 min
                 },
             )
 
+        await self._invalidate_cached_user(user_id)
+
     async def add_integration(
         self, user_id, integration_name: str, integration_data: BaseModel
     ):
@@ -923,8 +1186,7 @@ Enter this code: {code} into your verification form. This code expires in 15 min
                 },
             )
 
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        await self._invalidate_cached_user(user_id)
 
 
 def generate_random_string(len: int) -> str:
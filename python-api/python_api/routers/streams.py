@@ -0,0 +1,49 @@
+from fastapi import APIRouter, HTTPException
+from redis.exceptions import ResponseError
+
+from python_api.dependencies import RedisDep, SettingsDep
+from python_api.streams import (
+    DeadLetter,
+    discard_dead_letter,
+    get_dead_letters,
+    replay_dead_letter,
+)
+
+router = APIRouter(prefix="/streams", tags=["streams"])
+
+
+@router.get("/dead-letters", description="Get stream entries that failed ingest")
+async def list_dead_letters(
+    redis: RedisDep, count: int = 100, after: str | None = None
+) -> list[DeadLetter]:
+    try:
+        return await get_dead_letters(redis, count=count, after=after)
+    except ResponseError:
+        raise HTTPException(status_code=400, detail="Invalid dead letter ID")
+
+
+@router.post(
+    "/dead-letters/{id}/replay",
+    description="Publish a dead letter to its stream again",
+)
+async def replay(redis: RedisDep, settings: SettingsDep, id: str) -> dict:
+    try:
+        entry_id = await replay_dead_letter(redis, id, settings.stream_max_length)
+    except ResponseError:
+        raise HTTPException(status_code=400, detail="Invalid dead letter ID")
+
+    if entry_id is None:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return {"entry_id": entry_id}
+
+
+@router.delete("/dead-letters/{id}", description="Discard a dead letter")
+async def discard(redis: RedisDep, id: str) -> dict:
+    try:
+        discarded = await discard_dead_letter(redis, id)
+    except ResponseError:
+        raise HTTPException(status_code=400, detail="Invalid dead letter ID")
+
+    if not discarded:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return {}
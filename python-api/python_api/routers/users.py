@@ -1,12 +1,14 @@
-import json
-from fastapi.encoders import jsonable_encoder
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Depends, Query
 import fastapi
-from python_api.dependencies import UserRepositoryDep, RedisDep
+from python_api.dependencies import (
+    UserRepositoryDep,
+    read_only_postgres,
+)
 from python_api.models import CamelModel
 from python_api.models.users import (
     AdminUserViewModel,
 )
+from python_api.repositories.users import user_page_cursor
 
 from fastapi import HTTPException
 
@@ -14,19 +16,39 @@ router = APIRouter(prefix="/users", tags=["users"])
 
 
 # Get all users
-@router.get("", description="Get all users")
+@router.get(
+    "", description="Get all users", dependencies=[Depends(read_only_postgres)]
+)
 async def get_users(
     users: UserRepositoryDep,
     offset: int | None = None,
     limit: int | None = None,
     search: str | None = None,
+    cursor: str | None = None,
+    exact_count: bool = Query(default=False, alias="exactCount"),
 ):
-    _users, total = await users.get_users(offset=offset, limit=limit, search=search)
-    return {"data": _users, "total": total}
+    try:
+        _users, total = await users.get_users(
+            offset=offset,
+            limit=limit,
+            search=search,
+            after=cursor,
+            exact_count=exact_count,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    next_cursor = None
+    if limit and len(_users) == limit:
+        next_cursor = user_page_cursor(_users[-1])
+
+    return {"data": _users, "total": total, "nextCursor": next_cursor}
 
 
 # Get user
-@router.get("/{id}", description="Get user")
+@router.get(
+    "/{id}", description="Get user", dependencies=[Depends(read_only_postgres)]
+)
 async def get_user(id: str, users: UserRepositoryDep):
     if user := await users.get_user(id):
         return user
@@ -39,20 +61,14 @@ async def get_user(id: str, users: UserRepositoryDep):
 async def update_user(
     user: AdminUserViewModel,
     users: UserRepositoryDep,
-    redis: RedisDep,
     _id: str = fastapi.Path(alias="id"),
     edit_subscription: bool = Query(default=False, alias="editSubscription"),
 ):
-    # Update role in db
+    # Update role in db; Redis is updated once it's committed.
     db_user = await users.update_user(_id, user)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Update user in Redis
-    await redis.setex(
-        f"users:{_id}", 2 * 60 * 60, json.dumps(jsonable_encoder(db_user))
-    )
-
     if not edit_subscription:
         return
 
@@ -60,24 +76,14 @@ async def update_user(
 @router.put("/{id}/restrict", description="Restrict user")
 async def restrict_user(
     users: UserRepositoryDep,
-    redis: RedisDep,
     _id: str = fastapi.Path(alias="id"),
 ):
     await users.restrict_user(_id)
-    user = await users.get_user(_id)
-
-    # Update user in Redis
-    await redis.setex(f"users:{_id}", 2 * 60 * 60, json.dumps(jsonable_encoder(user)))
 
 
 @router.put("/{id}/un-restrict", description="Un-restrict user")
 async def un_restrict_user(
     users: UserRepositoryDep,
-    redis: RedisDep,
     _id: str = fastapi.Path(alias="id"),
 ):
     await users.un_restrict_user(_id)
-    user = await users.get_user(_id)
-
-    # Update user in Redis
-    await redis.setex(f"users:{_id}", 2 * 60 * 60, json.dumps(jsonable_encoder(user)))
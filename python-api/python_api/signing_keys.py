@@ -0,0 +1,115 @@
+"""Keys used to sign and verify our access tokens.
+
+`KeyManager` parses the PEM files once and keeps the parsed keys, their kids
+and the public JWKS document in memory. Issuing or validating a token does
+no file I/O beyond an occasional `stat` to notice rotated files.
+
+Rotating keys:
+1. Add the new key to JWT_VERIFICATION_KEYS, so every worker accepts and
+   publishes it before any token is signed with it.
+2. Point JWT_SIGNING_KEY at the new key and move the old one to
+   JWT_VERIFICATION_KEYS until the tokens it signed have expired.
+3. Drop the old key.
+
+Replacing the contents of a file is picked up within
+JWT_KEY_RELOAD_INTERVAL seconds, without a restart.
+"""
+
+import os
+import time
+
+from jwcrypto import jwk
+
+from python_api.settings import Settings
+
+ALGORITHM = "RS256"
+
+
+def load_key(path: str) -> jwk.JWK:
+    with open(path, "rb") as f:
+        key = jwk.JWK.from_pem(f.read())
+    key.update({"use": "sig", "alg": ALGORITHM})
+    return key
+
+
+class KeyManager:
+    def __init__(
+        self,
+        signing_key_path: str,
+        verification_key_paths: list[str] | None = None,
+        reload_interval: float = 5.0,
+    ):
+        self.signing_key_path = signing_key_path
+        self.verification_key_paths = [
+            path for path in verification_key_paths or [] if path != signing_key_path
+        ]
+        self.reload_interval = reload_interval
+
+        self._mtimes: dict[str, float] = {}
+        self._checked_at = 0.0
+        self._load()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "KeyManager":
+        return cls(
+            settings.jwt_signing_key,
+            settings.jwt_verification_keys,
+            settings.jwt_key_reload_interval,
+        )
+
+    def _paths(self) -> list[str]:
+        return [self.signing_key_path, *self.verification_key_paths]
+
+    def _load(self):
+        mtimes = {path: os.stat(path).st_mtime for path in self._paths()}
+        keys = {path: load_key(path) for path in self._paths()}
+
+        self._signing_key = keys[self.signing_key_path]
+        self._keys = {key.key_id: key for key in keys.values()}
+        self._jwks = {
+            "keys": [key.export_public(as_dict=True) for key in self._keys.values()]
+        }
+        self._mtimes = mtimes
+        self._checked_at = time.monotonic()
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+
+        try:
+            changed = any(
+                os.stat(path).st_mtime != mtime for path, mtime in self._mtimes.items()
+            )
+            if changed:
+                self._load()
+                print("Reloaded JWT keys:", ", ".join(self._keys))
+        except (OSError, ValueError) as e:
+            # Mid-rotation files may be missing or half written; keep serving
+            # the keys we have and try again on the next interval.
+            print("Could not reload JWT keys:", e)
+
+    @property
+    def signing_key(self) -> jwk.JWK:
+        self._reload_if_changed()
+        return self._signing_key
+
+    def verification_key(self, kid: str | None) -> jwk.JWK | None:
+        self._reload_if_changed()
+        return self._keys.get(kid) if kid else None
+
+    @property
+    def jwks(self) -> dict:
+        self._reload_if_changed()
+        return self._jwks
+
+
+KEY_MANAGER: KeyManager | None = None
+
+
+def key_manager(settings: Settings) -> KeyManager:
+    global KEY_MANAGER
+    if KEY_MANAGER is None:
+        KEY_MANAGER = KeyManager.from_settings(settings)
+    return KEY_MANAGER
@@ -0,0 +1,162 @@
+"""Apple's and Google's signing keys, kept warm in the background.
+
+Each worker holds the provider's JWKS in memory and a background task
+refreshes it shortly before it expires, so SSO logins never wait on an HTTP
+fetch. Redis is shared between workers: whichever worker refreshes first
+publishes the keys there, and the rest adopt them instead of fetching again.
+Within a worker, concurrent refreshes share one fetch.
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import httpx
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from python_api.redis_pool import redis_client
+from python_api.settings import Settings
+
+# Refresh this long before the keys expire.
+REFRESH_MARGIN = timedelta(minutes=10)
+# Wait between attempts while the keys can't be fetched.
+RETRY_INTERVAL = 30.0
+# How long one worker may hold the cross-worker fetch lock.
+LOCK_TIMEOUT = 30
+
+
+class JwksCache:
+    def __init__(self, name: str, url_setting: str, ttl: timedelta):
+        # Redis keys are {name}:keys and {name}:expiration.
+        self.name = name
+        self.url_setting = url_setting
+        self.ttl = ttl
+
+        self.keys: list[dict] | None = None
+        self.expires_at: datetime | None = None
+
+        self._refreshing: asyncio.Future | None = None
+        self._task: asyncio.Task | None = None
+
+    async def get(self, settings: Settings) -> list[dict] | None:
+        """Return the keys, only fetching them if this worker has none yet."""
+        self.start(settings)
+        if self.keys is None:
+            await self.refresh(settings)
+        return self.keys
+
+    def start(self, settings: Settings):
+        """Start the background refresher on the running loop, if it isn't."""
+        loop = asyncio.get_running_loop()
+        task = self._task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._task = loop.create_task(self._run(settings))
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self, settings: Settings):
+        while True:
+            if self._stale():
+                try:
+                    await self.refresh(settings)
+                except Exception as e:
+                    print(f"Could not refresh {self.name}:", e)
+
+            await asyncio.sleep(self._sleep_time())
+
+    def _stale(self) -> bool:
+        return (
+            self.keys is None
+            or self.expires_at is None
+            or self.expires_at - REFRESH_MARGIN <= datetime.now()
+        )
+
+    def _sleep_time(self) -> float:
+        if self._stale():
+            return RETRY_INTERVAL
+        return (self.expires_at - REFRESH_MARGIN - datetime.now()).total_seconds()
+
+    async def refresh(self, settings: Settings):
+        loop = asyncio.get_running_loop()
+        refreshing = self._refreshing
+        if refreshing is not None and refreshing.get_loop() is loop:
+            await asyncio.shield(refreshing)
+            return
+
+        self._refreshing = future = loop.create_future()
+        try:
+            await self._refresh(
+                redis_client(settings), getattr(settings, self.url_setting)
+            )
+        finally:
+            future.set_result(None)
+            self._refreshing = None
+
+    async def _refresh(self, redis: Redis, url: str):
+        try:
+            keys, expires_at = await self._read_redis(redis)
+            if keys and expires_at - REFRESH_MARGIN > datetime.now():
+                self._adopt(keys, expires_at)
+                return
+
+            locked = await redis.set(
+                f"{self.name}:refresh_lock", "1", nx=True, ex=LOCK_TIMEOUT
+            )
+            if not locked and keys:
+                # Another worker is fetching; what Redis has will do until then.
+                self._adopt(keys, expires_at)
+                return
+        except RedisError as e:
+            print(f"Could not read {self.name} from redis:", e)
+            redis = None
+
+        async with httpx.AsyncClient() as client:
+            response = await client.get(url, timeout=10)
+            response.raise_for_status()
+            keys = response.json()["keys"]
+
+        expires_at = datetime.now() + self.ttl
+        self._adopt(keys, expires_at)
+
+        if redis is not None:
+            try:
+                await redis.set(f"{self.name}:keys", json.dumps(keys))
+                await redis.set(f"{self.name}:expiration", str(expires_at))
+                await redis.delete(f"{self.name}:refresh_lock")
+            except RedisError as e:
+                print(f"Could not write {self.name} to redis:", e)
+
+    async def _read_redis(self, redis: Redis):
+        keys = await redis.get(f"{self.name}:keys")
+        expiration = await redis.get(f"{self.name}:expiration")
+        if not keys or not expiration:
+            return None, None
+
+        return json.loads(keys), datetime.fromisoformat(expiration.decode("utf-8"))
+
+    def _adopt(self, keys: list[dict], expires_at: datetime):
+        self.keys = keys
+        self.expires_at = expires_at
+
+
+APPLE_JWKS = JwksCache("apple_keys", "apple_jwks_url", timedelta(hours=12))
+GOOGLE_JWKS = JwksCache("google_keys", "google_jwks_url", timedelta(hours=6))
+PROVIDERS = [APPLE_JWKS, GOOGLE_JWKS]
+
+
+def start_jwks_refreshers(settings: Settings):
+    for provider in PROVIDERS:
+        provider.start(settings)
+
+
+async def stop_jwks_refreshers():
+    for provider in PROVIDERS:
+        await provider.stop()
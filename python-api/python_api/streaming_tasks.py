@@ -1,10 +1,21 @@
+import asyncio
 import json
-from faststream import FastStream
+from faststream import Context, FastStream
 from faststream.redis import RedisBroker, StreamSub
 from python_api.models.actions import UserAction, UserSubscriptionAction
+from python_api.redis_pool import redis_client
+from python_api.repositories.actions import ActionsRepository
 from python_api.repositories.transactions import TransactionsRepository
 
 from python_api.settings import Settings
+from python_api.streams import (
+    StreamEntry,
+    consumer_name,
+    dead_letter,
+    reclaim_pending,
+    remove_idle_consumers,
+    trim_consumed,
+)
 from python_api.task_deps import async_conn
 
 settings = Settings()
@@ -12,65 +23,175 @@ settings = Settings()
 broker = RedisBroker(settings.redis_url)
 app = FastStream(broker=broker)
 
+CONSUMER = consumer_name(settings)
+# Consumers idle this long with nothing pending are removed from the group.
+CONSUMER_EXPIRY_MS = 60 * 60 * 1000
+
+# Every row a handler writes carries the ID of the stream entry it came from,
+# and inserts skip rows that already exist. A batch that is delivered again,
+# e.g. because the consumer died before acknowledging it, is then written
+# only once. Handlers commit before returning, and FastStream only
+# acknowledges a batch once its handler has returned.
+
+
+def _stream_sub(stream: str) -> StreamSub:
+    return StreamSub(
+        stream,
+        group=settings.stream_consumer_group,
+        consumer=CONSUMER,
+        batch=True,
+        max_records=settings.stream_batch_size,
+        # With a group, this is how long XREADGROUP blocks for new entries.
+        polling_interval=settings.stream_block_ms,
+    )
+
+
+def _entries(messages: list[dict[str, str]], message) -> list[StreamEntry]:
+    return [
+        (message_id.decode(), data)
+        for message_id, data in zip(message.raw_message["message_ids"], messages)
+    ]
+
+
+def _parse(entries: list[StreamEntry], parse):
+    """Parse each entry, returning the parsed entries and the malformed ones.
+
+    Retrying can't fix a malformed entry, so it goes straight to the
+    dead-letter stream instead of holding up the rest of its batch.
+    """
+    parsed, malformed = [], []
+    for stream_id, data in entries:
+        try:
+            parsed.append(parse(stream_id, data))
+        except (ValueError, TypeError, KeyError) as e:
+            malformed.append((stream_id, data, repr(e)))
 
-@broker.subscriber(stream=StreamSub("transactions", batch=True, polling_interval=1000))
-async def transactions_handler(messages: list[dict[str, str]]):
-    transactions = [json.loads(message["data"]) for message in messages]
+    return parsed, malformed
+
+
+async def _dead_letter(stream: str, failures: list[tuple[str, dict, str]]):
+    # Called after the batch commits, so a retried batch isn't dead-lettered
+    # twice.
+    redis = redis_client(settings)
+    for stream_id, data, error in failures:
+        await dead_letter(
+            redis,
+            stream,
+            stream_id,
+            data,
+            error,
+            max_length=settings.stream_max_length,
+        )
+
+
+async def ingest_transactions(entries: list[StreamEntry]):
+    transactions, failures = _parse(
+        entries,
+        lambda stream_id, data: {**json.loads(data["data"]), "stream_id": stream_id},
+    )
     async with async_conn() as conn:
-        repo = TransactionsRepository(conn)
-        for transaction in transactions:
-            await repo.insert_transaction(**transaction)
+        _, _, failed = await TransactionsRepository(conn).insert_transactions(
+            transactions
+        )
+        await conn.commit()
+
+    by_id = dict(entries)
+    for i, error in failed.items():
+        stream_id = transactions[i]["stream_id"]
+        failures.append((stream_id, by_id[stream_id], repr(error)))
+    await _dead_letter("transactions", failures)
 
 
-@broker.subscriber(stream=StreamSub("user-actions", batch=True, polling_interval=1000))
-async def user_actions_handler(messages: list[dict[str, str]]):
-    actions = [UserAction.model_validate_json(message["data"]) for message in messages]
+async def ingest_user_actions(entries: list[StreamEntry]):
+    actions, failures = _parse(
+        entries,
+        lambda stream_id, data: UserAction.model_validate_json(
+            data["data"]
+        ).model_copy(update={"stream_id": stream_id}),
+    )
     async with async_conn() as conn:
-        async with conn.cursor() as cur:
-            await cur.executemany(
-                """
-                INSERT INTO user_actions (action, user_id, info, occurred_at, stream_id)
-                VALUES (
-                    %(action)s,
-                    %(user_id)s,
-                    %(info)s,
-                    %(occurred_at)s,
-                    %(stream_id)s
-                )
-                """,
-                [action.model_dump(mode="json", by_alias=False) for action in actions],
-            )
-            await conn.commit()
+        await ActionsRepository(conn).insert_user_actions(actions)
+        await conn.commit()
 
+    await _dead_letter("user-actions", failures)
 
-@broker.subscriber(
-    stream=StreamSub("user-subscription-actions", batch=True, polling_interval=500)
-)
-async def user_subscription_actions_handler(messages: list[dict[str, str]]):
-    actions = [
-        UserSubscriptionAction.model_validate_json(message["data"])
-        for message in messages
-    ]
+
+async def ingest_user_subscription_actions(entries: list[StreamEntry]):
+    actions, failures = _parse(
+        entries,
+        lambda stream_id, data: UserSubscriptionAction.model_validate_json(
+            data["data"]
+        ).model_copy(update={"stream_id": stream_id}),
+    )
     async with async_conn() as conn:
-        async with conn.cursor() as cur:
-            action_dumps = [
-                action.model_dump(mode="json", by_alias=False) for action in actions
-            ]
-
-            for dump in action_dumps:
-                dump["info"] = json.dumps(dump["info"])
-
-            await cur.executemany(
-                """
-                INSERT INTO user_subscription_actions (action, user_id, info, occurred_at, stream_id)
-                VALUES (
-                    %(action)s,
-                    %(user_id)s,
-                    %(info)s,
-                    %(occurred_at)s,
-                    %(stream_id)s
+        await ActionsRepository(conn).insert_user_subscription_actions(actions)
+        await conn.commit()
+
+    await _dead_letter("user-subscription-actions", failures)
+
+
+INGESTERS = {
+    "transactions": ingest_transactions,
+    "user-actions": ingest_user_actions,
+    "user-subscription-actions": ingest_user_subscription_actions,
+}
+
+
+@broker.subscriber(stream=_stream_sub("transactions"))
+async def transactions_handler(messages: list[dict[str, str]], message=Context()):
+    await ingest_transactions(_entries(messages, message))
+
+
+@broker.subscriber(stream=_stream_sub("user-actions"))
+async def user_actions_handler(messages: list[dict[str, str]], message=Context()):
+    await ingest_user_actions(_entries(messages, message))
+
+
+@broker.subscriber(stream=_stream_sub("user-subscription-actions"))
+async def user_subscription_actions_handler(
+    messages: list[dict[str, str]], message=Context()
+):
+    await ingest_user_subscription_actions(_entries(messages, message))
+
+
+async def _maintain_streams():
+    """Reclaim abandoned entries and trim what the group has consumed."""
+    redis = redis_client(settings)
+    group = settings.stream_consumer_group
+    while True:
+        await asyncio.sleep(settings.stream_claim_interval)
+        for stream, ingest in INGESTERS.items():
+            try:
+                reclaimed = await reclaim_pending(
+                    redis,
+                    stream,
+                    group,
+                    CONSUMER,
+                    ingest,
+                    settings.stream_claim_idle_ms,
+                    settings.stream_batch_size,
+                    settings.stream_max_deliveries,
+                    settings.stream_max_length,
                 )
-                """,
-                action_dumps,
-            )
-            await conn.commit()
+                if reclaimed:
+                    print(f"Reclaimed {reclaimed} pending entries from {stream}")
+
+                await remove_idle_consumers(redis, stream, group, CONSUMER_EXPIRY_MS)
+                await trim_consumed(redis, stream, group)
+            except Exception as e:
+                print(f"Could not maintain {stream}:", e)
+
+
+_maintainer: asyncio.Task | None = None
+
+
+@app.after_startup
+async def start_maintainer():
+    global _maintainer
+    _maintainer = asyncio.create_task(_maintain_streams())
+
+
+@app.on_shutdown
+async def stop_maintainer():
+    if _maintainer is not None:
+        _maintainer.cancel()
@@ -0,0 +1,511 @@
+"""Consumer-group plumbing for the Redis streams `streaming_tasks` ingests.
+
+Every ingest process joins one consumer group per stream under its own
+consumer name, so Redis splits each stream between however many processes
+are running. An entry stays pending with the consumer that read it until
+that consumer acknowledges it. If the consumer dies first, `reclaim_pending`
+in one of the others claims the entry with XAUTOCLAIM once it has been idle
+for long enough and ingests it instead. Entries that keep failing end up in
+DEAD_LETTER_STREAM rather than blocking the rest.
+
+Producers cap each stream with an approximate MAXLEN as a last resort, and
+the ingest processes trim everything the group has acknowledged with
+`trim_consumed`. `StreamMonitor` follows how far the group is behind in each
+API worker. It exports that as metrics and tells `Tracking` when to hold
+back: while a stream's lag is over `stream_lag_threshold`, events on sampled
+streams are mostly dropped and events on the others are spooled in memory,
+then published once the consumers catch up.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from python_api import metrics
+from python_api.redis_pool import redis_client
+from python_api.settings import Settings
+
+# (stream entry ID, entry fields)
+StreamEntry = tuple[str, dict[str, str]]
+Ingest = Callable[[list[StreamEntry]], Awaitable[None]]
+
+# What producers do with a lagging stream's events. Actions are analytics and
+# may be sampled; subscription actions and transactions must not be lost.
+SAMPLE = "sample"
+SPOOL = "spool"
+STREAM_POLICIES = {
+    "user-actions": SAMPLE,
+    "user-subscription-actions": SPOOL,
+    "transactions": SPOOL,
+}
+
+# Entries that could not be ingested, with the error, for inspection and
+# replay through the admin API or the dead-letters CLI.
+DEAD_LETTER_STREAM = "stream-dead-letters"
+
+STREAM_LENGTH = metrics.Gauge(
+    "exchequer_stream_length",
+    "Entries held in each Redis stream.",
+)
+STREAM_LAG = metrics.Gauge(
+    "exchequer_stream_lag",
+    "Entries not yet delivered to the consumer group, by stream.",
+)
+STREAM_PENDING = metrics.Gauge(
+    "exchequer_stream_pending",
+    "Entries delivered to a consumer but not yet acknowledged, by stream.",
+)
+STREAM_SPOOLED = metrics.Gauge(
+    "exchequer_stream_spooled",
+    "Events this worker holds back until the stream's consumers catch up.",
+)
+STREAM_DEGRADED = metrics.Counter(
+    "exchequer_stream_degraded_events_total",
+    "Events sampled out, spooled or published despite lag, by stream.",
+)
+
+
+def consumer_name(settings: Settings) -> str:
+    return settings.stream_consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def reclaim_pending(
+    redis: Redis,
+    stream: str,
+    group: str,
+    consumer: str,
+    ingest: Ingest,
+    min_idle_ms: int,
+    count: int = 100,
+    max_deliveries: int = 5,
+    max_length: int | None = None,
+) -> int:
+    """Claim entries other consumers left pending, ingest and acknowledge them.
+
+    A batch that fails is retried entry by entry, so only the entries that
+    fail on their own stay pending. Every claim counts as a delivery, and an
+    entry still failing after `max_deliveries` is moved to the dead-letter
+    stream, capped at about `max_length` entries. Returns how many entries were
+    reclaimed.
+    """
+    reclaimed = 0
+    start_id = "0-0"
+    while True:
+        start_id, claimed, *_ = await redis.xautoclaim(
+            stream, group, consumer, min_idle_ms, start_id=start_id, count=count
+        )
+        entries = [
+            (_decode(entry_id), {_decode(k): _decode(v) for k, v in fields.items()})
+            for entry_id, fields in claimed
+            if fields
+        ]
+        # Entries trimmed from the stream while pending come back empty.
+        if trimmed := [entry_id for entry_id, fields in claimed if not fields]:
+            await redis.xack(stream, group, *trimmed)
+
+        if entries:
+            deliveries = await _delivery_counts(redis, stream, group, consumer, entries)
+            reclaimed += await _ingest_reclaimed(
+                redis,
+                stream,
+                group,
+                ingest,
+                entries,
+                deliveries,
+                max_deliveries,
+                max_length,
+            )
+
+        if _decode(start_id) == "0-0":
+            return reclaimed
+
+
+async def _delivery_counts(
+    redis: Redis, stream: str, group: str, consumer: str, entries: list[StreamEntry]
+) -> dict[str, int]:
+    pending = await redis.xpending_range(
+        stream,
+        group,
+        min=entries[0][0],
+        max=entries[-1][0],
+        count=len(entries),
+        consumername=consumer,
+    )
+    return {
+        _decode(entry["message_id"]): entry["times_delivered"] for entry in pending
+    }
+
+
+async def _ingest_reclaimed(
+    redis: Redis,
+    stream: str,
+    group: str,
+    ingest: Ingest,
+    entries: list[StreamEntry],
+    deliveries: dict[str, int],
+    max_deliveries: int,
+    max_length: int | None,
+) -> int:
+    # An entry gets `max_deliveries` attempts. XPENDING's count includes the
+    # delivery in hand.
+    def exhausted(attempts: int) -> bool:
+        return attempts >= max_deliveries
+
+    # Entries whose earlier attempts are used up, possibly by crashing a
+    # consumer, are not tried again.
+    retries = []
+    for entry_id, fields in entries:
+        if entry_id not in deliveries:
+            # Not pending for us any more: it was acknowledged, or another
+            # consumer claimed it, since XAUTOCLAIM. Ingesting it here would
+            # write it twice.
+            continue
+
+        delivered = deliveries[entry_id]
+        if exhausted(delivered - 1):
+            await dead_letter(
+                redis,
+                stream,
+                entry_id,
+                fields,
+                f"Not acknowledged after {max_deliveries} deliveries",
+                delivered,
+                max_length,
+            )
+            await redis.xack(stream, group, entry_id)
+        else:
+            retries.append((entry_id, fields))
+
+    if not retries:
+        return 0
+
+    try:
+        await ingest(retries)
+        await redis.xack(stream, group, *(entry_id for entry_id, _ in retries))
+        return len(retries)
+    except Exception as e:
+        print(f"Reclaimed batch from {stream} failed, retrying one by one:", e)
+
+    ingested = 0
+    for entry_id, fields in retries:
+        try:
+            await ingest([(entry_id, fields)])
+        except Exception as e:
+            delivered = deliveries[entry_id]
+            if not exhausted(delivered):
+                # Left pending, to be claimed and tried again.
+                continue
+            await dead_letter(
+                redis, stream, entry_id, fields, repr(e), delivered, max_length
+            )
+        else:
+            ingested += 1
+
+        await redis.xack(stream, group, entry_id)
+
+    return ingested
+
+
+async def remove_idle_consumers(
+    redis: Redis, stream: str, group: str, min_idle_ms: int
+) -> list[str]:
+    """Drop consumers with nothing pending that haven't read in a while.
+
+    Consumer names include the process ID, so every restart leaves one behind.
+    """
+    removed = []
+    for consumer in await redis.xinfo_consumers(stream, group):
+        name = _decode(consumer["name"])
+        if consumer["pending"] == 0 and consumer["idle"] >= min_idle_ms:
+            await redis.xgroup_delconsumer(stream, group, name)
+            removed.append(name)
+
+    return removed
+
+
+@dataclass
+class StreamProgress:
+    length: int
+    # Entries the group has yet to read. Estimated by the length when Redis
+    # can't tell, e.g. after entries were deleted.
+    lag: int
+    pending: int
+    last_delivered_id: str
+    oldest_pending_id: str | None
+
+
+async def group_progress(redis: Redis, stream: str, group: str) -> StreamProgress:
+    length = await redis.xlen(stream)
+    try:
+        groups = await redis.xinfo_groups(stream)
+    except ResponseError:
+        # No such stream yet.
+        groups = []
+
+    info = next((g for g in groups if _decode(g["name"]) == group), None)
+    if info is None:
+        return StreamProgress(length, length, 0, "0-0", None)
+
+    oldest_pending_id = None
+    if info["pending"]:
+        oldest_pending_id = _decode((await redis.xpending(stream, group))["min"])
+
+    lag = info.get("lag")
+    return StreamProgress(
+        length,
+        length if lag is None else lag,
+        info["pending"],
+        _decode(info["last-delivered-id"]),
+        oldest_pending_id,
+    )
+
+
+async def trim_consumed(redis: Redis, stream: str, group: str) -> int:
+    """Trim entries the group has read and acknowledged. Returns how many."""
+    progress = await group_progress(redis, stream, group)
+    min_id = progress.oldest_pending_id or progress.last_delivered_id
+    if min_id == "0-0":
+        return 0
+
+    # Approximate, so Redis only drops whole nodes, which is much cheaper.
+    return await redis.xtrim(stream, minid=min_id, approximate=True)
+
+
+class StreamMonitor:
+    def __init__(
+        self,
+        group: str,
+        lag_threshold: int,
+        sample_rate: float = 0.1,
+        spool_size: int = 10000,
+    ):
+        self.group = group
+        self.lag_threshold = lag_threshold
+        self.sample_rate = sample_rate
+        self.spool_size = spool_size
+
+        self.progress: dict[str, StreamProgress] = {}
+        # stream -> fields of the events held back
+        self.spools: dict[str, deque[dict]] = {}
+        self._task: asyncio.Task | None = None
+
+    def lagging(self, stream: str) -> bool:
+        progress = self.progress.get(stream)
+        return progress is not None and progress.lag > self.lag_threshold
+
+    def admit(self, stream: str, fields: dict) -> bool:
+        """Whether to publish an event now. Spools or drops it otherwise."""
+        if not self.lagging(stream):
+            return True
+
+        if STREAM_POLICIES.get(stream, SPOOL) == SAMPLE:
+            if random.random() < self.sample_rate:
+                return True
+            STREAM_DEGRADED.inc(stream=stream, action="sampled_out")
+            return False
+
+        spool = self.spools.setdefault(stream, deque())
+        if len(spool) >= self.spool_size:
+            # Nowhere left to hold it; MAXLEN still bounds the stream.
+            STREAM_DEGRADED.inc(stream=stream, action="overflowed")
+            return True
+
+        spool.append(fields)
+        STREAM_DEGRADED.inc(stream=stream, action="spooled")
+        return False
+
+    async def refresh(self, redis: Redis, max_length: int):
+        for stream in STREAM_POLICIES:
+            progress = await group_progress(redis, stream, self.group)
+            self.progress[stream] = progress
+            STREAM_LENGTH.set(progress.length, stream=stream)
+            STREAM_LAG.set(progress.lag, stream=stream)
+            STREAM_PENDING.set(progress.pending, stream=stream)
+
+            if self.spools.get(stream) and not self.lagging(stream):
+                await self.flush(redis, stream, max_length)
+
+        dead_letters = await redis.xlen(DEAD_LETTER_STREAM)
+        STREAM_LENGTH.set(dead_letters, stream=DEAD_LETTER_STREAM)
+
+    async def flush(self, redis: Redis, stream: str, max_length: int):
+        """Publish a stream's spooled events in one pipeline."""
+        spool = self.spools.get(stream)
+        if not spool:
+            return
+
+        # Taken out first, so events spooled meanwhile wait for the next flush.
+        events = list(spool)
+        spool.clear()
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for fields in events:
+                    pipe.xadd(stream, fields, maxlen=max_length, approximate=True)
+                await pipe.execute()
+        except BaseException:
+            spool.extendleft(reversed(events))
+            raise
+
+        print(f"Published {len(events)} spooled events to {stream}")
+
+    def start(self, settings: Settings):
+        loop = asyncio.get_running_loop()
+        task = self._task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._task = loop.create_task(self._run(settings))
+
+    async def stop(self, settings: Settings):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+        # Publish what's left rather than lose it with the worker.
+        for stream in list(self.spools):
+            try:
+                await self.flush(
+                    redis_client(settings), stream, settings.stream_max_length
+                )
+            except Exception as e:
+                print(f"Could not publish spooled events to {stream}:", e)
+
+    async def _run(self, settings: Settings):
+        while True:
+            try:
+                await self.refresh(redis_client(settings), settings.stream_max_length)
+            except Exception as e:
+                print("Could not refresh stream progress:", e)
+
+            await asyncio.sleep(settings.stream_monitor_interval)
+
+
+STREAM_MONITOR: StreamMonitor | None = None
+
+
+def stream_monitor(settings: Settings) -> StreamMonitor:
+    global STREAM_MONITOR
+    if STREAM_MONITOR is None:
+        STREAM_MONITOR = StreamMonitor(
+            settings.stream_consumer_group,
+            settings.stream_lag_threshold,
+            settings.stream_sample_rate,
+            settings.stream_spool_size,
+        )
+    return STREAM_MONITOR
+
+
+@metrics.on_collect
+def _collect_stream_metrics():
+    if STREAM_MONITOR is None:
+        return
+    for stream in STREAM_POLICIES:
+        spool = STREAM_MONITOR.spools.get(stream)
+        STREAM_SPOOLED.set(len(spool) if spool else 0, stream=stream)
+
+
+@dataclass
+class DeadLetter:
+    id: str
+    stream: str
+    entry_id: str
+    fields: dict[str, str]
+    error: str
+    deliveries: int
+    failed_at: int
+
+
+async def dead_letter(
+    redis: Redis,
+    stream: str,
+    entry_id: str,
+    fields: dict[str, str],
+    error: str,
+    deliveries: int = 1,
+    max_length: int | None = None,
+):
+    """Move a stream entry that can't be ingested to the dead-letter stream.
+
+    Like the other streams, it's capped at about `max_length` entries.
+    """
+    print(f"Dead-lettering {entry_id} from {stream}:", error)
+    await redis.xadd(
+        DEAD_LETTER_STREAM,
+        {
+            "stream": stream,
+            "entry_id": entry_id,
+            "fields": json.dumps(fields),
+            "error": error,
+            "deliveries": deliveries,
+            "failed_at": int(time.time()),
+        },
+        maxlen=max_length,
+        approximate=True,
+    )
+
+
+def _dead_letter(entry_id, fields) -> DeadLetter:
+    fields = {_decode(k): _decode(v) for k, v in fields.items()}
+    return DeadLetter(
+        id=_decode(entry_id),
+        stream=fields["stream"],
+        entry_id=fields["entry_id"],
+        fields=json.loads(fields["fields"]),
+        error=fields["error"],
+        deliveries=int(fields["deliveries"]),
+        failed_at=int(fields["failed_at"]),
+    )
+
+
+async def get_dead_letters(
+    redis: Redis, count: int = 100, after: str | None = None
+) -> list[DeadLetter]:
+    """Oldest first, starting after the dead letter with ID `after`."""
+    start = f"({after}" if after else "-"
+    entries = await redis.xrange(DEAD_LETTER_STREAM, min=start, count=count)
+    return [_dead_letter(entry_id, fields) for entry_id, fields in entries]
+
+
+async def get_dead_letter(redis: Redis, id: str) -> DeadLetter | None:
+    entries = await redis.xrange(DEAD_LETTER_STREAM, min=id, max=id)
+    return _dead_letter(*entries[0]) if entries else None
+
+
+async def replay_dead_letter(
+    redis: Redis, id: str, max_length: int | None = None
+) -> str | None:
+    """Publish a dead letter to its stream again, as a new entry.
+
+    Returns the new entry's ID, or None if there is no such dead letter.
+    """
+    letter = await get_dead_letter(redis, id)
+    if letter is None:
+        return None
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.xadd(
+            letter.stream, letter.fields, maxlen=max_length, approximate=True
+        )
+        pipe.xdel(DEAD_LETTER_STREAM, id)
+        entry_id, _ = await pipe.execute()
+
+    return _decode(entry_id)
+
+
+async def discard_dead_letter(redis: Redis, id: str) -> bool:
+    return bool(await redis.xdel(DEAD_LETTER_STREAM, id))
@@ -3,8 +3,7 @@ from contextlib import asynccontextmanager
 from psycopg.rows import dict_row
 from python_api.db_conn import AsyncConnection
 
-from redis.asyncio import Redis
-
+from python_api.redis_pool import redis_client
 from python_api.settings import Settings
 from python_api.repositories.automated_emails import AutomatedEmails
 
@@ -24,8 +23,7 @@ async def async_conn():
 
 
 async def redis_dep():
-    redis = Redis.from_url(settings.redis_url)
-    return redis
+    return redis_client(settings)
 
 
 async def automated_emails_dep(conn):
@@ -44,26 +44,25 @@ async def send_emails():
         mailer = await mailer_dep()
         email_gen = await email_generator_dep()
 
-        emails = await automated_email_repo.get_due_emails()
-
         start_time = datetime.now().timestamp()
         total_sent = 0
-        for email in emails:
-            if not email.id:
-                continue
+        async for emails in automated_email_repo.stream_due_emails():
+            for email in emails:
+                if not email.id:
+                    continue
 
-            subject, text, html = email_gen.generate_email(
-                email.subject,
-                email.template,
-                **email.variables if email.variables else {},
-            )
+                subject, text, html = email_gen.generate_email(
+                    email.subject,
+                    email.template,
+                    **email.variables if email.variables else {},
+                )
 
-            if email.user_email:
-                mailer.sendmail(email.user_email, subject, text, html)
+                if email.user_email:
+                    mailer.sendmail(email.user_email, subject, text, html)
 
-            await automated_email_repo.mark_sent(email.id)
+                await automated_email_repo.mark_sent(email.id)
 
-            total_sent += 1
+                total_sent += 1
 
         end_time = datetime.now().timestamp()
         emails_per_second = total_sent / (end_time - start_time)
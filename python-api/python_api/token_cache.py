@@ -0,0 +1,77 @@
+"""In-process cache of verified access tokens.
+
+Clients reuse the same access token for up to two hours, so most requests
+present a token this worker has already verified. Caching the verified
+payload by token digest skips the RS256 signature check on those requests.
+Entries expire with the token's own `exp` and the least recently used entry
+is evicted once the cache is full.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+
+from python_api.metrics import Counter, Gauge
+
+TOKEN_CACHE_LOOKUPS = Counter(
+    "exchequer_token_cache_lookups_total",
+    "Verified-token cache lookups, by result.",
+)
+TOKEN_CACHE_ENTRIES = Gauge(
+    "exchequer_token_cache_entries",
+    "Verified tokens currently cached in this worker.",
+)
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        # digest -> (kid, payload JSON, exp)
+        self._entries: OrderedDict[bytes, tuple[str, str, float]] = OrderedDict()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> tuple[str, str] | None:
+        """Return the (kid, payload JSON) of a cached, unexpired token."""
+        if not self.max_size:
+            return None
+
+        digest = self._digest(token)
+        entry = self._entries.get(digest)
+        if entry is None or entry[2] <= time.time():
+            if entry is not None:
+                del self._entries[digest]
+                TOKEN_CACHE_ENTRIES.set(len(self._entries))
+            TOKEN_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        self._entries.move_to_end(digest)
+        TOKEN_CACHE_LOOKUPS.inc(result="hit")
+        return entry[0], entry[1]
+
+    def put(self, token: str, kid: str, payload: str, exp: float):
+        if not self.max_size:
+            return
+
+        digest = self._digest(token)
+        self._entries[digest] = (kid, payload, exp)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        TOKEN_CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        TOKEN_CACHE_ENTRIES.set(0)
+
+
+TOKEN_CACHE: VerifiedTokenCache | None = None
+
+
+def token_cache(settings) -> VerifiedTokenCache:
+    global TOKEN_CACHE
+    if TOKEN_CACHE is None:
+        TOKEN_CACHE = VerifiedTokenCache(settings.jwt_cache_size)
+    return TOKEN_CACHE
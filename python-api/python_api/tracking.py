@@ -1,17 +1,72 @@
+"""Publishes tracked events to the Redis streams `streaming_tasks` ingests.
+
+The request-scoped `Tracking` from `dependencies.tracking` is buffered:
+events accumulate during the request and go out in one pipeline after the
+response has been sent. Events tracked with `critical=True` are published
+before the call returns, even while the stream's consumers are behind, for
+callers that need them in the stream before they respond. Transactions are
+critical by default.
+"""
+
 from redis.asyncio import Redis
 from datetime import datetime
 
 import json
 
 from python_api.models.actions import UserSubscriptionAction
+from python_api.settings import Settings
+from python_api.streams import stream_monitor
 
 
 class Tracking:
-    def __init__(self, redis: Redis, user_id: str | None):
+    def __init__(
+        self,
+        redis: Redis,
+        user_id: str | None,
+        settings: Settings,
+        buffered: bool = False,
+    ):
         self.redis = redis
         self.user_id = user_id
+        self.settings = settings
+        self.buffered = buffered
+
+        # (stream, fields) of the events waiting for flush()
+        self._buffer: list[tuple[str, dict]] = []
+
+    async def _publish(self, stream: str, fields: dict, critical: bool):
+        if not critical:
+            # Held back or sampled out while the stream's consumers are
+            # behind. Critical events never wait in memory, where a crash
+            # would lose them; MAXLEN still bounds the stream.
+            if not stream_monitor(self.settings).admit(stream, fields):
+                return
+
+            if self.buffered:
+                self._buffer.append((stream, fields))
+                return
+
+        await self.redis.xadd(
+            stream, fields, maxlen=self.settings.stream_max_length, approximate=True
+        )
+
+    async def flush(self):
+        """Publish the buffered events in one round trip."""
+        events, self._buffer = self._buffer, []
+        if not events:
+            return
 
-    async def track_subscription_action(self, action, info):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for stream, fields in events:
+                pipe.xadd(
+                    stream,
+                    fields,
+                    maxlen=self.settings.stream_max_length,
+                    approximate=True,
+                )
+            await pipe.execute()
+
+    async def track_subscription_action(self, action, info, critical: bool = False):
         if hasattr(info, "model_dump"):
             info = info.model_dump(by_alias=True, mode="json")
 
@@ -22,11 +77,13 @@ class Tracking:
             occurred_at=int(datetime.now().timestamp()),
         )
 
-        await self.redis.xadd(
+        await self._publish(
             "user-subscription-actions",
             {"data": action.model_dump_json(by_alias=True)},
+            critical,
         )
-        pass
 
-    async def track_transaction(self, transaction):
-        await self.redis.xadd("transactions", {"data": json.dumps(transaction)})
+    async def track_transaction(self, transaction, critical: bool = True):
+        await self._publish(
+            "transactions", {"data": json.dumps(transaction)}, critical
+        )
@@ -0,0 +1,218 @@
+"""Two-tier cache of the user status that auth checks read on every request.
+
+`users:{id}` in Redis holds the role and restriction state admins last wrote.
+`UserStatusCache` keeps parsed copies in process memory for a short TTL, so
+`valid_jwt`, `admin` and `editor` usually don't touch Redis at all. It also
+caches the `UserWithInfo` behind `get_current_user`, which otherwise costs
+several Postgres queries per request.
+
+Writes go through `UserStatusCache.set`, or `invalidate_everywhere` for the
+user info, which publish the user id on INVALIDATION_CHANNEL. Every worker
+listens on that channel and drops its copies, so a restriction or profile
+change shows on the next request. While a worker isn't subscribed, it can't
+hear invalidations and reads skip the memory tier.
+"""
+
+import asyncio
+import json
+import time
+import weakref
+from collections.abc import Awaitable, Callable
+
+from fastapi.encoders import jsonable_encoder
+from redis.asyncio import Redis
+
+from python_api import metrics
+from python_api.models.users import User, UserWithInfo
+from python_api.redis_pool import redis_client
+from python_api.settings import Settings
+
+INVALIDATION_CHANNEL = "users:invalidate"
+# Lifetime of the users:{id} keys in Redis.
+REDIS_TTL = 2 * 60 * 60
+
+USER_STATUS_LOOKUPS = metrics.Counter(
+    "exchequer_user_status_lookups_total",
+    "User status lookups, by the tier that answered.",
+)
+
+
+def _key(user_id: str) -> str:
+    return f"users:{user_id}"
+
+
+class UserStatusCache:
+    def __init__(
+        self,
+        redis: Redis,
+        ttl: float = 30.0,
+        max_size: int = 10000,
+        user_info_ttl: float = 0.0,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_size = max_size
+        self.user_info_ttl = user_info_ttl
+
+        # user id -> (user, time.monotonic() it expires)
+        self._entries: dict[str, tuple[User | None, float]] = {}
+        self._user_info: dict[str, tuple[UserWithInfo, float]] = {}
+        # In-flight user info loads, so a burst of requests shares one.
+        self._loading: dict[str, asyncio.Future] = {}
+        # Bumped on every invalidation, so a read that raced one isn't cached.
+        self._generation = 0
+        self._listening = False
+        self._listener: asyncio.Task | None = None
+
+    def _ensure_listener(self):
+        if not (self.ttl or self.user_info_ttl):
+            return
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "subscribe":
+                            # Anything cached before now may have missed a message.
+                            self.clear()
+                            self._listening = True
+                        elif message["type"] == "message":
+                            self.invalidate(message["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("User status invalidation listener failed:", e)
+            finally:
+                self._listening = False
+                self.clear()
+
+            await asyncio.sleep(1)
+
+    def invalidate(self, user_id: str):
+        self._generation += 1
+        self._entries.pop(user_id, None)
+        self._user_info.pop(user_id, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._user_info.clear()
+
+    async def invalidate_everywhere(self, user_id: str):
+        self.invalidate(user_id)
+        await self.redis.publish(INVALIDATION_CHANNEL, user_id)
+
+    def _store(self, entries: dict, user_id: str, value, ttl: float):
+        if len(entries) >= self.max_size:
+            entries.pop(next(iter(entries)))
+        entries[user_id] = (value, time.monotonic() + ttl)
+
+    async def get(self, user_id: str) -> User | None:
+        self._ensure_listener()
+
+        entry = self._entries.get(user_id)
+        if entry and self._listening and entry[1] > time.monotonic():
+            USER_STATUS_LOOKUPS.inc(tier="memory")
+            return entry[0]
+
+        generation = self._generation
+        raw = await self.redis.get(_key(user_id))
+        user = User(**json.loads(raw)) if raw else None
+        USER_STATUS_LOOKUPS.inc(tier="redis")
+
+        if self.ttl and self._listening and generation == self._generation:
+            self._store(self._entries, user_id, user, self.ttl)
+
+        return user
+
+    async def get_user_info(
+        self, user_id: str, load: Callable[[], Awaitable[UserWithInfo | None]]
+    ) -> UserWithInfo | None:
+        """Return the cached user info, or `load()` it.
+
+        Concurrent misses for the same user share a single `load()`. Callers
+        get their own copy, so they may modify it.
+        """
+        if not self.user_info_ttl:
+            return await load()
+        self._ensure_listener()
+
+        entry = self._user_info.get(user_id)
+        if entry and self._listening and entry[1] > time.monotonic():
+            USER_STATUS_LOOKUPS.inc(tier="user_info_memory")
+            return entry[0].model_copy(deep=True)
+
+        if (loading := self._loading.get(user_id)) is not None:
+            try:
+                user = await asyncio.shield(loading)
+                return user.model_copy(deep=True) if user else None
+            except asyncio.CancelledError:
+                if not loading.cancelled():
+                    raise
+                # The load we waited on failed; this request does its own.
+                return await load()
+
+        USER_STATUS_LOOKUPS.inc(tier="user_info_postgres")
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            user = await load()
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(user)
+        finally:
+            del self._loading[user_id]
+
+        if user and self._listening and generation == self._generation:
+            self._store(self._user_info, user_id, user, self.user_info_ttl)
+
+        return user.model_copy(deep=True) if user else None
+
+    async def set(self, user_id: str, user):
+        """Store the user's status in Redis and invalidate every worker's copy."""
+        await self.redis.setex(
+            _key(user_id), REDIS_TTL, json.dumps(jsonable_encoder(user))
+        )
+        await self.invalidate_everywhere(user_id)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+
+# One per event loop, like the Redis pool the cache reads through.
+_CACHES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, UserStatusCache]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def user_status_cache(settings: Settings) -> UserStatusCache:
+    loop = asyncio.get_running_loop()
+    cache = _CACHES.get(loop)
+    if cache is None:
+        cache = UserStatusCache(
+            redis_client(settings),
+            settings.user_status_cache_ttl,
+            user_info_ttl=settings.user_info_cache_ttl,
+        )
+        _CACHES[loop] = cache
+
+    return cache
+
+
+async def close_user_status_cache():
+    cache = _CACHES.pop(asyncio.get_running_loop(), None)
+    if cache is not None:
+        await cache.close()
@@ -1,11 +1,12 @@
 import json
 from typing import Any
 from datetime import datetime, timedelta, timezone
-from jwcrypto import common, jwk, jwt
+from jwcrypto import common, jwt
 
 from python_api.models.users import DbUser, UserWithInfo
+from python_api.signing_keys import ALGORITHM, key_manager
+from python_api.token_cache import token_cache
 
-ALGORITHM = "RS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
 
@@ -50,34 +51,29 @@ def create_access_token_from_user(
     )
 
 
-def load_key(settings):
-    key = jwk.JWK.from_pem(open(settings.jwt_signing_key, "rb").read())
-    key.update({"use": "sig", "alg": ALGORITHM})
-    return key
-
-
 def get_jwks(settings):
-    key = load_key(settings)
-    return {"keys": [key.export_public(as_dict=True)]}
-
-
-signing_key = None
+    return key_manager(settings).jwks
 
 
 def validate_token(token: str, settings):
-    global signing_key
-    if signing_key is None:
-        signing_key = load_key(settings)
+    keys = key_manager(settings)
+    cache = token_cache(settings)
 
-    valid_kids = [signing_key.key_id]
+    # A cached token still needs a known kid, so retired keys stop working.
+    if (cached := cache.get(token)) and keys.verification_key(cached[0]):
+        return json.loads(cached[1])
 
     jwt_token = jwt.JWT.from_jose_token(token)
-    if jwt_token.token.jose_header.get("kid") in valid_kids:
-        jwt_token.validate(signing_key)
-    else:
+    kid = jwt_token.token.jose_header.get("kid")
+    key = keys.verification_key(kid)
+    if key is None:
         raise common.JWException("Invalid kid in token")
 
+    jwt_token.validate(key)
+
     payload = json.loads(jwt_token.token.payload)
+    if isinstance(payload.get("exp"), (int, float)):
+        cache.put(token, kid, jwt_token.token.payload.decode(), payload["exp"])
     return payload
 
 
@@ -96,8 +92,7 @@ def create_access_token(
                 minutes=ACCESS_TOKEN_EXPIRE_MINUTES
             )
     to_encode.update({"exp": int(expire.timestamp())})
-    key = load_key(settings)
-    print(key.key_id)
+    key = key_manager(settings).signing_key
 
     token = jwt.JWT(header={"alg": ALGORITHM, "kid": key.key_id}, claims=to_encode)
     token.make_signed_token(key)
@@ -211,9 +211,8 @@ def redis(docker_ip, docker_services):
     return dsn
 
 
-@pytest.fixture(scope="session")
-def postgres(docker_ip, docker_services):
-    port = docker_services.port_for("test-postgres", 5432)
+def _migrated_postgres(docker_ip, docker_services, service):
+    port = docker_services.port_for(service, 5432)
     dsn = f"postgresql://postgres:password@{docker_ip}:{port}/exchequer"
     docker_services.wait_until_responsive(
         timeout=30.0, pause=0.1, check=lambda: is_postgres_responsive(dsn)
@@ -230,6 +229,17 @@ def postgres(docker_ip, docker_services):
     return dsn
 
 
+@pytest.fixture(scope="session")
+def postgres(docker_ip, docker_services):
+    return _migrated_postgres(docker_ip, docker_services, "test-postgres")
+
+
+# A second, independent server standing in for the read replica.
+@pytest.fixture(scope="session")
+def postgres_replica(docker_ip, docker_services):
+    return _migrated_postgres(docker_ip, docker_services, "test-postgres-replica")
+
+
 @pytest.fixture(scope="session")
 async def test_data(
     postgres,
@@ -245,14 +255,14 @@ async def test_data(
         email="test@exchequer.local",
         name="Test User",
         roles=[UserRole.ADMIN],
-        passwordHash=user_repo.get_password_hash("oldpassword"),
+        passwordHash=await user_repo.get_password_hash("oldpassword"),
     )
     await user_repo.insert_user(user)
     user2 = DbUser(
         email="test2@exchequer.local",
         name="Test2 User",
         roles=[UserRole.ADMIN],
-        passwordHash=user_repo.get_password_hash("oldpassword"),
+        passwordHash=await user_repo.get_password_hash("oldpassword"),
     )
     await user_repo.insert_user(user2)
     await conn.commit()
@@ -0,0 +1,88 @@
+import uuid
+
+import psycopg
+from psycopg.rows import dict_row
+
+from python_api.models.actions import UserAction, UserSubscriptionAction
+from python_api.repositories.actions import ActionsRepository
+
+
+def _stream_id():
+    return f"test-{uuid.uuid4()}"
+
+
+async def _count(conn, table, stream_ids):
+    async with conn.cursor() as cur:
+        await cur.execute(
+            f"SELECT count(*) AS n FROM {table} WHERE stream_id = ANY(%s)",
+            (stream_ids,),
+        )
+        return (await cur.fetchone())["n"]
+
+
+async def test_insert_user_actions(postgres, test_user):
+    actions = [
+        UserAction(
+            action="login",
+            user_id=str(test_user.id),
+            info={"ip": "127.0.0.1"},
+            occurred_at=1700000000,
+            stream_id=_stream_id(),
+        ),
+        UserAction(action="visit", occurred_at=1700000001, stream_id=_stream_id()),
+    ]
+
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row
+    ) as conn:
+        assert await ActionsRepository(conn).insert_user_actions(actions) == 2
+        await conn.commit()
+
+        stream_ids = [action.stream_id for action in actions]
+        assert await _count(conn, "user_actions", stream_ids) == 2
+
+
+async def test_copy_falls_back_on_duplicates(postgres, test_user):
+    duplicate = _stream_id()
+    actions = [
+        UserSubscriptionAction(
+            action="subscribe",
+            user_id=str(test_user.id),
+            occurred_at=1700000000,
+            stream_id=stream_id,
+        )
+        for stream_id in [duplicate, _stream_id(), duplicate]
+    ]
+
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row
+    ) as conn:
+        repo = ActionsRepository(conn)
+        assert await repo.insert_user_subscription_actions(actions) == 2
+        await conn.commit()
+
+        stream_ids = [action.stream_id for action in actions]
+        assert await _count(conn, "user_subscription_actions", stream_ids) == 2
+
+
+async def test_redelivered_batch_is_written_once(postgres, test_user):
+    actions = [
+        UserAction(
+            action="login",
+            user_id=str(test_user.id),
+            occurred_at=1700000000,
+            stream_id=_stream_id(),
+        )
+        for _ in range(3)
+    ]
+
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row
+    ) as conn:
+        repo = ActionsRepository(conn)
+        assert await repo.insert_user_actions(actions) == 3
+        assert await repo.insert_user_actions(actions) == 0
+        await conn.commit()
+
+        stream_ids = [action.stream_id for action in actions]
+        assert await _count(conn, "user_actions", stream_ids) == 3
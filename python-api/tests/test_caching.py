@@ -0,0 +1,91 @@
+import asyncio
+
+from python_api.caching import Cache, async_cache, cache
+from python_api.models import CamelModel
+
+
+class Item(CamelModel):
+    name: str
+
+
+class FrozenItem(CamelModel, frozen=True):
+    name: str
+
+
+def test_entries_expire_independently(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("python_api.caching.time.monotonic", lambda: now)
+    _cache = Cache("test_expiry", timeout=10)
+
+    _cache.get("a", lambda: 1)
+    now += 5
+    _cache.get("b", lambda: 2)
+    now += 6
+
+    assert _cache.get("a", lambda: 10) == 10
+    assert _cache.get("b", lambda: 20) == 2
+
+
+def test_lru_bound():
+    _cache = Cache("test_lru", max_size=2)
+    _cache.get("a", lambda: 1)
+    _cache.get("b", lambda: 2)
+    _cache.get("a", lambda: 0)
+    _cache.get("c", lambda: 3)
+
+    assert _cache.get("b", lambda: 0) == 0
+    assert _cache.stats()["evictions"] == 2
+
+
+def test_copies_unless_frozen():
+    calls = []
+
+    @cache(name="test_copies")
+    def items(frozen):
+        calls.append(frozen)
+        return [FrozenItem(name="a")] if frozen else [Item(name="a")]
+
+    first = items(False)
+    first[0].name = "changed"
+    assert items(False)[0].name == "a"
+    assert items(True)[0] is items(True)[0]
+    assert calls == [False, True]
+
+
+async def test_single_flight():
+    calls = 0
+
+    class Repo:
+        @async_cache("test_single_flight")
+        async def get(self, key):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return [Item(name=key)]
+
+    repo = Repo()
+    results = await asyncio.gather(*(repo.get("a") for _ in range(10)))
+
+    assert calls == 1
+    assert all(result[0].name == "a" for result in results)
+    assert Repo.get.cache.stats()["waits"] == 9
+
+
+async def test_failed_load_is_not_shared():
+    attempts = 0
+
+    async def load():
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0.01)
+        if attempts == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    _cache = Cache("test_failed_load")
+    results = await asyncio.gather(
+        _cache.aget("a", load), _cache.aget("a", load), return_exceptions=True
+    )
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == "ok"
@@ -0,0 +1,300 @@
+import asyncio
+import uuid
+
+import psycopg
+import pytest
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from python_api import dependencies
+from python_api.db.streaming import stream_rows
+from python_api.db.tracing import QUERY_TIME, SlowQueryLog
+from python_api.db_conn import LazyConnectionContextManagerAsync, replica_scope
+from python_api.settings import Settings
+
+
+async def _open_pool(dsn):
+    pool = AsyncConnectionPool(
+        dsn, kwargs={"row_factory": dict_row}, min_size=1, max_size=1, open=False
+    )
+    await pool.open()
+    return pool
+
+
+@pytest.fixture
+async def conn_pool(postgres):
+    pool = await _open_pool(postgres)
+    yield pool
+    await pool.close()
+
+
+@pytest.fixture
+async def replica_pool(postgres_replica):
+    pool = await _open_pool(postgres_replica)
+    yield pool
+    await pool.close()
+
+
+async def _system_identifier(db):
+    async with db.cursor() as cur:
+        await cur.execute("SELECT system_identifier FROM pg_control_system()")
+        return (await cur.fetchone())["system_identifier"]
+
+
+async def _current_user_id(db):
+    async with db.cursor() as cur:
+        await cur.execute(
+            "SELECT coalesce(current_setting('app.current_user_id', true), '')"
+            " AS user_id"
+        )
+        return (await cur.fetchone())["user_id"]
+
+
+async def test_rls_context_is_pipelined(conn_pool):
+    sub = str(uuid.uuid4())
+    async with LazyConnectionContextManagerAsync(conn_pool, {"sub": sub}) as db:
+        assert await _current_user_id(db) == sub
+        # BEGIN and set_config went out with the first statement.
+        assert db.round_trips_saved == 1
+
+    assert db.round_trips_saved == 1
+
+
+async def test_read_only_skips_commit(conn_pool):
+    sub = str(uuid.uuid4())
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, {"sub": sub}, read_only=True
+    ) as db:
+        assert await _current_user_id(db) == sub
+        assert await _current_user_id(db) == sub
+
+    # No BEGIN; the RESET on release costs what the skipped COMMIT saved.
+    assert db.round_trips_saved == 1
+
+
+async def test_anonymous_read_only_skips_begin_and_commit(conn_pool):
+    async with LazyConnectionContextManagerAsync(conn_pool, None, read_only=True) as db:
+        assert await _current_user_id(db) == ""
+
+    assert db.round_trips_saved == 2
+
+
+async def test_read_only_context_does_not_leak(conn_pool):
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, {"sub": str(uuid.uuid4())}, read_only=True
+    ) as db:
+        await _current_user_id(db)
+
+    async with LazyConnectionContextManagerAsync(conn_pool, None) as db:
+        assert await _current_user_id(db) == ""
+
+    # Nor into code that takes the pool directly.
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, {"sub": str(uuid.uuid4())}, read_only=True
+    ) as db:
+        await _current_user_id(db)
+
+    async with conn_pool.connection() as conn:
+        assert await _current_user_id(conn) == ""
+
+
+async def test_rollback_does_not_restore_a_stale_context(conn_pool):
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, {"sub": str(uuid.uuid4())}, read_only=True
+    ) as db:
+        await _current_user_id(db)
+
+    sub = str(uuid.uuid4())
+    async with LazyConnectionContextManagerAsync(conn_pool, {"sub": sub}) as db:
+        await _current_user_id(db)
+        await db.rollback()
+        # The context is sent again with the next transaction.
+        assert await _current_user_id(db) == sub
+
+
+async def test_broken_connections_go_back_to_the_pool(conn_pool):
+    with pytest.raises(psycopg.OperationalError):
+        async with LazyConnectionContextManagerAsync(conn_pool, None) as db:
+            await _current_user_id(db)
+            await db.conn.close()
+
+    # The pool's only slot was freed, and a working connection took it.
+    async with LazyConnectionContextManagerAsync(conn_pool, None) as db:
+        assert await _current_user_id(db) == ""
+
+
+async def test_statement_errors_raise_at_execute(conn_pool):
+    async with LazyConnectionContextManagerAsync(conn_pool, None) as db:
+        async with db.cursor() as cur:
+            with pytest.raises(psycopg.errors.UndefinedTable):
+                await cur.execute("SELECT * FROM no_such_table")
+        await db.rollback()
+
+
+async def test_replica_safe_reads_use_replica(conn_pool, replica_pool):
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, None, replica_pool=replica_pool
+    ) as db:
+        with replica_scope():
+            replica_id = await _system_identifier(db)
+
+        assert db.replica_conn is not None
+        assert db.conn is None
+
+        primary_id = await _system_identifier(db)
+        assert primary_id != replica_id
+
+
+async def test_replica_reads_your_writes(conn_pool, replica_pool):
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, None, replica_pool=replica_pool
+    ) as db:
+        primary_id = await _system_identifier(db)
+
+        # The primary may now hold uncommitted writes, so stay on it.
+        with replica_scope():
+            assert await _system_identifier(db) == primary_id
+
+        assert db.replica_conn is None
+
+
+async def test_read_only_request_keeps_using_replica(conn_pool, replica_pool):
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, None, read_only=True, replica_pool=replica_pool
+    ) as db:
+        primary_id = await _system_identifier(db)
+
+        with replica_scope():
+            assert await _system_identifier(db) != primary_id
+
+
+async def test_replica_scope_without_replica(conn_pool):
+    async with LazyConnectionContextManagerAsync(conn_pool, None) as db:
+        with replica_scope():
+            await _system_identifier(db)
+
+        assert db.conn is not None
+
+
+async def test_after_commit_sees_committed_writes(conn_pool, postgres_conn):
+    endpoint = f"/after-commit/{uuid.uuid4()}"
+    seen = []
+
+    async def callback():
+        async with postgres_conn.cursor() as cur:
+            await cur.execute(
+                "SELECT count(*) AS count FROM error_log WHERE endpoint = %s",
+                (endpoint,),
+            )
+            seen.append((await cur.fetchone())["count"])
+
+    async with LazyConnectionContextManagerAsync(conn_pool, None) as db:
+        async with db.cursor() as cur:
+            await cur.execute(
+                """
+                INSERT INTO error_log (severity, type, created_at, endpoint)
+                VALUES (30, 'test', now(), %s)
+                """,
+                (endpoint,),
+            )
+        db.after_commit(callback)
+        assert seen == []
+
+    assert seen == [1]
+
+
+async def test_slow_queries_are_logged(conn_pool, postgres_conn):
+    slow_queries = SlowQueryLog(conn_pool, threshold_ms=10, batch_size=100)
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, None, route="/test", slow_query_log=slow_queries
+    ) as db:
+        async with db.cursor() as cur:
+            await cur.execute("SELECT pg_sleep(0.05)")
+            await cur.execute("SELECT 1")
+
+    await slow_queries.flush()
+
+    async with postgres_conn.cursor() as cur:
+        await cur.execute(
+            "SELECT endpoint, details FROM error_log WHERE type = 'slow-query'"
+        )
+        rows = await cur.fetchall()
+
+    assert len(rows) == 1
+    assert rows[0]["endpoint"] == "/test"
+    assert rows[0]["details"]["query"] == "SELECT pg_sleep(0.05)"
+    assert rows[0]["details"]["op"] == "execute"
+
+
+@pytest.mark.parametrize("read_only", [False, True])
+async def test_stream_rows(conn_pool, read_only):
+    sub = str(uuid.uuid4())
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, {"sub": sub}, read_only=read_only
+    ) as db:
+        chunks = [
+            [row["n"] for row in rows]
+            async for rows in stream_rows(
+                db, "SELECT generate_series(1, 5) AS n", chunk_size=2
+            )
+        ]
+
+        assert chunks == [[1, 2], [3, 4], [5]]
+        assert await _current_user_id(db) == sub
+
+
+async def test_iteration_is_timed_and_queued_statements_are_not(conn_pool):
+    async with LazyConnectionContextManagerAsync(
+        conn_pool, None, route="/traced"
+    ) as db:
+        async with db.cursor() as cur:
+            await cur.execute("SELECT generate_series(1, 3)")
+            assert len([row async for row in cur]) == 3
+
+        async with db.pipeline():
+            async with db.cursor() as cur:
+                await cur.execute("SELECT 1")
+
+    ops = {
+        labels["op"]
+        for labels in map(dict, QUERY_TIME._counts)
+        if labels["route"] == "/traced"
+    }
+    assert ops == {"execute", "iterate"}
+
+
+async def test_slow_queries_flush_on_a_timer(conn_pool, postgres_conn, monkeypatch):
+    slow_queries = SlowQueryLog(conn_pool, threshold_ms=10, batch_size=100)
+    monkeypatch.setattr(dependencies, "SLOW_QUERY_LOG", slow_queries)
+    dependencies.start_slow_query_flusher(Settings(slow_query_flush_interval=0.05))
+    try:
+        async with LazyConnectionContextManagerAsync(
+            conn_pool, None, route="/timer", slow_query_log=slow_queries
+        ) as db:
+            async with db.cursor() as cur:
+                await cur.execute("SELECT pg_sleep(0.05)")
+
+        async with asyncio.timeout(5):
+            while True:
+                async with postgres_conn.cursor() as cur:
+                    await cur.execute(
+                        "SELECT count(*) AS count FROM error_log"
+                        " WHERE type = 'slow-query' AND endpoint = '/timer'"
+                    )
+                    if (await cur.fetchone())["count"]:
+                        break
+                await asyncio.sleep(0.05)
+    finally:
+        await dependencies.stop_slow_query_flusher()
+
+
+def test_pool_sizes_stay_within_the_budget():
+    settings = Settings(database_connection_budget=20, web_concurrency=4)
+    _, async_size = dependencies.pool_size(settings)
+    _, sync_size = dependencies.pool_size(settings, sync=True)
+    assert (async_size + sync_size) * 4 <= 20
+
+    with pytest.raises(ValueError):
+        dependencies.pool_size(
+            Settings(database_connection_budget=4, web_concurrency=4)
+        )
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from python_api.redis_pool import close_redis_pool, redis_client
+from python_api.settings import Settings
+from python_api.sso.jwks import JwksCache
+
+KEYS = [{"kty": "RSA", "kid": "test", "n": "AQAB", "e": "AQAB"}]
+
+
+@pytest.fixture
+def jwks_server():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            body = json.dumps({"keys": KEYS}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/keys", requests
+    server.shutdown()
+
+
+async def test_concurrent_gets_share_one_fetch(redis, jwks_server):
+    url, requests = jwks_server
+    settings = Settings(redis_url=redis, apple_jwks_url=url)
+    await redis_client(settings).delete("test_jwks:keys", "test_jwks:expiration")
+
+    cache = JwksCache("test_jwks", "apple_jwks_url", timedelta(hours=1))
+    try:
+        results = await asyncio.gather(*(cache.get(settings) for _ in range(20)))
+        assert all(keys == KEYS for keys in results)
+        assert len(requests) == 1
+    finally:
+        await cache.stop()
+        await close_redis_pool()
+
+
+async def test_workers_adopt_keys_from_redis(redis, jwks_server):
+    url, requests = jwks_server
+    settings = Settings(redis_url=redis, google_jwks_url=url)
+    await redis_client(settings).delete("test_jwks:keys", "test_jwks:expiration")
+
+    first = JwksCache("test_jwks", "google_jwks_url", timedelta(hours=1))
+    second = JwksCache("test_jwks", "google_jwks_url", timedelta(hours=1))
+    try:
+        assert await first.get(settings) == KEYS
+        assert await second.get(settings) == KEYS
+        assert second.expires_at == first.expires_at
+        assert len(requests) == 1
+    finally:
+        await first.stop()
+        await second.stop()
+        await close_redis_pool()
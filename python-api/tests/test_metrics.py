@@ -0,0 +1,37 @@
+import os
+
+from python_api import metrics
+
+WORKER = f'worker="{os.getpid()}"'
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram(
+        "test_wait_seconds", "Test histogram.", buckets=(0.1, 1.0)
+    )
+    histogram.observe(0.05, route="/users/me")
+    histogram.observe(2.0, route="/users/me")
+
+    text = metrics.render()
+
+    assert "# TYPE test_wait_seconds histogram" in text
+    labels = f'{WORKER},route="/users/me"'
+    assert f'test_wait_seconds_bucket{{{labels},le="0.1"}} 1.0' in text
+    assert f'test_wait_seconds_bucket{{{labels},le="+Inf"}} 2.0' in text
+    assert f"test_wait_seconds_count{{{labels}}} 2.0" in text
+
+
+def test_collectors_run_before_render():
+    gauge = metrics.Gauge("test_queue_depth", "Test gauge.")
+
+    @metrics.on_collect
+    def _collect():
+        gauge.set(3, queue="bcrypt")
+
+    text = metrics.render()
+    assert f'test_queue_depth{{{WORKER},queue="bcrypt"}} 3.0' in text
+
+
+def test_metrics_requires_token(test_client):
+    response = test_client.get("/metrics")
+    assert response.status_code == 404
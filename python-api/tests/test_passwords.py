@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+
+from python_api.passwords import PasswordHasher, PasswordHasherBusy
+
+
+async def test_hash_and_verify():
+    hasher = PasswordHasher(workers=1)
+    try:
+        password_hash = await hasher.hash("hunter2")
+        assert await hasher.verify("hunter2", password_hash)
+        assert not await hasher.verify("hunter3", password_hash)
+        assert not await hasher.verify("hunter2", "not a hash")
+    finally:
+        hasher.shutdown()
+
+
+async def test_hashing_does_not_block_the_event_loop():
+    hasher = PasswordHasher(workers=2)
+    gaps: list[float] = []
+
+    async def ticker(stop: asyncio.Event):
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    stop = asyncio.Event()
+    try:
+        ticking = asyncio.create_task(ticker(stop))
+        await asyncio.gather(*(hasher.hash("hunter2") for _ in range(4)))
+        assert hasher.pending == 0
+        stop.set()
+        await ticking
+    finally:
+        hasher.shutdown()
+
+    # Each hash takes hundreds of milliseconds; the loop kept ticking anyway.
+    assert max(gaps) < 0.1
+
+
+async def test_hashes_past_the_limit_are_refused():
+    hasher = PasswordHasher(workers=1, max_pending=2)
+    try:
+        running = [asyncio.create_task(hasher.hash("hunter2")) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert hasher.pending == 2
+
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash("hunter2")
+
+        await asyncio.gather(*running)
+        assert await hasher.hash("hunter2")
+    finally:
+        hasher.shutdown()
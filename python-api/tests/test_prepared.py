@@ -0,0 +1,62 @@
+import psycopg
+from psycopg.rows import dict_row
+
+from python_api.repositories.users import (
+    GET_USER,
+    GET_USER_BY_REFRESH_TOKEN,
+    GET_USER_SUBSCRIPTION,
+    refresh_token_digest,
+)
+
+
+async def _prepared_count(conn) -> int:
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT count(*) AS count FROM pg_prepared_statements")
+        return (await cur.fetchone())["count"]
+
+
+async def test_statement_is_prepared_on_first_run(postgres, test_user):
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row
+    ) as conn:
+        async with conn.cursor() as cur:
+            misses = GET_USER_SUBSCRIPTION.misses
+            await GET_USER_SUBSCRIPTION.execute(cur, {"user_id": test_user.id})
+            assert GET_USER_SUBSCRIPTION.misses == misses + 1
+            assert await _prepared_count(conn) == 1
+
+            hits = GET_USER_SUBSCRIPTION.hits
+            await GET_USER_SUBSCRIPTION.execute(cur, {"user_id": test_user.id})
+            assert GET_USER_SUBSCRIPTION.hits == hits + 1
+            assert await _prepared_count(conn) == 1
+
+
+async def test_nothing_is_prepared_without_a_threshold(postgres, test_user):
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row, prepare_threshold=None
+    ) as conn:
+        async with conn.cursor() as cur:
+            misses = GET_USER_SUBSCRIPTION.misses
+            for _ in range(2):
+                await GET_USER_SUBSCRIPTION.execute(cur, {"user_id": test_user.id})
+            assert GET_USER_SUBSCRIPTION.misses == misses + 2
+            assert await _prepared_count(conn) == 0
+
+
+async def test_prepared_statement_returns_rows(postgres, test_user):
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row
+    ) as conn:
+        async with conn.cursor() as cur:
+            for user_id in (test_user.id, str(test_user.id)):
+                await GET_USER.execute(cur, {"user_id": user_id})
+                user = await cur.fetchone()
+                assert user is not None
+                assert str(user["id"]) == str(test_user.id)
+                assert user["email"] == test_user.email
+
+            # bytea parameters bind too.
+            await GET_USER_BY_REFRESH_TOKEN.execute(
+                cur, {"digest": refresh_token_digest("no such token")}
+            )
+            assert await cur.fetchone() is None
@@ -0,0 +1,18 @@
+import asyncio
+
+from python_api.redis_pool import close_redis_pool, redis_client, redis_pool
+from python_api.settings import Settings
+
+
+async def test_clients_share_one_pool(redis):
+    settings = Settings(redis_url=redis, redis_max_connections=2)
+    first, second = redis_client(settings), redis_client(settings)
+    assert first.connection_pool is second.connection_pool
+
+    # More concurrent commands than connections wait for a free one.
+    await asyncio.gather(*(first.ping() for _ in range(10)))
+    assert len(redis_pool(settings)._in_use_connections) == 0
+
+    await close_redis_pool()
+    assert redis_pool(settings) is not first.connection_pool
+    await close_redis_pool()
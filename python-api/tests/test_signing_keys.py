@@ -0,0 +1,72 @@
+import os
+
+import pytest
+from jwcrypto import common, jwk
+
+from python_api.settings import Settings
+from python_api.signing_keys import KeyManager
+from python_api import signing_keys
+from python_api.utils import create_access_token, validate_token
+
+
+def _write_key(path):
+    key = jwk.JWK.generate(kty="RSA", size=2048)
+    path.write_bytes(key.export_to_pem(private_key=True, password=None))
+    return path
+
+
+@pytest.fixture
+def key_files(tmp_path):
+    return _write_key(tmp_path / "new.pem"), _write_key(tmp_path / "old.pem")
+
+
+@pytest.fixture
+def settings(key_files, monkeypatch):
+    new, old = key_files
+    settings = Settings(
+        jwt_signing_key=str(new),
+        jwt_verification_keys=[str(old)],
+        jwt_key_reload_interval=0,
+    )
+    monkeypatch.setattr(signing_keys, "KEY_MANAGER", None)
+    return settings
+
+
+def test_rotation_accepts_both_kids(settings, key_files):
+    new, old = key_files
+    old_manager = KeyManager(str(old))
+    manager = KeyManager.from_settings(settings)
+
+    assert {key["kid"] for key in manager.jwks["keys"]} == {
+        manager.signing_key.key_id,
+        old_manager.signing_key.key_id,
+    }
+    assert manager.verification_key(old_manager.signing_key.key_id) is not None
+    assert manager.verification_key("unknown") is None
+
+
+def test_tokens_round_trip(settings):
+    token = create_access_token(settings, {"sub": "user"})
+    assert validate_token(token, settings)["sub"] == "user"
+
+
+def test_reloads_changed_files(settings, key_files):
+    manager = KeyManager.from_settings(settings)
+    before = manager.signing_key.key_id
+
+    new, _ = key_files
+    _write_key(new)
+    os.utime(new, (0, 0))
+
+    assert manager.signing_key.key_id != before
+    assert manager.verification_key(before) is None
+
+
+def test_unknown_kid_is_rejected(settings, tmp_path):
+    other = KeyManager(str(_write_key(tmp_path / "other.pem")))
+    signing_keys.KEY_MANAGER = other
+    token = create_access_token(settings, {"sub": "user"})
+
+    signing_keys.KEY_MANAGER = None
+    with pytest.raises(common.JWException):
+        validate_token(token, settings)
@@ -0,0 +1,182 @@
+import uuid
+
+from redis.asyncio import Redis
+
+from python_api.streams import (
+    StreamMonitor,
+    _ingest_reclaimed,
+    StreamProgress,
+    dead_letter,
+    discard_dead_letter,
+    get_dead_letter,
+    get_dead_letters,
+    group_progress,
+    reclaim_pending,
+    remove_idle_consumers,
+    replay_dead_letter,
+)
+
+
+async def test_reclaim_entries_of_a_dead_consumer(redis):
+    client = Redis.from_url(redis)
+    stream, group = f"test-stream-{uuid.uuid4()}", "test-group"
+    await client.xgroup_create(stream, group, id="0", mkstream=True)
+
+    ids = [(await client.xadd(stream, {"data": str(i)})).decode() for i in range(3)]
+    # A consumer reads the entries, then dies without acknowledging them.
+    await client.xreadgroup(group, "dead", {stream: ">"}, count=10)
+
+    ingested = []
+
+    async def ingest(entries):
+        ingested.extend(entries)
+
+    # Not idle long enough yet.
+    assert await reclaim_pending(client, stream, group, "alive", ingest, 60000) == 0
+
+    assert await reclaim_pending(client, stream, group, "alive", ingest, 0, count=2) == 3
+    assert ingested == [(entry_id, {"data": str(i)}) for i, entry_id in enumerate(ids)]
+    assert (await client.xpending(stream, group))["pending"] == 0
+
+    removed = await remove_idle_consumers(client, stream, group, 0)
+    assert set(removed) == {"dead", "alive"}
+
+    await client.delete(stream)
+    await client.aclose()
+
+
+async def test_poison_entries_are_dead_lettered(redis):
+    client = Redis.from_url(redis)
+    stream, group = f"test-stream-{uuid.uuid4()}", "test-group"
+    await client.xgroup_create(stream, group, id="0", mkstream=True)
+
+    ids = [(await client.xadd(stream, {"data": data})).decode() for data in "abc"]
+    await client.xreadgroup(group, "dead", {stream: ">"}, count=10)
+
+    ingested = []
+
+    async def ingest(entries):
+        if any(fields["data"] == "b" for _, fields in entries):
+            raise ValueError("poison")
+        ingested.extend(entries)
+
+    # The good entries go through on their own, the poison one stays pending.
+    assert await reclaim_pending(client, stream, group, "alive", ingest, 0, 100, 3) == 2
+    assert [entry_id for entry_id, _ in ingested] == [ids[0], ids[2]]
+    assert (await client.xpending(stream, group))["pending"] == 1
+
+    # Its third delivery fails too, so it is dead-lettered and acknowledged.
+    assert await reclaim_pending(client, stream, group, "alive", ingest, 0, 100, 3) == 0
+    assert (await client.xpending(stream, group))["pending"] == 0
+
+    [letter] = [
+        letter
+        for letter in await get_dead_letters(client, count=10000)
+        if letter.stream == stream
+    ]
+    assert letter.entry_id == ids[1]
+    assert letter.fields == {"data": "b"}
+    assert letter.deliveries == 3
+    assert "poison" in letter.error
+
+    replayed = await replay_dead_letter(client, letter.id)
+    assert await get_dead_letter(client, letter.id) is None
+    [(entry_id, fields)] = await client.xrange(stream, min=replayed, max=replayed)
+    assert fields == {b"data": b"b"}
+
+    assert await replay_dead_letter(client, letter.id) is None
+    assert not await discard_dead_letter(client, letter.id)
+
+    await client.delete(stream)
+    await client.aclose()
+
+
+async def test_entries_missing_from_xpending_are_skipped(redis):
+    client = Redis.from_url(redis)
+    stream, group = f"test-stream-{uuid.uuid4()}", "test-group"
+    await client.xgroup_create(stream, group, id="0", mkstream=True)
+    entry_id = (await client.xadd(stream, {"data": "a"})).decode()
+    await client.xreadgroup(group, "dead", {stream: ">"}, count=10)
+
+    ingested = []
+
+    async def ingest(entries):
+        ingested.extend(entries)
+
+    # No pending record for the entry, e.g. acknowledged after it was claimed.
+    assert (
+        await _ingest_reclaimed(
+            client, stream, group, ingest, [(entry_id, {"data": "a"})], {}, 3, None
+        )
+        == 0
+    )
+    assert ingested == []
+
+    await client.delete(stream)
+    await client.aclose()
+
+
+async def test_discard_dead_letter(redis):
+    client = Redis.from_url(redis)
+    stream = f"test-stream-{uuid.uuid4()}"
+    await dead_letter(client, stream, "1-0", {"data": "x"}, "ValueError()")
+
+    [letter] = [
+        letter
+        for letter in await get_dead_letters(client, count=10000)
+        if letter.stream == stream
+    ]
+    assert await discard_dead_letter(client, letter.id)
+    assert await get_dead_letter(client, letter.id) is None
+
+    await client.aclose()
+
+
+async def test_group_progress(redis):
+    client = Redis.from_url(redis)
+    stream, group = f"test-stream-{uuid.uuid4()}", "test-group"
+    await client.xgroup_create(stream, group, id="0", mkstream=True)
+
+    ids = [(await client.xadd(stream, {"data": str(i)})).decode() for i in range(5)]
+    await client.xreadgroup(group, "consumer", {stream: ">"}, count=3)
+    await client.xack(stream, group, ids[0])
+
+    progress = await group_progress(client, stream, group)
+    assert progress.length == 5
+    assert progress.lag == 2
+    assert progress.pending == 2
+    assert progress.last_delivered_id == ids[2]
+    assert progress.oldest_pending_id == ids[1]
+
+    await client.delete(stream)
+    await client.aclose()
+
+
+async def test_lagging_streams_spool_until_flushed(redis):
+    client = Redis.from_url(redis)
+    stream = f"test-stream-{uuid.uuid4()}"
+    monitor = StreamMonitor("test-group", lag_threshold=10, spool_size=2)
+
+    assert monitor.admit(stream, {"data": "0"})
+
+    monitor.progress[stream] = StreamProgress(100, 100, 0, "0-0", None)
+    assert not monitor.admit(stream, {"data": "1"})
+    assert not monitor.admit(stream, {"data": "2"})
+    # The spool is full, so this one is published despite the lag.
+    assert monitor.admit(stream, {"data": "3"})
+
+    await monitor.flush(client, stream, max_length=1000)
+    entries = await client.xrange(stream)
+    assert [fields[b"data"] for _, fields in entries] == [b"1", b"2"]
+    assert not monitor.spools[stream]
+
+    await client.delete(stream)
+    await client.aclose()
+
+
+def test_lagging_sampled_streams_drop_events():
+    monitor = StreamMonitor("test-group", lag_threshold=10, sample_rate=0)
+    monitor.progress["user-actions"] = StreamProgress(100, 100, 0, "0-0", None)
+
+    assert not monitor.admit("user-actions", {"data": "0"})
+    assert not monitor.spools
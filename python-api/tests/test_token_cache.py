@@ -0,0 +1,51 @@
+import time
+
+import pytest
+from jwcrypto import jwk
+
+from python_api import signing_keys, token_cache
+from python_api.settings import Settings
+from python_api.token_cache import VerifiedTokenCache
+from python_api.utils import create_access_token, validate_token
+
+
+def test_lru_eviction():
+    cache = VerifiedTokenCache(max_size=2)
+    exp = time.time() + 60
+    cache.put("a", "kid", "{}", exp)
+    cache.put("b", "kid", "{}", exp)
+    assert cache.get("a")
+    cache.put("c", "kid", "{}", exp)
+
+    assert cache.get("a")
+    assert cache.get("b") is None
+    assert cache.get("c")
+
+
+def test_expired_tokens_are_not_served():
+    cache = VerifiedTokenCache()
+    cache.put("a", "kid", "{}", time.time() - 1)
+    assert cache.get("a") is None
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    path = tmp_path / "key.pem"
+    key = jwk.JWK.generate(kty="RSA", size=2048)
+    path.write_bytes(key.export_to_pem(private_key=True, password=None))
+
+    monkeypatch.setattr(signing_keys, "KEY_MANAGER", None)
+    monkeypatch.setattr(token_cache, "TOKEN_CACHE", None)
+    return Settings(jwt_signing_key=str(path))
+
+
+def test_validate_token_uses_cache(settings):
+    token = create_access_token(settings, {"sub": "user"})
+    assert validate_token(token, settings)["sub"] == "user"
+
+    cache = token_cache.token_cache(settings)
+    assert cache.get(token) is not None
+
+    payload = validate_token(token, settings)
+    payload["sub"] = "someone else"
+    assert validate_token(token, settings)["sub"] == "user"
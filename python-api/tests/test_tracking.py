@@ -0,0 +1,94 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
+
+from python_api.dependencies import TrackingDep, settings
+from python_api.settings import Settings
+from python_api.streams import StreamProgress, stream_monitor
+from python_api.tracking import Tracking
+
+
+async def test_buffered_events_are_published_on_flush(redis):
+    client = Redis.from_url(redis)
+    tracking = Tracking(client, None, Settings(redis_url=redis), buffered=True)
+    stream = "user-subscription-actions"
+    before = await client.xlen(stream)
+
+    await tracking.track_subscription_action("subscribe", {"plan": "pro"})
+    await tracking.track_subscription_action("renew", {"plan": "pro"})
+    assert await client.xlen(stream) == before
+
+    await tracking.track_subscription_action("cancel", None, critical=True)
+    assert await client.xlen(stream) == before + 1
+
+    await tracking.flush()
+    assert await client.xlen(stream) == before + 3
+    await tracking.flush()
+    assert await client.xlen(stream) == before + 3
+
+    await client.aclose()
+
+
+async def test_critical_events_skip_the_spool(redis):
+    client = Redis.from_url(redis)
+    settings = Settings(redis_url=redis)
+    stream = "transactions"
+    monitor = stream_monitor(settings)
+    monitor.progress[stream] = StreamProgress(
+        10**9, settings.stream_lag_threshold + 1, 0, "0-0", None
+    )
+    tracking = Tracking(client, None, settings, buffered=True)
+    before = await client.xlen(stream)
+    try:
+        await tracking.track_transaction({"transaction_id": "critical"})
+        assert await client.xlen(stream) == before + 1
+
+        await tracking.track_transaction({"transaction_id": "held"}, critical=False)
+        await tracking.flush()
+        assert await client.xlen(stream) == before + 1
+        assert len(monitor.spools[stream]) == 1
+    finally:
+        monitor.progress.pop(stream)
+        monitor.spools.pop(stream, None)
+        await client.aclose()
+
+
+def test_request_events_are_flushed_once(redis, monkeypatch):
+    # A route of its own, so the test doesn't depend on what the app tracks.
+    app = FastAPI()
+
+    @app.post("/track")
+    async def track(tracking: TrackingDep, fail: bool = False):
+        await tracking.track_subscription_action("subscribe", {"plan": "pro"})
+        await tracking.track_subscription_action("renew", {"plan": "pro"})
+        if fail:
+            raise ValueError("failed")
+
+    app.dependency_overrides[settings] = lambda: Settings(redis_url=redis)
+
+    flushed = []
+    flush = Tracking.flush
+
+    async def spy(self):
+        flushed.append([stream for stream, _ in self._buffer])
+        await flush(self)
+
+    monkeypatch.setattr(Tracking, "flush", spy)
+
+    stream = "user-subscription-actions"
+    client = SyncRedis.from_url(redis)
+    before = client.xlen(stream)
+
+    with TestClient(app, raise_server_exceptions=False) as test_client:
+        assert test_client.post("/track").status_code == 200
+        # One flush after the response, with both events in its pipeline.
+        assert flushed == [[stream, stream]]
+        assert client.xlen(stream) == before + 2
+
+        # Failed requests flush too, still only once.
+        assert test_client.post("/track", params={"fail": True}).status_code == 500
+        assert flushed == [[stream, stream], [stream, stream]]
+        assert client.xlen(stream) == before + 4
+
+    client.close()
@@ -0,0 +1,63 @@
+import uuid
+
+import psycopg
+from psycopg.rows import dict_row
+
+from python_api.db.bulk import insert_rows
+from python_api.repositories.transactions import transaction_rows
+
+TRANSACTION = {
+    "user_id": "00000000-0000-0000-0000-000000000000",
+    "source": "app_store",
+    "transaction_id": "1000",
+    "product_id": "pro",
+    "price": 60.0,
+    "tax_percentage": 0.1,
+    "commission_percentage": 0.15,
+    "takehome_percentage": 0.75,
+    "takehome_amount": 45.0,
+    "created_at": 1700000000,
+    "applied_at": 1700000000,
+    "duration": "six_month",
+}
+
+
+def test_transaction_rows_amortize():
+    main, *amortized = transaction_rows(**TRANSACTION)
+
+    assert main["applied_at"] is None
+    assert len(amortized) == 6
+    assert {row["amortized_transaction_id"] for row in amortized} == {main["id"]}
+    assert [row["transaction_id"] for row in amortized][:2] == ["1000.0", "1000.1"]
+    assert sum(row["price"] for row in amortized) == TRANSACTION["price"]
+
+
+def test_monthly_transactions_are_not_amortized():
+    rows = transaction_rows(**{**TRANSACTION, "duration": "monthly"})
+    assert len(rows) == 1
+    assert rows[0]["applied_at"] == TRANSACTION["applied_at"]
+
+
+async def test_insert_rows_skips_conflicts(postgres):
+    duplicate = f"test-{uuid.uuid4()}"
+    rows = [
+        ("visit", None, None, 1700000000, stream_id)
+        for stream_id in [duplicate, f"test-{uuid.uuid4()}", duplicate]
+    ]
+    columns = ("action", "user_id", "info", "occurred_at", "stream_id")
+
+    async with await psycopg.AsyncConnection.connect(
+        postgres, row_factory=dict_row
+    ) as conn:
+        assert await insert_rows(conn, "user_actions", columns, rows) == 2
+        await conn.commit()
+
+
+def test_stream_id_derives_row_ids():
+    first = transaction_rows(**TRANSACTION, stream_id="1700000000000-0")
+    again = transaction_rows(**TRANSACTION, stream_id="1700000000000-0")
+    other = transaction_rows(**TRANSACTION, stream_id="1700000000000-1")
+
+    assert [row["id"] for row in first] == [row["id"] for row in again]
+    assert first[0]["id"] != other[0]["id"]
+    assert len({row["id"] for row in first}) == len(first)
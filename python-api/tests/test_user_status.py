@@ -0,0 +1,66 @@
+import asyncio
+import uuid
+
+from redis.asyncio import Redis
+
+from python_api.models.users import User, UserWithInfo
+from python_api.user_status import UserStatusCache
+
+
+async def _wait_for(predicate, timeout=5.0):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+
+async def test_invalidation_reaches_other_workers(redis):
+    client = Redis.from_url(redis)
+    reader = UserStatusCache(client, ttl=60)
+    writer = UserStatusCache(client, ttl=60)
+
+    user_id = str(uuid.uuid4())
+    user = User(id=user_id, email="status@exchequer.local", name="Status")
+    await writer.set(user_id, user)
+
+    assert await reader.get(user_id) is not None
+    await _wait_for(lambda: reader._listening)
+    assert (await reader.get(user_id)).restricted is False
+    assert user_id in reader._entries
+
+    await writer.set(user_id, user.model_copy(update={"restricted": True}))
+    await _wait_for(lambda: user_id not in reader._entries)
+    assert (await reader.get(user_id)).restricted is True
+
+    await reader.close()
+    await writer.close()
+    await client.aclose()
+
+
+async def test_user_info_loads_are_shared(redis):
+    client = Redis.from_url(redis)
+    cache = UserStatusCache(client, ttl=60, user_info_ttl=60)
+    user_id = str(uuid.uuid4())
+    loads = 0
+
+    async def load():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.05)
+        return UserWithInfo(id=user_id, email="info@exchequer.local", name="Info")
+
+    await cache.get_user_info(user_id, load)
+    await _wait_for(lambda: cache._listening)
+
+    users = await asyncio.gather(*(cache.get_user_info(user_id, load) for _ in range(10)))
+    assert loads == 2
+    assert len({id(user) for user in users}) == 10
+
+    assert (await cache.get_user_info(user_id, load)).name == "Info"
+    assert loads == 2
+
+    await cache.invalidate_everywhere(user_id)
+    await cache.get_user_info(user_id, load)
+    assert loads == 3
+
+    await cache.close()
+    await client.aclose()
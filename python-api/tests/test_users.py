@@ -1,8 +1,11 @@
+import base64
+import json
 import uuid
 
 from fastapi.testclient import TestClient
 
 from python_api.models.users import DbUser
+from python_api.repositories.users import USER_COUNTS
 
 
 def test_get_users(test_client: TestClient, test_data):
@@ -11,6 +14,31 @@ def test_get_users(test_client: TestClient, test_data):
     assert len(response.json()["data"]) == 2
 
 
+def test_get_users_by_cursor(test_client: TestClient, test_data):
+    first = test_client.get("/admin/users", params={"limit": 1}).json()
+    assert len(first["data"]) == 1
+    assert first["total"] == 2
+
+    second = test_client.get(
+        "/admin/users", params={"limit": 1, "cursor": first["nextCursor"]}
+    ).json()
+    assert len(second["data"]) == 1
+    assert second["data"][0]["id"] != first["data"][0]["id"]
+
+    last = test_client.get(
+        "/admin/users",
+        params={"limit": 1, "cursor": second["nextCursor"], "exactCount": True},
+    ).json()
+    assert last["data"] == []
+    assert last["total"] == 2
+    assert last["nextCursor"] is None
+
+
+def test_get_users_invalid_cursor(test_client: TestClient, test_data):
+    response = test_client.get("/admin/users", params={"cursor": "nope"})
+    assert response.status_code == 400
+
+
 def test_get_user(test_client: TestClient, test_user: DbUser, test_data):
     response = test_client.get(f"/admin/users/{test_user.id}")
     assert response.status_code == 200
@@ -40,6 +68,16 @@ def test_update_user(test_client: TestClient, test_user: DbUser, test_data):
     assert response.json()["roles"] == ["user", "admin"]
 
 
+async def test_restrict_user_updates_status_after_commit(
+    test_client: TestClient, test_user: DbUser, test_data, redis_conn
+):
+    response = test_client.put(f"/admin/users/{test_user.id}/restrict")
+    assert response.status_code == 200
+
+    raw = await redis_conn.get(f"users:{test_user.id}")
+    assert json.loads(raw)["restricted"] is True
+
+
 async def test_password_reset(
     test_client: TestClient, test_user: DbUser, test_data, postgres_conn
 ):
@@ -114,3 +152,92 @@ def test_valid_jwt(test_client: TestClient, test_user: DbUser, test_data):
     )
 
     assert response.status_code == 200
+
+
+async def test_generate_email_verification_code(
+    user_repo, test_user: DbUser, test_data, postgres_conn
+):
+    await user_repo.generate_email_verification_code(str(test_user.id))
+    code = await user_repo.generate_email_verification_code(str(test_user.id))
+
+    async with postgres_conn.cursor() as cur:
+        await cur.execute(
+            "SELECT code FROM verification WHERE user_id = %s", (test_user.id,)
+        )
+        rows = await cur.fetchall()
+
+    assert [row["code"] for row in rows] == [code]
+
+
+async def test_stream_users(user_repo, test_data):
+    chunks = [users async for users in user_repo.stream_users(chunk_size=1)]
+
+    assert [len(users) for users in chunks] == [1, 1]
+    streamed = [user.id for users in chunks for user in users]
+    listed, _ = await user_repo.get_users()
+    assert streamed == [user.id for user in listed]
+
+
+async def test_lookup_refresh_token(user_repo, test_user: DbUser, test_data):
+    token = await user_repo.insert_new_refresh_token(str(test_user.id))
+
+    user, provider, last_used = await user_repo.lookup_refresh_token(
+        token.refresh_token
+    )
+    assert user.id == test_user.id
+    assert provider == "EXCHEQUER"
+    assert last_used == token.last_used
+
+    rotated = base64.b64encode(b"rotated").decode()
+    await user_repo.update_refresh_token_by_token(token.refresh_token, rotated)
+    assert await user_repo.lookup_refresh_token(token.refresh_token) is None
+    user, _, _ = await user_repo.lookup_refresh_token(rotated)
+    assert user.id == test_user.id
+
+
+async def test_refresh_token(
+    test_client: TestClient, user_repo, test_user: DbUser, test_data, postgres_conn
+):
+    token = await user_repo.insert_new_refresh_token(str(test_user.id))
+    await postgres_conn.execute(
+        "UPDATE user_tokens SET last_used = 0 WHERE id = %s", (token.id,)
+    )
+    await postgres_conn.commit()
+
+    # Not used recently: the token is marked used and handed back.
+    response = test_client.get(
+        "/users/me/token",
+        headers={"Authorization": f"Bearer {token.refresh_token}"},
+    )
+    assert response.status_code == 200
+    assert response.json()["refresh_token"] == token.refresh_token
+    assert response.json()["user"]["email"] == test_user.email
+
+    _, _, last_used = await user_repo.lookup_refresh_token(token.refresh_token)
+    assert last_used > 0
+
+    # Used just now: a new token is created instead.
+    response = test_client.get(
+        "/users/me/token",
+        headers={"Authorization": f"Bearer {token.refresh_token}"},
+    )
+    assert response.status_code == 200
+    new_token = response.json()["refresh_token"]
+    assert new_token != token.refresh_token
+    user, _, _ = await user_repo.lookup_refresh_token(new_token)
+    assert user.id == test_user.id
+
+    response = test_client.get(
+        "/users/me/token", headers={"Authorization": "Bearer not-a-token"}
+    )
+    assert response.status_code == 401
+
+
+async def test_user_counts_are_bounded(user_repo, test_data, monkeypatch):
+    monkeypatch.setattr(USER_COUNTS, "max_size", 2)
+    for search in ("a", "b", "c", "exchequer"):
+        await user_repo.count_users(search)
+    assert len(USER_COUNTS._entries) == 2
+
+    assert await user_repo.count_users("exchequer") >= 2
+    assert await user_repo.count_users("exchequer", exact=True) >= 2